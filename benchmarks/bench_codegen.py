@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""Code generation time as the number of functions grows.
+
+Usage: python3 benchmarks/bench_codegen.py [max_functions]
+
+With per-function buffers the time per function should stay flat; the
+old generator re-filtered the whole text section at every funcdef.
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from parser_lexer import Lexer, Parser
+from codegen import CodeGenerator
+
+FUNCTION_TEMPLATE = """funcdef %f{i}(a: int, b: int) -> int {{
+    $c: int = add $a, $b;
+    $d: int = mul $c, 3;
+    cmp $d, 10;
+    jl .small{i};
+    call %printf(fmt: bytes, $d: int);
+.small{i}:
+    ret int $c;
+}}
+"""
+
+
+def build_ast(functions):
+    source = 'datadef fmt: bytes = "%d\\n";\nextern %printf;\n'
+    source += ''.join(FUNCTION_TEMPLATE.format(i=i) for i in range(functions))
+    return Parser(Lexer(source).tokenize()).parse()
+
+
+def main():
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    sizes = [largest // 8, largest // 4, largest // 2, largest]
+    print(f'{"functions":>10} {"nodes":>8} {"seconds":>9} {"us/function":>12}')
+    for functions in sizes:
+        ast = build_ast(functions)
+        start = time.perf_counter()
+        CodeGenerator().generate(ast, io.StringIO())
+        elapsed = time.perf_counter() - start
+        print(f'{functions:>10} {len(ast):>8} {elapsed:>9.3f} {elapsed / functions * 1e6:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
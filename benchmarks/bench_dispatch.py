@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Per-node dispatch: visitor tables against the old if/elif and isinstance chains.
+
+Usage: python3 benchmarks/bench_dispatch.py [functions]
+
+Parses and generates code for a large synthetic program (see generator.py)
+with the Parser and CodeGenerator, and with copies of them that keep the
+chains they used before dispatch went through visitor.py.
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from parser_lexer import (Lexer, Parser, DataDefNode, ExternNode, FuncDefNode, CallNode, RetNode,
+                          VarDeclNode, BinOpNode, FuncCallAssignNode, StrDeclNode, LabelNode, CmpNode,
+                          JumpNode, StructDefNode, EnumDefNode, BssDefNode, ArrayGetNode,
+                          AddressOfNode, PointerDerefNode, ArrayAssignNode, PushNode, PopNode,
+                          UseRuntimeNode, GetNode)
+from codegen import CodeGenerator
+from generator import generate_program
+
+
+class LegacyParser(Parser):
+    """The Parser with its old per-token if/elif chain."""
+
+    def iter_parse(self):
+        for token in self.tokens:
+            node = self._parse_token(token)
+            if node is not None:
+                yield node
+            self.pos += 1
+
+    def _parse_token(self, token):
+        node = None
+        if token.type == 'LABEL':
+            node = LabelNode(token.value)
+        elif token.type == 'DATA_DEF':
+            node = DataDefNode(*token.value)
+        elif token.type == 'EXTERN':
+            node = ExternNode(token.value)
+        elif token.type == 'FUNCDEF':
+            node = FuncDefNode(*token.value)
+        elif token.type == 'CALL':
+            node = CallNode(*token.value)
+        elif token.type == 'RET':
+            node = RetNode(token.value[0], token.value[1])
+        elif token.type == 'GET':
+            name, var_type, target = token.value
+            node = GetNode(name, var_type, target)
+        elif token.type == 'VAR_DECL':
+            if len(token.value) == 3:
+                name, var_type, value = token.value
+                node = VarDeclNode(name, var_type, value)
+            else:
+                name, value = token.value
+                var_type = 'int' if isinstance(value, int) else 'bytes'
+                node = VarDeclNode(name, var_type, value)
+        elif token.type == 'ARRAY_ASSIGN':
+            node = ArrayAssignNode(*token.value)
+        elif token.type == 'POINTER_DEREF':
+            var_name, index = token.value
+            node = PointerDerefNode(var_name, index)
+        elif token.type == 'BIN_OP':
+            op, result_var, left, right = token.value
+            node = BinOpNode(op, result_var, left, right)
+        elif token.type == 'FUNC_CALL_ASSIGN':
+            node = FuncCallAssignNode(*token.value)
+        elif token.type == 'STR_DECL':
+            node = StrDeclNode(*token.value)
+        elif token.type == 'CMP':
+            node = CmpNode(*token.value)
+        elif token.type == 'JUMP':
+            node = JumpNode(*token.value)
+        elif token.type == 'STRUCT_DEF':
+            name, fields = token.value
+            node = StructDefNode(name, fields)
+        elif token.type == 'ENUM_DEF':
+            name, variants = token.value
+            node = EnumDefNode(name, variants)
+        elif token.type == 'ENUM_VALUE':
+            name, var_type, value = token.value
+            node = VarDeclNode(name, var_type, value)
+        elif token.type == 'BSS_DEF':
+            name, size = token.value
+            node = BssDefNode(name, size)
+        elif token.type == 'ARRAY_ACCESS':
+            node = ArrayGetNode(*token.value)
+        elif token.type == 'ADDRESS_OF':
+            var_name, var_type, target = token.value
+            node = AddressOfNode(var_name, var_type, target)
+        elif token.type == 'PUSH':
+            node = PushNode(token.value)
+        elif token.type == 'POP':
+            node = PopNode(*token.value)
+        elif token.type == 'USE_RUNTIME':
+            node = UseRuntimeNode()
+        return node
+
+
+class LegacyCodeGenerator(CodeGenerator):
+    """The CodeGenerator with its old per-node isinstance chain."""
+
+    def generate_nodes(self, ast):
+        for node in ast:
+            if isinstance(node, StructDefNode):
+                self.structs[node.name] = node.fields
+                self.layouts.define(node.name, node.fields)
+            elif isinstance(node, BssDefNode):
+                self._gen_bss_def(node)
+            elif isinstance(node, LabelNode):
+                self.text_section.append(f'.{node.name}:')
+            elif isinstance(node, DataDefNode):
+                self._gen_data_def(node)
+            elif isinstance(node, ExternNode):
+                self._gen_extern(node)
+            elif isinstance(node, FuncDefNode):
+                self._gen_func_def(node)
+            elif isinstance(node, CallNode):
+                self._gen_call(node)
+            elif isinstance(node, RetNode):
+                self._gen_ret(node)
+            elif isinstance(node, VarDeclNode):
+                self._gen_var_decl(node)
+            elif isinstance(node, AddressOfNode):
+                self._gen_var_decl(node)
+            elif isinstance(node, BinOpNode):
+                self._gen_bin_op(node)
+            elif isinstance(node, FuncCallAssignNode):
+                self._gen_func_call_assign(node)
+            elif isinstance(node, StrDeclNode):
+                self._gen_str_decl(node)
+            elif isinstance(node, CmpNode):
+                self._gen_cmp(node)
+            elif isinstance(node, JumpNode):
+                self._gen_jump(node)
+            elif isinstance(node, EnumDefNode):
+                self.enums[node.name] = {variant: i for i, variant in enumerate(node.variants)}
+            elif 'ArrayAssignNode' in str(type(node)):
+                self._gen_array_assign(node)
+            elif isinstance(node, ArrayAssignNode):
+                self._gen_array_assign(node)
+            elif isinstance(node, ArrayGetNode):
+                self._gen_array_get(node)
+            elif hasattr(node, 'var_name') and hasattr(node, 'target') and type(node).__name__ == 'GetNode':
+                self._gen_get(node)
+            elif isinstance(node, PushNode):
+                self._gen_push(node)
+            elif isinstance(node, PopNode):
+                self._gen_pop(node)
+            elif isinstance(node, UseRuntimeNode):
+                self.use_runtime = True
+                for func in self.runtime_funcs:
+                    self.externs.add(func)
+                    self.text_section.append(f'.extern {func}')
+
+
+def best_of(work, rounds=5):
+    best = None
+    result = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = work()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    tokens = Lexer(generate_program(functions)).tokenize()
+
+    legacy_ast, legacy_parse = best_of(lambda: LegacyParser(tokens).parse())
+    ast, parse = best_of(lambda: Parser(tokens).parse())
+    legacy_asm, legacy_gen = best_of(lambda: LegacyCodeGenerator().generate(legacy_ast))
+    asm, gen = best_of(lambda: CodeGenerator().generate(ast))
+    if asm != legacy_asm:
+        print('error: generated assembly differs')
+        return 1
+
+    print(f'{len(tokens)} tokens, {len(ast)} nodes')
+    print(f'{"":10} {"chain":>10} {"visitor":>10} {"speedup":>8}')
+    print(f'{"parse":10} {legacy_parse:>9.3f}s {parse:>9.3f}s {legacy_parse / parse:>7.2f}x')
+    print(f'{"codegen":10} {legacy_gen:>9.3f}s {gen:>9.3f}s {legacy_gen / gen:>7.2f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Lexer throughput: the table-driven Lexer against the old startswith cascade.
+
+Usage: python3 benchmarks/bench_lexer.py [repeat]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from parser_lexer import Lexer, Token
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples')
+
+
+class LegacyLexer(Lexer):
+    """The per-line cascade the Lexer used before it became table-driven.
+
+    Only kept here so the benchmark has something to compare against.
+    """
+
+    def tokenize(self):
+        tokens = []
+        in_struct = False
+        struct_lines = []
+        in_enum = False
+        enum_lines = []
+        for line in self.source:
+            line = line.strip()
+            if not line or line.startswith('//'):
+                continue
+            if line.strip() == 'use runtime;':
+                tokens.append(Token('USE_RUNTIME', None))
+                continue
+            if line.startswith('structdef'):
+                in_struct = True
+                struct_lines = [line]
+                continue
+            if in_struct:
+                struct_lines.append(line)
+                if '}' in line:
+                    tokens.append(self._match_structdef(' '.join(struct_lines)))
+                    in_struct = False
+                continue
+            if line.startswith('enumdef'):
+                in_enum = True
+                enum_lines = [line]
+                continue
+            if in_enum:
+                enum_lines.append(line)
+                if '}' in line:
+                    tokens.append(self._match_enumdef(' '.join(enum_lines)))
+                    in_enum = False
+                continue
+            if line.startswith('bssdef'):
+                tokens.append(self._match_bssdef(line))
+            if line.startswith('.'):
+                tokens.append(self._match_label(line))
+            elif line.startswith('datadef'):
+                tokens.append(self._match_datadef(line))
+            elif line.startswith('extern'):
+                tokens.append(self._match_extern(line))
+            elif line.startswith('funcdef'):
+                tokens.append(self._match_funcdef(line))
+            elif line.startswith('call'):
+                tokens.append(self._match_call(line))
+            elif line.startswith('ret'):
+                tokens.append(self._match_ret(line))
+            elif line.startswith('push'):
+                value = line.split(' ', 1)[1].rstrip(';')
+                tokens.append(Token('PUSH', value))
+            elif '= pop' in line:
+                match = re.match(r'\$(\w+):\s*(\w+)\s*=\s*pop;', line)
+                if match:
+                    tokens.append(Token('POP', (match.group(1), match.group(2))))
+            elif line.startswith('$'):
+                if re.match(r'^\$\w+\[', line):
+                    tokens.append(self._match_array_assign(line))
+                else:
+                    tokens.append(self._match_var_decl(line))
+            elif 'add' in line:
+                raise SyntaxError(f"Invalid statement: {line}")
+            elif line.startswith('cmp'):
+                tokens.append(self._match_cmp(line))
+            elif line.startswith('j'):
+                tokens.append(self._match_jump(line))
+        return tokens
+
+    def _match_var_decl(self, line):
+        # The old matcher assembled and looked up its pattern on every call
+        if re.search(r'=\s*get\s+\$?\w+\s*;', line):
+            re.match(r'\$(\w+)\*?:\s*([\w\[\]]+)\s*=\s*get\s+(\$?\w+)\s*;', line)
+        struct_init = r'(\w+)\s*{([^}]*)}'
+        enum_value = r'(\w+)::(\w+)'
+        pointer_access = r'(\$?\w+)<(\d+)>'
+        array_access = r'(\$?\w+)\[(\d+)\]'
+        pattern = (
+            r'\$(\w+)\*?:\s*([\w\[\]]+)\s*=\s*'
+            r'(?:call\s+%(\w+)\((.*)\)|'
+            f'{struct_init}|'
+            f'{enum_value}|'
+            r'array\s+((?:-?\d+\s*,\s*)*-?\d+)|'
+            f'{pointer_access}|'
+            f'{array_access}|'
+            r'&(\$?\w+)|'
+            r'"([^"]*)"|'
+            r'(\d+)|'
+            r'([a-z]+)\s+(\$?\w+),\s*(\$?\w+)'
+            r')\s*;'
+        )
+        re.match(pattern, line)
+        return super()._match_var_decl(line)
+
+    def _match_jump(self, line):
+        valid_jumps = ['jge', 'je', 'jg', 'jl', 'jne', 'jle', 'jmp']
+        re.match(r'(' + '|'.join(valid_jumps) + r')\s+\.(\w+);', line)
+        return super()._match_jump(line)
+
+
+def load_corpus(repeat):
+    sources = []
+    for name in sorted(os.listdir(EXAMPLES_DIR)):
+        if name.endswith('.scb'):
+            with open(os.path.join(EXAMPLES_DIR, name)) as f:
+                sources.append(f.read())
+    return '\n'.join(sources * repeat)
+
+
+def token_key(value):
+    """A comparable form of a token payload, including the nodes CALL carries."""
+    if isinstance(value, (list, tuple)):
+        return tuple(token_key(item) for item in value)
+    slots = getattr(type(value), '__slots__', None)
+    if slots is not None or hasattr(value, '__dict__'):
+        names = slots if slots is not None else vars(value)
+        return (type(value).__name__, tuple(sorted((n, token_key(getattr(value, n))) for n in names)))
+    return value
+
+
+def measure(lexer_class, source, rounds=3):
+    best = None
+    tokens = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        tokens = lexer_class(source).tokenize()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return tokens, best
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    source = load_corpus(repeat)
+    lines = source.count('\n') + 1
+
+    legacy_tokens, legacy_time = measure(LegacyLexer, source)
+    tokens, new_time = measure(Lexer, source)
+    if [(t.type, token_key(t.value)) for t in tokens] != \
+       [(t.type, token_key(t.value)) for t in legacy_tokens]:
+        print('error: token streams differ')
+        return 1
+
+    print(f'{lines} lines, {len(tokens)} tokens')
+    print(f'legacy lexer: {legacy_time:8.3f}s  {len(tokens) / legacy_time:12,.0f} tokens/s')
+    print(f'table lexer:  {new_time:8.3f}s  {len(tokens) / new_time:12,.0f} tokens/s')
+    print(f'speedup:      {legacy_time / new_time:8.2f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
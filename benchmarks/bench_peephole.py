@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Peephole optimizer: instructions removed, hits per rule, and unchanged behaviour.
+
+Usage: python3 benchmarks/bench_peephole.py [functions]
+
+Compiles the examples and a generated program (see generator.py) with and
+without -fpeephole. When gcc is available every program is also built and
+run both ways, and the outputs must match.
+"""
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from scbc import SCBCompiler
+from stats import CompileStats
+from generator import generate_program
+
+EXAMPLES_DIR = os.path.join(HERE, '..', 'examples')
+
+
+def compile_counted(source, passes):
+    stats = CompileStats()
+    asm = SCBCompiler(stats=stats, passes=passes).compile(source)
+    stats.close()
+    return asm, stats.counters
+
+
+def run(asm, workdir, name):
+    """Assemble, link and run ``asm``; returns its output and exit status.
+
+    Both builds of a program share a name, since some print argv[0].
+    Printed addresses change from run to run, so they are masked.
+    """
+    asm_file = os.path.join(workdir, name + '.s')
+    exe_file = os.path.join(workdir, name)
+    with open(asm_file, 'w') as f:
+        f.write(asm)
+    subprocess.run(['gcc', '-no-pie', '-o', exe_file, asm_file], check=True, capture_output=True)
+    result = subprocess.run(['./' + name], cwd=workdir, capture_output=True, timeout=10,
+                            stdin=subprocess.DEVNULL)
+    return re.sub(rb'0x[0-9a-f]+', b'0x?', result.stdout), result.returncode
+
+
+def main():
+    functions = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    programs = {}
+    for path in sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.scb'))):
+        with open(path) as f:
+            source = f.read()
+        # Programs using the runtime need it linked in; compile them only
+        programs[os.path.basename(path)[:-4]] = source
+    programs['generated'] = generate_program(functions)
+
+    can_run = shutil.which('gcc') is not None and sys.platform.startswith('linux')
+    workdir = tempfile.mkdtemp(prefix='scbc-peephole-')
+    total_hits = Counter()
+    failures = 0
+    print(f'{"program":<14} {"before":>8} {"after":>8} {"saved":>7} {"runs":>6}')
+    try:
+        for name, source in programs.items():
+            plain, plain_counts = compile_counted(source, ())
+            optimized, counts = compile_counted(source, ('peephole',))
+            total_hits.update({rule: hits for rule, hits in counts.items() if rule.startswith('peephole.')})
+            before, after = plain_counts['instructions'], counts['instructions']
+            status = '-'
+            if can_run and 'use runtime' not in source:
+                same = run(plain, workdir, name) == run(optimized, workdir, name)
+                status = 'same' if same else 'DIFF'
+                failures += not same
+            print(f'{name:<14} {before:>8} {after:>8} {1 - after / before:>7.1%} {status:>6}')
+    finally:
+        shutil.rmtree(workdir)
+
+    print()
+    for rule, hits in total_hits.most_common():
+        print(f'{rule:<36} {hits:>8}')
+    if failures:
+        print(f'error: {failures} programs behave differently with -fpeephole')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
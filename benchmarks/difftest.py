@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Differential test of the optimization levels.
+
+Usage: python3 benchmarks/difftest.py [programs] [seed]
+
+Generates small random programs built around loops, in which variables
+are declared again (by a literal, ``get``, ``pop`` or a call) and read on
+the next iteration, and values are pushed below the pop that takes them,
+reached by a backward jump. Each one is compiled at -O0, -O1 and -O2,
+built and run, and the outputs must match. Needs gcc on Linux.
+"""
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from scbc import SCBCompiler
+from passes import select_passes
+
+LEVELS = (1, 2)
+VARIABLES = ['a', 'b', 'c', 'd']
+
+PRELUDE = """datadef fmt: bytes = "%ld\\n";
+extern %printf;
+
+funcdef %twice(x: int) -> int {
+    $y: int = add $x, $x;
+    ret int $y;
+}
+
+"""
+
+
+def _statement(rng, labels, fresh=True):
+    """Lines of one random statement; ``fresh`` allows the ones that give
+    their variable a new slot (later code in the source reads that slot)."""
+    target = '$' + rng.choice(VARIABLES)
+    source = '$' + rng.choice(VARIABLES)
+    kind = rng.randrange(8) if fresh else rng.choice([3, 5])
+    if kind == 0:
+        return [f'    {target}: int = {rng.randrange(100)};']
+    if kind == 1 and source != target:
+        # $x: int = get $x; would read the new, unset slot
+        return [f'    {target}: int = get {source};']
+    if kind == 2:
+        return [f'    push {source};', f'    {target}: int = pop;']
+    if kind == 3:
+        return [f'    {target}: int = call %twice({source}: int);']
+    if kind == 4:
+        label = f'skip{next(labels)}'
+        return [f'    cmp {source}, {rng.randrange(100)};', f'    {rng.choice(["jl", "jg", "je"])} .{label};',
+                *_statement(rng, labels, fresh=False), f'.{label}:']
+    if kind == 6 and source != target:
+        # The pop comes before its push in the source, reached by a backward
+        # jump; pushing the popped variable would read its new, unset slot
+        label = next(labels)
+        return [f'    jmp .push{label};', f'.pop{label}:', f'    {target}: int = pop;', f'    jmp .skip{label};',
+                f'.push{label}:', f'    push {source};', f'    jmp .pop{label};', f'.skip{label}:']
+    op = rng.choice(['add', 'sub', 'mul'])
+    right = rng.choice(['$' + rng.choice(VARIABLES), str(rng.randrange(10))])
+    return [f'    {target}: int = {op} {source}, {right};']
+
+
+def generate(rng):
+    """The source of one random program."""
+    labels = iter(range(1000))
+    lines = ['funcdef %main() -> int {']
+    lines += [f'    ${name}: int = {rng.randrange(100)};' for name in VARIABLES]
+    for loop in range(rng.randint(1, 3)):
+        lines += [f'    $i{loop}: int = 0;', f'.loop{loop}:']
+        for _ in range(rng.randint(2, 6)):
+            lines += _statement(rng, labels)
+        lines += [f'    $i{loop}: int = add $i{loop}, 1;', f'    cmp $i{loop}, {rng.randint(1, 5)};',
+                  f'    jl .loop{loop};']
+    lines += [f'    call %printf(fmt: bytes, ${name}: int);' for name in VARIABLES]
+    lines += ['    ret int 0;', '}']
+    return PRELUDE + '\n'.join(lines) + '\n'
+
+
+def run(asm, workdir):
+    """Assemble, link and run ``asm``; returns its output and exit status."""
+    asm_file = os.path.join(workdir, 'prog.s')
+    exe_file = os.path.join(workdir, 'prog')
+    with open(asm_file, 'w') as f:
+        f.write(asm)
+    subprocess.run(['gcc', '-no-pie', '-o', exe_file, asm_file], check=True, capture_output=True)
+    result = subprocess.run([exe_file], capture_output=True, timeout=10, stdin=subprocess.DEVNULL)
+    return result.stdout, result.returncode
+
+
+def main():
+    programs = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    if shutil.which('gcc') is None or not sys.platform.startswith('linux'):
+        print('error: needs gcc on Linux')
+        return 1
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix='scbc-difftest-')
+    failures = 0
+    try:
+        for number in range(programs):
+            source = generate(rng)
+            expected = run(SCBCompiler().compile(source), workdir)
+            for level in LEVELS:
+                asm = SCBCompiler(passes=select_passes(level, [], [])).compile(source)
+                if run(asm, workdir) != expected:
+                    failures += 1
+                    print(f'program {number} (seed {seed}) differs at -O{level}:')
+                    print(source)
+                    break
+    finally:
+        shutil.rmtree(workdir)
+    print(f'{programs} programs, {failures} differ')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Synthetic SCB program generator for the compiler benchmarks.
+
+Usage: python3 benchmarks/generator.py FUNCTIONS [SEED] > big.scb
+
+Every construct the lexer understands shows up: datadef, bssdef, extern,
+structdef, enumdef, array literals/stores/loads, strings, address-of and
+pointer dereference, get, push/pop (including push arithmetic), all the
+binary operators, cmp with each conditional jump, labels, calls and
+call assignments. The programs are valid and terminate, so they can be
+built and run as well as compiled.
+"""
+import random
+import sys
+
+PRELUDE = """datadef fmt: bytes = "%ld\\n";
+datadef fmt2: bytes = "%ld %ld\\n";
+datadef fmt_s: bytes = "%s\\n";
+bssdef scratch: bytesbuff = 64;
+
+extern %printf;
+
+structdef Point {
+    $x: int;
+    $y: int;
+}
+
+enumdef Color {
+    RED,
+    GREEN,
+    BLUE,
+}
+"""
+
+LEAF = """
+funcdef %leaf{i}(a: int, b: int) -> int {{
+    $c: int = add $a, $b;
+    $d: int = mul $c, {mul};
+    $e: int = sub $d, $a;
+    $divisor: int = {div};
+    $f: int = div $e, $divisor;
+    $g: int = shl $f, 1;
+    $h: int = shr $g, 1;
+    ret int $h;
+}}
+"""
+
+WORKER = """
+funcdef %work{i}(n: int) -> int {{
+    $i: int = 0;
+    $acc: int = {seed};
+    $arr: int[4] = array 1, 2, 3, {last};
+    $arr[1] = $n;
+    $p: Point = Point {{ $x: {x}, $y: {y} }};
+    $color: Color = Color::{color};
+    $msg: bytes = "work{i}";
+    $ptr*: bytes = &msg;
+    jmp .loop{i};
+.loop{i}:
+    $acc: int = call %leaf{i}($acc: int, $i: int);
+    push $acc;
+    push add $i, 1;
+    $t: int = pop;
+    $u: int = pop;
+    $acc: int = add $u, 0;
+    $i: int = add $t, 0;
+    $copy: int = get $i;
+    cmp $copy, $n;
+    jl .loop{i};
+    cmp $acc, 0;
+    jge .positive{i};
+    $acc: int = sub 0, $acc;
+.positive{i}:
+    cmp $acc, {big};
+    jle .small{i};
+    $seven: int = 7;
+    $acc: int = div $acc, $seven;
+.small{i}:
+    cmp $color, 9;
+    je .done{i};
+    cmp $acc, $acc;
+    jne .done{i};
+    cmp $i, 0;
+    jg .done{i};
+.done{i}:
+    call %printf(fmt2: bytes, $arr[1]: int, $p->$y: int);
+    ret int $acc;
+}}
+"""
+
+MAIN_HEAD = """
+funcdef %main() -> int {
+    $total: int = 0;
+    $n: int = 8;
+    $banner: bytes = "synthetic";
+    $bptr*: bytes = &banner;
+    call %printf(fmt_s, $bptr<0>);
+"""
+
+MAIN_CALL = """    $r{i}: int = call %work{i}($n: int);
+    $total: int = add $total, $r{i};
+"""
+
+MAIN_TAIL = """    call %printf(fmt: bytes, $total: int);
+    ret int 0;
+}
+"""
+
+
+def generate_program(functions, seed=0):
+    """Return the source of a program with ``functions`` worker/leaf pairs."""
+    rng = random.Random(seed)
+    parts = [PRELUDE]
+    for i in range(functions):
+        parts.append(LEAF.format(i=i, mul=rng.randint(2, 9), div=rng.randint(2, 9)))
+        parts.append(WORKER.format(
+            i=i,
+            seed=rng.randint(0, 50),
+            last=rng.randint(4, 99),
+            x=rng.randint(0, 9),
+            y=rng.randint(0, 9),
+            color=rng.choice(['RED', 'GREEN', 'BLUE']),
+            big=rng.randint(1000, 100000),
+        ))
+    parts.append(MAIN_HEAD)
+    parts.extend(MAIN_CALL.format(i=i) for i in range(functions))
+    parts.append(MAIN_TAIL)
+    return ''.join(parts)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    sys.stdout.write(generate_program(count, seed))
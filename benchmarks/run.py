@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Compiler throughput benchmark: lex, parse and codegen on synthetic programs.
+
+Usage:
+    python3 benchmarks/run.py                  # compare with baseline.json
+    python3 benchmarks/run.py --save-baseline  # record a new baseline
+    python3 benchmarks/run.py --sizes 100 1000 --tolerance 0.25
+
+Timings and memory are taken in separate runs, because tracemalloc slows
+down every allocation. Exits with status 1 when a stage is slower, or
+uses more memory, than the baseline by more than the tolerance.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+from parser_lexer import Lexer, Parser
+from codegen import CodeGenerator
+from generator import generate_program
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+DEFAULT_SIZES = [100, 1000]
+
+
+def _stages(source):
+    # Each stage takes the previous stage's output: (name, work, unit count)
+    state = {}
+
+    def lex():
+        state['tokens'] = Lexer(source).tokenize()
+
+    def parse():
+        state['ast'] = Parser(state['tokens']).parse()
+
+    def codegen():
+        CodeGenerator().generate(state['ast'], io.StringIO())
+
+    return state, [('lex', lex), ('parse', parse), ('codegen', codegen)]
+
+
+def measure(source, rounds):
+    lines = source.count('\n') + 1
+    best = {}
+    for _ in range(rounds):
+        state, stages = _stages(source)
+        for name, work in stages:
+            start = time.perf_counter()
+            work()
+            elapsed = time.perf_counter() - start
+            best[name] = min(best.get(name, elapsed), elapsed)
+
+    units = {'lex': lines, 'parse': len(state['tokens']), 'codegen': len(state['ast'])}
+    peaks = {}
+    state, stages = _stages(source)
+    tracemalloc.start()
+    for name, work in stages:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        work()
+        peaks[name] = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+
+    return {
+        name: {
+            'seconds': best[name],
+            'per_second': units[name] / best[name],
+            'peak_bytes': peaks[name],
+        }
+        for name in best
+    }
+
+
+UNIT_NAMES = {'lex': 'lines', 'parse': 'tokens', 'codegen': 'nodes'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SCB compiler throughput benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Worker functions per generated program')
+    parser.add_argument('--rounds', type=int, default=5, help='Timing runs per size (best is kept)')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed slowdown or memory growth against the baseline')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        source = generate_program(size)
+        results[str(size)] = measure(source, args.rounds)
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = 0
+    print(f"{'size':>6} {'stage':<8} {'throughput':>18} {'peak KiB':>10} {'vs baseline':>20}")
+    for size, stages in results.items():
+        for name, result in stages.items():
+            line = (f"{size:>6} {name:<8} {result['per_second']:>11,.0f} {UNIT_NAMES[name]:<6}"
+                    f" {result['peak_bytes'] / 1024:>10.1f}")
+            old = baseline.get(size, {}).get(name)
+            if old:
+                speed = result['per_second'] / old['per_second']
+                memory = result['peak_bytes'] / max(old['peak_bytes'], 1)
+                line += f"   {speed:>5.2f}x speed {memory:>5.2f}x mem"
+                if speed < 1 - args.tolerance or memory > 1 + args.tolerance:
+                    line += '  REGRESSION'
+                    regressions += 1
+            print(line)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f"baseline written to {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""Bounds-check elimination.
+
+With ``--bounds-check``, codegen checks every array index held in a
+variable and traps when it is out of range. This pass proves indexes in
+range and adds their accesses to CodeGenerator.safe_indexes, which
+codegen does not check.
+
+It tracks an interval of possible values for each local through the
+function's blocks. Constants set it, ``add``/``sub`` move it, and the
+edges out of a block ending with ``cmp`` and a conditional jump narrow it:
+after ``cmp $i, 10; jl .loop``, i is at most 9 on the jump and at least
+10 on the fall-through. Loops are widened until nothing changes, first
+to the constants the function compares against and then to infinity, and
+then narrowed again, so that in
+
+    $i: int = 0;
+.loop:
+    $x: int = $arr[$i];
+    $i: int = add $i, 1;
+    cmp $i, 10;
+    jl .loop;
+
+i is known to be in 0..9. Variables whose address is taken, and values
+from anything else (calls, pops, pointers, multiplications...), are
+unbounded.
+"""
+from math import inf
+
+from ir import VarRefs
+from parser_lexer import (ArrayAccessNode, ArrayAssignNode, ArrayGetNode, AssignNode, BinOpNode,
+                          CallNode, CmpNode, FuncCallAssignNode, GetNode, JumpNode, TailCallNode,
+                          VarDeclNode)
+
+TOP = (-inf, inf)
+INT64 = (-2 ** 63, 2 ** 63 - 1)
+WIDEN_AFTER = 2  # Updates of a loop head before its intervals are widened
+NARROW_ROUNDS = 2
+
+_NEGATED = {'jl': 'jge', 'jge': 'jl', 'jle': 'jg', 'jg': 'jle', 'je': 'jne', 'jne': 'je'}
+
+
+def _int(operand):
+    if isinstance(operand, int):
+        return operand
+    if isinstance(operand, str) and operand.lstrip('-').isdigit():
+        return int(operand)
+    return None
+
+
+def _clamp(lo, hi):
+    # Arithmetic wraps around at 64 bits: past that, anything is possible
+    if lo < INT64[0] or hi > INT64[1]:
+        return TOP
+    return lo, hi
+
+
+def _join(states):
+    """The hull of the intervals of the ``states`` that are reachable (not None)."""
+    states = [state for state in states if state is not None]
+    if not states:
+        return None
+    joined = dict(states[0])
+    for state in states[1:]:
+        for name in list(joined):
+            if name not in state:
+                del joined[name]
+            else:
+                (lo1, hi1), (lo2, hi2) = joined[name], state[name]
+                joined[name] = (min(lo1, lo2), max(hi1, hi2))
+    return joined
+
+
+def _widen(old, new, thresholds):
+    """``new``, with every bound that moved since ``old`` pushed out to the next of ``thresholds``.
+
+    ``thresholds`` is sorted; past its ends, bounds go to infinity.
+    """
+    widened = {}
+    for name, (lo, hi) in new.items():
+        if name in old:
+            old_lo, old_hi = old[name]
+            if lo < old_lo:
+                lo = max((t for t in thresholds if t <= lo), default=-inf)
+            if hi > old_hi:
+                hi = min((t for t in thresholds if t >= hi), default=inf)
+            widened[name] = (lo, hi)
+    return widened
+
+
+class _Intervals:
+    """Interval transfer functions over the nodes of one function."""
+
+    def __init__(self, func):
+        self.refs = VarRefs(dict(func.structs))
+        for node in func.nodes():
+            self.refs.visit(node)
+        self.pinned = self.refs.pinned
+        self.structs = self.refs.structs
+        # Widening stops at the bounds the function compares against, so a
+        # counted loop keeps its limit instead of growing to infinity
+        constants = set()
+        for node in func.nodes():
+            if type(node) is CmpNode:
+                for operand in (node.left, node.right):
+                    value = _int(operand)
+                    if value is not None:
+                        constants.update((value - 1, value, value + 1))
+        self.thresholds = sorted(constants)
+
+    def interval(self, state, operand):
+        value = _int(operand)
+        if value is not None:
+            return value, value
+        if isinstance(operand, str) and operand.startswith('$'):
+            return state.get(operand[1:], TOP)
+        return TOP
+
+    def _set(self, state, name, interval):
+        if interval == TOP or name in self.pinned:
+            state.pop(name, None)
+        else:
+            state[name] = interval
+
+    def transfer(self, state, node):
+        """Update ``state`` to after ``node``."""
+        cls = type(node)
+        if cls is VarDeclNode and isinstance(node.value, int) and node.type not in self.structs:
+            self._set(state, node.name, (node.value, node.value))
+        elif cls is AssignNode:
+            self._set(state, node.name, (node.value, node.value))
+        elif cls is GetNode:
+            self._set(state, node.var_name, self.interval(state, '$' + node.target.lstrip('$')))
+        elif cls is BinOpNode and node.op in ('add', 'sub'):
+            (lo1, hi1), (lo2, hi2) = self.interval(state, node.left_var), self.interval(state, node.right_var)
+            if node.op == 'add':
+                result = _clamp(lo1 + lo2, hi1 + hi2)
+            else:
+                result = _clamp(lo1 - hi2, hi1 - lo2)
+            self._set(state, node.result_var, result)
+        else:
+            for name in self.refs.visit(node)[0]:
+                state.pop(name, None)
+
+    def refine(self, state, cmp, condition):
+        """``state`` where ``cmp left, right`` and then ``condition`` jumps; None if it never does."""
+        (l_lo, l_hi), (r_lo, r_hi) = self.interval(state, cmp.left), self.interval(state, cmp.right)
+        if condition == 'jl':
+            l_hi, r_lo = min(l_hi, r_hi - 1), max(r_lo, l_lo + 1)
+        elif condition == 'jle':
+            l_hi, r_lo = min(l_hi, r_hi), max(r_lo, l_lo)
+        elif condition == 'jg':
+            l_lo, r_hi = max(l_lo, r_lo + 1), min(r_hi, l_hi - 1)
+        elif condition == 'jge':
+            l_lo, r_hi = max(l_lo, r_lo), min(r_hi, l_hi)
+        elif condition == 'je':
+            l_lo = r_lo = max(l_lo, r_lo)
+            l_hi = r_hi = min(l_hi, r_hi)
+        if l_lo > l_hi or r_lo > r_hi:
+            return None
+        state = dict(state)
+        for operand, interval in ((cmp.left, (l_lo, l_hi)), (cmp.right, (r_lo, r_hi))):
+            if isinstance(operand, str) and operand.startswith('$'):
+                self._set(state, operand[1:], interval)
+        return state
+
+
+def _edge_state(intervals, blocks, block, succ, out):
+    """The state on the edge from ``block`` to ``succ``, given the state ``out`` at its end."""
+    if out is None:
+        return None
+    term = block.terminator()
+    if type(term) is not JumpNode or term.condition == 'jmp' or len(block.nodes) < 2 \
+            or type(block.nodes[-2]) is not CmpNode or term.condition not in _NEGATED:
+        return out
+    taken = succ.label == term.label
+    falls = block.index + 1 < len(blocks) and succ is blocks[block.index + 1]
+    if taken and falls:
+        return out
+    return intervals.refine(out, block.nodes[-2], term.condition if taken else _NEGATED[term.condition])
+
+
+def _block_states(func, intervals):
+    """The state on entry to each block, None for blocks never reached."""
+    blocks = func.blocks
+    heads = {head.index for head, _ in func.back_edges()}
+    state_in = [None] * len(blocks)
+    state_out = [None] * len(blocks)
+    updates = [0] * len(blocks)
+
+    def compute_in(block):
+        edges = [_edge_state(intervals, blocks, pred, block, state_out[pred.index]) for pred in block.preds]
+        if block.index == 0:
+            edges.append({})
+        return _join(edges)
+
+    def compute_out(block):
+        state = dict(state_in[block.index])
+        for node in block.nodes:
+            intervals.transfer(state, node)
+        state_out[block.index] = state
+
+    changed = True
+    while changed:
+        changed = False
+        for block in blocks:
+            new = compute_in(block)
+            old = state_in[block.index]
+            if new is None:
+                continue
+            if old is not None:
+                new = _join([old, new])
+                if block.index in heads and updates[block.index] >= WIDEN_AFTER:
+                    new = _widen(old, new, intervals.thresholds)
+            if new == old:
+                continue
+            state_in[block.index] = new
+            updates[block.index] += 1
+            compute_out(block)
+            changed = True
+    # Narrow: recompute without widening, which keeps the result sound
+    for _ in range(NARROW_ROUNDS):
+        for block in blocks:
+            if state_in[block.index] is None:
+                continue
+            state_in[block.index] = compute_in(block)
+            if state_in[block.index] is None:
+                state_out[block.index] = None  # No edge into it can be taken after all
+            else:
+                compute_out(block)
+    return state_in
+
+
+def _accesses(node):
+    """(access node, array name, index) of each array access ``node`` makes."""
+    if type(node) is ArrayGetNode:
+        return [(node, node.array, node.index)]
+    if type(node) is ArrayAssignNode:
+        return [(node, node.var_name, node.index)]
+    if type(node) is TailCallNode:
+        node = node.call
+    if type(node) in (CallNode, FuncCallAssignNode):
+        return [(arg, arg.var_name.lstrip('$'), arg.index) for arg in node.args
+                if isinstance(arg, ArrayAccessNode)]
+    return []
+
+
+def elide_bounds_checks(func, codegen, counts, options):
+    """Add the accesses of an ir.Function whose index is known to be in range to codegen.safe_indexes."""
+    if not codegen.bounds_checks:
+        return
+    lengths = {}
+    accesses = False
+    for node in func.nodes():
+        if type(node) is VarDeclNode and isinstance(node.type, str) and node.type.endswith(']'):
+            length = int(node.type[node.type.index('[') + 1:-1])
+            lengths[node.name] = min(length, lengths.get(node.name, length))
+        accesses = accesses or bool(_accesses(node))
+    if not accesses:
+        return
+    intervals = _Intervals(func)
+    for block, state in zip(func.blocks, _block_states(func, intervals)):
+        if state is None:
+            continue
+        state = dict(state)
+        for node in block.nodes:
+            for access, array, index in _accesses(node):
+                if not isinstance(index, str) or array not in lengths:
+                    continue
+                lo, hi = intervals.interval(state, index)
+                if 0 <= lo and hi < lengths[array]:
+                    codegen.safe_indexes.add(id(access))
+                    counts['elided'] += 1
+                else:
+                    counts['kept'] += 1
+            intervals.transfer(state, node)
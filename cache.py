@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024  # bytes
+# Entries used this recently are never evicted: another scbc run may have
+# just looked one up and be about to assemble or link it
+IN_USE_SECONDS = 60
+
+
+def default_cache_dir():
+    if os.environ.get('SCBC_CACHE_DIR'):
+        return os.environ['SCBC_CACHE_DIR']
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'scbc')
+
+
+def compiler_version(version, modules):
+    """Identify the compiler build: its version plus a hash of its own sources.
+
+    Editing the compiler without bumping the version must not serve stale
+    output. Frozen builds have no .py files next to the modules, so those
+    fall back to the version string alone.
+    """
+    digest = hashlib.sha256(version.encode())
+    for module in modules:
+        try:
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        except (AttributeError, OSError):
+            pass
+    return digest.hexdigest()
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class CacheEntry:
+    def __init__(self, path):
+        self.path = path
+        self.asm_path = os.path.join(path, 'out.s')
+        self.object_path = os.path.join(path, 'out.o')
+        self.meta_path = os.path.join(path, 'meta.json')
+        with open(self.meta_path) as f:
+            self.meta = json.load(f)
+
+    @property
+    def has_object(self):
+        return os.path.exists(self.object_path)
+
+
+class CompileCache:
+    """Content-addressed store for generated assembly and assembled objects.
+
+    Entries live in ``objects/<key[:2]>/<key>/`` and hold ``out.s``, the
+    optional ``out.o`` and ``meta.json``. Every file is written to a temp
+    name and renamed into place, so concurrent scbc runs never see half an
+    entry. A hit refreshes the entry's mtime; once the cache grows past
+    ``max_size`` the least recently used entries are removed, except the
+    one being stored and those used in the last IN_USE_SECONDS.
+    """
+
+    def __init__(self, root=None, max_size=DEFAULT_MAX_SIZE):
+        self.root = root or default_cache_dir()
+        self.max_size = max_size
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.stats_path = os.path.join(self.root, 'stats.json')
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    @staticmethod
+    def key(source_path, target, version, flags):
+        digest = hashlib.sha256()
+        with open(source_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        digest.update(b'\0' + target.encode())
+        digest.update(b'\0' + version.encode())
+        for flag in flags:
+            digest.update(b'\0' + flag.encode())
+        return digest.hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.objects_dir, key[:2], key)
+
+    def lookup(self, key):
+        path = self._entry_dir(key)
+        try:
+            entry = CacheEntry(path)
+        except (OSError, ValueError):
+            self._count('misses')
+            return None
+        os.utime(entry.meta_path)
+        self._count('hits')
+        return entry
+
+    def store_asm(self, key, asm_file, meta):
+        path = self._entry_dir(key)
+        os.makedirs(path, exist_ok=True)
+        with open(asm_file, 'rb') as f:
+            _write_atomic(os.path.join(path, 'out.s'), f.read())
+        # meta.json goes last: an entry only counts once it exists
+        _write_atomic(os.path.join(path, 'meta.json'), json.dumps(meta).encode())
+        entry = CacheEntry(path)
+        self.evict(keep=path)
+        return entry
+
+    def object_temp_path(self, entry):
+        """A private path to assemble into before store_object() publishes it."""
+        fd, tmp = tempfile.mkstemp(dir=entry.path, prefix='.tmp-', suffix='.o')
+        os.close(fd)
+        return tmp
+
+    def store_object(self, entry, tmp_object):
+        os.replace(tmp_object, entry.object_path)
+        self.evict(keep=entry.path)
+
+    def _entries(self):
+        for shard in os.listdir(self.objects_dir):
+            shard_dir = os.path.join(self.objects_dir, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for key in os.listdir(shard_dir):
+                path = os.path.join(shard_dir, key)
+                size = 0
+                try:
+                    for name in os.listdir(path):
+                        size += os.path.getsize(os.path.join(path, name))
+                    used = os.path.getmtime(os.path.join(path, 'meta.json'))
+                except OSError:
+                    continue
+                yield used, size, path
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_size.
+
+        The entry at ``keep`` and entries in use stay, even if the cache
+        is still too big without them.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        in_use = time.time() - IN_USE_SECONDS
+        for used, size, path in entries:
+            if total <= self.max_size:
+                break
+            if path == keep or used >= in_use:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def _read_stats(self):
+        try:
+            with open(self.stats_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'hits': 0, 'misses': 0}
+
+    def _count(self, field):
+        # Best effort: a lost update under concurrent runs only skews the numbers
+        stats = self._read_stats()
+        stats[field] = stats.get(field, 0) + 1
+        try:
+            _write_atomic(self.stats_path, json.dumps(stats).encode())
+        except OSError:
+            pass
+
+    def stats(self):
+        stats = self._read_stats()
+        entries = list(self._entries())
+        stats['entries'] = len(entries)
+        stats['size'] = sum(size for _, size, _ in entries)
+        stats['max_size'] = self.max_size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
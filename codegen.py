@@ -1,72 +1,148 @@
-from parser_lexer import DataDefNode, ExternNode, FuncDefNode, CallNode, RetNode, VarDeclNode, BinOpNode, FuncCallAssignNode, StrDeclNode, LabelNode, CmpNode, JumpNode, StructDefNode, EnumDefNode, BssDefNode, ArrayAccessNode, AddressOfNode, PointerDerefNode, ArrayAssignNode, PushNode, PopNode, UseRuntimeNode
+from parser_lexer import DataDefNode, ExternNode, FuncDefNode, CallNode, RetNode, VarDeclNode, BinOpNode, FuncCallAssignNode, StrDeclNode, LabelNode, CmpNode, JumpNode, StructDefNode, EnumDefNode, BssDefNode, ArrayAccessNode, AddressOfNode, PointerDerefNode, ArrayAssignNode, ArrayGetNode, VectorOpNode, PushNode, PopNode, UseRuntimeNode
+from emitter import AsmEmitter
+from layout import WORD, Layouts, copy, load, store, value_size
+from ir import build_function, compute_liveness, format_function, split_functions, versioned
+from passes import PassManager
+from regalloc import CALLEE_SAVED
+from vector import AVX2, ELEMENT_SIZE, ELEMENT_TYPES, SSE2, lower
+from visitor import NodeVisitor
+import io
 import re
 
-class CodeGenerator:
-    def __init__(self, target_os='linux'):
+_ARRAY_TYPE_RE = re.compile(r'(\w+)\[(\d+)\]')
+
+# GNU stack and CET property notes emitted at the top of every Linux file
+LINUX_NOTE_SECTIONS = [
+    '.section .note.GNU-stack,"",@progbits',
+    '.section .note.gnu.property,"a"',
+    '    .align 8',
+    '    .long 1f - 0f',
+    '    .long 4f - 1f',
+    '    .long 5',
+    '0: .asciz "GNU"',
+    '1: .align 8',
+    '    .long 0xc0000002',
+    '    .long 3f - 2f',
+    '2: .long 0x3',
+    '3: .align 8',
+    '4:'
+]
+
+class CodeGenerator(NodeVisitor):
+    def __init__(self, target_os='linux', passes=(), dump_ir=False, bounds_checks=False, avx2=False):
         self.data_section = []
-        self.text_section = []
+        self.emitter = AsmEmitter()
+        # Buffer of the function being generated; every _gen_* appends here
+        self.text_section = self.emitter.current
         self.externs = set()
         self.stack_offset = 0
         self.vars = {}  # Now stores (offset, type) tuples
         self.structs = {}
+        self.layouts = Layouts()  # Field offsets and size of each struct
         self.enums = {}
-        self.func_prologue_index = None
-        self.func_prologue_index_updated = False
+        self.func_prologue = None
+        self.frame_slot = None  # The same slot; func_prologue is cleared once patched
+        self.frames = []  # (buffer, frame slot, final stack_offset) of each function
+        # Optional passes: a PassManager, or pass names (e.g. 'regalloc'); none at -O0
+        self.passes = passes if isinstance(passes, PassManager) else PassManager(passes)
+        self.var_regs = {}  # Register of each register-allocated variable, by ir.versioned name
+        self.versions = {}  # Number of the latest declaration of each name in the function
+        self.saved_regs = []  # (register, offset) of saved callee-saved registers
+        self.entry_label = None  # Where a function's tail calls to itself jump
+        self.isel = None  # InstructionSelector for arithmetic; fixed sequences without one
+        self.bounds_checks = bounds_checks  # Trap on array indexes out of range
+        self.safe_indexes = set()  # id() of the array accesses whose index is known to be in range
+        self.bounds_label = None  # Trap label of the current function, once a check uses it
+        self.vector_units = AVX2 if avx2 else SSE2  # Registers of vector statements, widest first
+        self.vector_loops = 0  # Numbers their loop labels
+        self.dump_ir = dump_ir
+        self.ir_dumps = []  # Text of each function's IR, when dump_ir is set
         self.target_os = target_os  # 'linux' or 'win64'
         self.param_regs = ['rcx', 'rdx', 'r8', 'r9'] if target_os == 'win64' else ['rdi', 'rsi', 'rdx', 'rcx', 'r8', 'r9']
         self.use_runtime = False
         self.runtime_funcs = ['open', 'write', 'close', 'read', 'allocate', 'deallocate', 'starts_with', 'ends_with']
     
-    def generate(self, ast):
-        for node in ast:
-            if isinstance(node, StructDefNode):
-                self.structs[node.name] = node.fields
-            elif isinstance(node, BssDefNode):
-                self._gen_bss_def(node)
-            elif isinstance(node, LabelNode):
-                self.text_section.append(f'.{node.name}:')
-            elif isinstance(node, DataDefNode):
-                self._gen_data_def(node)
-            elif isinstance(node, ExternNode):
-                self._gen_extern(node)
-            elif isinstance(node, FuncDefNode):
-                self._gen_func_def(node)
-            elif isinstance(node, CallNode):
-                self._gen_call(node)
-            elif isinstance(node, RetNode):
-                self._gen_ret(node)
-            elif isinstance(node, VarDeclNode):
-                self._gen_var_decl(node)
-            elif isinstance(node, AddressOfNode):
-                self._gen_var_decl(node)
-            elif isinstance(node, BinOpNode):
-                self._gen_bin_op(node)
-            elif isinstance(node, FuncCallAssignNode):
-                self._gen_func_call_assign(node)
-            elif isinstance(node, StrDeclNode):
-                self._gen_str_decl(node)
-            elif isinstance(node, CmpNode):
-                self._gen_cmp(node)
-            elif isinstance(node, JumpNode):
-                self._gen_jump(node)
-            elif isinstance(node, EnumDefNode):
-                self.enums[node.name] = {variant: i for i, variant in enumerate(node.variants)}
-            elif 'ArrayAssignNode' in str(type(node)):
-                self._gen_array_assign(node)
-            elif isinstance(node, ArrayAssignNode):
-                self._gen_array_assign(node)
-            elif hasattr(node, 'var_name') and hasattr(node, 'target') and type(node).__name__ == 'GetNode':
-                self._gen_get(node)
-            elif isinstance(node, PushNode):
-                self._gen_push(node)
-            elif isinstance(node, PopNode):
-                self._gen_pop(node)
-            elif isinstance(node, UseRuntimeNode):
-                self.use_runtime = True
-                # Add externs for all runtime functions
-                for func in self.runtime_funcs:
-                    self.externs.add(func)
-                    self.text_section.append(f'.extern {func}')
+    def generate(self, ast, out=None):
+        """Generate assembly for ``ast``.
+
+        Returns the assembly text, or writes it straight to the ``out``
+        stream and returns None when one is given.
+        """
+        self.generate_nodes(ast)
+        return self.finalize(out)
+
+    def generate_nodes(self, ast):
+        # Functions are lowered one at a time from their basic blocks; the
+        # nodes before the first one have no control flow.
+        for unit in split_functions(ast):
+            if isinstance(unit[0], FuncDefNode):
+                self.generate_function(build_function(unit, self.structs))
+            else:
+                self.visit_all(unit)
+        self.var_regs = {}
+
+    def generate_function(self, func):
+        """Lower an ir.Function: its header, then its blocks in order."""
+        self.safe_indexes = set()
+        self.passes.run_ir(func, self)
+        if self.dump_ir:
+            compute_liveness(func)
+            self.ir_dumps.append(format_function(func))
+        self.entry_label = func.entry_label
+        self.visit_all(func.nodes())
+        if self.bounds_label is not None:
+            # Failed bounds checks end up here, out of the way of the code
+            self.text_section.extend([f'{self.bounds_label}:', '    ud2'])
+            self.bounds_label = None
+        self.frames.append((self.text_section, self.frame_slot, self.stack_offset))
+
+    def _next_version(self, name):
+        """The ir.versioned name of a new declaration of ``name``."""
+        version = self.versions.get(name, -1) + 1
+        self.versions[name] = version
+        return versioned(name, version)
+
+    def _declare(self, name, var_type):
+        """Bind ``name`` to its register, or else to a new 8-byte stack slot."""
+        reg = self.var_regs.get(self._next_version(name))
+        if reg is not None:
+            self.vars[name] = (reg, var_type)
+        else:
+            self.vars[name] = (self.stack_offset + 16, var_type)
+            self.stack_offset += 8
+        return self._var_ref(name)
+
+    def _var_ref(self, name):
+        """The operand holding variable ``name``: a register or its stack slot."""
+        location, _ = self.vars[name]
+        if isinstance(location, str):
+            return location
+        return f'QWORD PTR [rbp - {location}]'
+
+    # Node handlers; see visitor.NodeVisitor. Top-level ArrayAccessNode and
+    # PointerDerefNode have no handler and generate nothing.
+    def visit_StructDefNode(self, node):
+        self.structs[node.name] = node.fields
+        self.layouts.define(node.name, node.fields)
+
+    def visit_LabelNode(self, node):
+        self.text_section.append(f'.{node.name}:')
+
+    def visit_EnumDefNode(self, node):
+        self.enums[node.name] = {variant: i for i, variant in enumerate(node.variants)}
+
+    def visit_UseRuntimeNode(self, node):
+        self.use_runtime = True
+        # Add externs for all runtime functions
+        for func in self.runtime_funcs:
+            self.externs.add(func)
+            self.text_section.append(f'.extern {func}')
+
+    def finalize(self, out=None):
+        self.passes.run_asm(self)
+        if out is not None:
+            self.write_asm(out)
+            return None
         return self._finalize_asm()
     
     def _gen_data_def(self, node):
@@ -84,27 +160,48 @@ class CodeGenerator:
     def _gen_func_def(self, node):
         shadow_space = 32 if self.target_os == 'win64' else 0
         
+        self.text_section = self.emitter.begin_function(node.name)
         self.text_section.extend([
             f'.text',
             f'.globl {node.name}',
-            f'.type {node.name}, @function' if self.target_os == 'linux' else '',
+        ])
+        if self.target_os == 'linux':
+            self.text_section.append(f'.type {node.name}, @function')
+        self.text_section.extend([
             f'{node.name}:',
             '    push rbp',
             '    mov rbp, rsp',
-            f'    sub rsp, STACK_SIZE_PLACEHOLDER + {shadow_space}'
         ])
         
-        # Filter out empty strings from the assembly
-        self.text_section = [line for line in self.text_section if line.strip() != '']
-        
-        # Record the index of our placeholder prologue line for later update.
-        self.func_prologue_index = len(self.text_section) - 1
+        # The frame size is patched into this slot at the first RET.
+        self.func_prologue = self.emitter.slot(f'    sub rsp, STACK_SIZE_PLACEHOLDER + {shadow_space}')
+        self.frame_slot = self.func_prologue
         # Reset stack offset for local variables
         self.stack_offset = shadow_space  # Start after shadow space on Windows
         self.vars = {}
+        self.versions = {}
+        
+        # Save the callee-saved registers the allocator handed out
+        self.saved_regs = []
+        used_regs = set(self.var_regs.values())
+        for reg in CALLEE_SAVED:
+            if reg in used_regs:
+                offset = self.stack_offset + 16
+                self.saved_regs.append((reg, offset))
+                self.text_section.append(f'    mov QWORD PTR [rbp - {offset}], {reg}')
+                self.stack_offset += 8
         
+        if self.entry_label is not None:
+            self.text_section.append(f'.{self.entry_label}:')
+
         # Store parameters
         for i, param in enumerate(node.params):
+            reg = self.var_regs.get(self._next_version(param))
+            if reg is not None:
+                self.vars[param] = (reg, param)
+                if i < len(self.param_regs):
+                    self.text_section.append(f'    mov {reg}, {self.param_regs[i]}')
+                continue
             offset = self.stack_offset + 16
             self.vars[param] = (offset, param)
             if i < len(self.param_regs):
@@ -124,15 +221,13 @@ class CodeGenerator:
     def _gen_var_decl(self, node):
         if isinstance(node, AddressOfNode):
             # Handle pointer declaration with address-of
-            offset = self.stack_offset + 16
-            self.vars[node.var_name] = (offset, node.var_type)
-            self.stack_offset += 8
+            ref = self._declare(node.var_name, node.var_type)
             
             # Get target variable's address
             target_offset, _ = self.vars[node.target]  # Use target name directly
             self.text_section.extend([
                 f'    lea rax, [rbp - {target_offset}]',
-                f'    mov QWORD PTR [rbp - {offset}], rax'
+                f'    mov {ref}, rax'
             ])
             return
         # Handle enum values
@@ -141,16 +236,12 @@ class CodeGenerator:
             if isinstance(node.value, str) and '::' in node.value:
                 _, variant = node.value.split('::')
                 int_value = enum_values[variant]
-                offset = self.stack_offset + 16
-                self.vars[node.name] = (offset, node.type)
-                self.text_section.append(f'    mov QWORD PTR [rbp - {offset}], {int_value}')
-                self.stack_offset += 8
+                ref = self._declare(node.name, node.type)
+                self.text_section.append(f'    mov {ref}, {int_value}')
                 return
         elif node.type == 'bytes':
             # Allocate stack space for pointer
-            offset = self.stack_offset + 16
-            self.vars[node.name] = (offset, 'bytes')
-            self.stack_offset += 8
+            ref = self._declare(node.name, 'bytes')
             
             # Generate string literal in rodata
             label = f'..LC{len(self.data_section)//4}'
@@ -164,20 +255,19 @@ class CodeGenerator:
             # Store pointer to string
             self.text_section.extend([
                 f'    lea rax, [{label} + rip]',
-                f'    mov QWORD PTR [rbp - {offset}], rax'
+                f'    mov {ref}, rax'
             ])
         elif node.type in self.structs:
-            struct_fields = self.structs[node.type]
-            struct_size = len(struct_fields) * 8
-            base_offset = self.stack_offset + 16
+            # The struct's first byte is the lowest: fields are at base - offset
+            struct = self.layouts.structs[node.type]
+            self.stack_offset += (struct.size + WORD - 1) // WORD * WORD
+            base_offset = self.stack_offset + 8
             self.vars[node.name] = (base_offset, node.type)
-            self.stack_offset += struct_size
             
-            for i, (field, field_type) in enumerate(struct_fields):
-                field_value = node.value[i][1]
-                offset = base_offset + i * 8
+            for field, (_, field_value) in zip(struct.fields.values(), node.value):
+                offset = base_offset - field.offset
                 
-                if field_type == 'bytes' and field_value.startswith('"'):
+                if field.type == 'bytes' and field_value.startswith('"'):
                     # Handle string literals in structs
                     label = f'..LC{len(self.data_section)//4}'
                     self.data_section.extend([
@@ -190,16 +280,17 @@ class CodeGenerator:
                         f'    lea rax, [{label} + rip]',
                         f'    mov QWORD PTR [rbp - {offset}], rax'
                     ])
+                elif field.type in self.layouts and field_value.startswith('$'):
+                    # A nested struct is copied whole
+                    source_offset, _ = self.vars[field_value[1:]]
+                    self.text_section.extend(copy(offset, source_offset, field.size))
+                elif field_value.startswith('$'):
+                    self.text_section.extend([
+                        f'    mov rax, {self._var_ref(field_value[1:])}',
+                        store(f'[rbp - {offset}]', field.type, 'rax')
+                    ])
                 else:
-                    # Existing handling for other types
-                    if field_value.startswith('$'):
-                        src_offset, _ = self.vars[field_value[1:]]
-                        self.text_section.extend([
-                            f'    mov rax, QWORD PTR [rbp - {src_offset}]',
-                            f'    mov QWORD PTR [rbp - {offset}], rax'
-                        ])
-                    else:
-                        self.text_section.append(f'    mov QWORD PTR [rbp - {offset}], {field_value}')
+                    self.text_section.append(store(f'[rbp - {offset}]', field.type, field_value))
         elif re.match(r'\w+\[\d+\]', node.type):
             m = re.match(r'(\w+)\[(\d+)\]', node.type)
             base_type = m.group(1)
@@ -208,43 +299,40 @@ class CodeGenerator:
             values = [int(x.strip()) for x in node.value.split(',')]
             if len(values) != count:
                 raise ValueError(f"Array literal for {node.name} expects {count} values, got {len(values)}")
-            base_offset = self.stack_offset + 16
+            # Element 0 is the lowest, so that element i is at base - i * size
+            element_size = value_size(base_type)
+            self.stack_offset += (count * element_size + WORD - 1) // WORD * WORD
+            base_offset = self.stack_offset + 8
             self.vars[node.name] = (base_offset, node.type)
-            element_size = 8  # assuming 8 bytes per int element
-            self.stack_offset += count * element_size
             for i, value in enumerate(values):
-                offset = base_offset + i * element_size
-                self.text_section.append(f'    mov QWORD PTR [rbp - {offset}], {value}')
+                offset = base_offset - i * element_size
+                self.text_section.append(store(f'[rbp - {offset}]', base_type, str(value)))
             return
         elif isinstance(node.value, int):
-            offset = self.stack_offset + 16
-            self.vars[node.name] = (offset, node.type)
+            ref = self._declare(node.name, node.type)
             self.text_section.extend([
-                f'    mov QWORD PTR [rbp - {offset}], {node.value}'
+                f'    mov {ref}, {node.value}'
             ])
-            self.stack_offset += 8
     
     def _gen_bin_op(self, node):
         # Allocate stack space for the result variable first
         result_var = node.result_var
         if result_var not in self.vars:
-            offset = self.stack_offset + 16
-            self.vars[result_var] = (offset, result_var)
-            self.stack_offset += 8  # Allocate 8 bytes for 64-bit int
+            self._declare(result_var, result_var)  # 8 bytes for a 64-bit int
 
-        target_offset, _ = self.vars[result_var]
+        target = self._var_ref(result_var)
         
         def get_operand(operand):
             if operand.startswith('$'):
-                var_name = operand[1:]
-                var_offset, var_type = self.vars[var_name]
-                return f'QWORD PTR [rbp - {var_offset}]'
+                return self._var_ref(operand[1:])
             return operand
 
         left = get_operand(node.left_var)
         right = get_operand(node.right_var)
 
-        if node.op == 'add':
+        if self.isel is not None:
+            asm = self.isel.arith(node.op, left, right)
+        elif node.op == 'add':
             asm = [
                 f'    mov rax, {left}',
                 f'    add rax, {right}'
@@ -260,7 +348,13 @@ class CodeGenerator:
                 f'    imul rax, {right}'
             ]
         elif node.op == 'div':
-            asm = [
+            if right.lstrip('-').isdigit():
+                # A propagated constant: idiv takes no immediate
+                asm = [f'    mov rcx, {right}']
+                right = 'rcx'
+            else:
+                asm = []
+            asm += [
                 f'    mov rax, {left}',
                 f'    cqo',
                 f'    idiv {right}'
@@ -278,41 +372,45 @@ class CodeGenerator:
                 f'    shl rax, cl'
             ]
         
-        asm.append(f'    mov QWORD PTR [rbp - {target_offset}], rax')
+        asm.append(f'    mov {target}, rax')
         self.text_section.extend(asm)
     
     def _gen_call(self, node):
         processed_args = []
         for arg in node.args:
+            if isinstance(arg, int):
+                # Known constant, from constant propagation
+                processed_args.append(arg)
+                continue
             if isinstance(arg, PointerDerefNode):
                 clean_var_name = arg.var_name.lstrip('$')
-                offset, _ = self.vars[clean_var_name]
-                # Load pointer value from stack
-                self.text_section.append(f'    mov rax, QWORD PTR [rbp - {offset}]')
+                # Load pointer value from stack, just before the argument
+                # register, like an array index: an earlier value left in rax
+                # would be overwritten by the next one
+                setup = [f'    mov rax, {self._var_ref(clean_var_name)}']
                 pointer_offset = arg.index * 8
-                if pointer_offset != 0:
-                    self.text_section.append(f'    add rax, {pointer_offset}')
+                address = f'[rax + {pointer_offset}]' if pointer_offset != 0 else '[rax]'
                 # Always dereference pointers when using <> syntax
-                self.text_section.append(f'    mov rax, QWORD PTR [rax]')
-                processed_args.append('rax')
+                processed_args.append((setup, 'int', address))
                 continue
             # Existing case for simple variable usage
             if isinstance(arg, str) and arg.startswith('$'):
                 var_name = arg[1:]  # Remove $
                 if var_name in self.vars:
-                    offset, var_type = self.vars[var_name]
+                    _, var_type = self.vars[var_name]
                     if '*' in var_type:  # Pointer variable used directly
-                        self.text_section.append(f'    mov rdi, QWORD PTR [rbp - {offset}]')
+                        self.text_section.append(f'    mov rdi, {self._var_ref(var_name)}')
                         processed_args.append('rdi')
                         continue
             
             # Handle array accesses (now using square brackets '[]')
             if isinstance(arg, ArrayAccessNode):
-                clean_var_name = arg.var_name.lstrip('$')
-                var_offset, _ = self.vars[clean_var_name]
-                element_offset = var_offset + arg.index * 8
-                self.text_section.append(f'    mov rax, QWORD PTR [rbp - {element_offset}]')
-                processed_args.append('rax')
+                # rax holds a variable index until the element is loaded
+                setup, element_type, address = self._element(arg, arg.var_name.lstrip('$'), arg.index, 'rax')
+                if setup or value_size(element_type) != WORD:
+                    processed_args.append((setup, element_type, address))
+                else:
+                    processed_args.append(address)
                 continue
             
             if arg == 'mybuff':  # Handle buffer name directly
@@ -320,18 +418,12 @@ class CodeGenerator:
                 continue
             
             if '->' in arg:
-                parts = [p.strip()[1:] for p in arg.split('->')]
-                current_var, *fields = parts
-                current_offset, current_type = self.vars[current_var]
-                total_offset = current_offset
-                for field in fields:
-                    if current_type not in self.structs:
-                        break  # Stop if not a struct type
-                    struct_fields = self.structs[current_type]
-                    field_index = next(i for i, (name, _) in enumerate(struct_fields) if name == field)
-                    total_offset += field_index * 8
-                    current_type = struct_fields[field_index][1]
-                processed_args.append(f'[rbp - {total_offset}]')
+                current_var, *fields = [p.strip()[1:] for p in arg.split('->')]
+                base_offset, current_type = self.vars[current_var]
+                field_offset, field_type = self.layouts.resolve(current_type, fields)
+                address = f'[rbp - {base_offset - field_offset}]'
+                # Narrower fields are extended as they are loaded
+                processed_args.append(address if value_size(field_type) == WORD else ([], field_type, address))
             else:
                 processed_args.append(arg)
         
@@ -343,18 +435,24 @@ class CodeGenerator:
         for i, arg in enumerate(processed_args):
             if i >= len(regs):
                 # On Windows, push remaining args to stack in reverse order
-                self.text_section.insert(-1, f'    push {arg}')
+                if isinstance(arg, tuple):
+                    setup, value_type, address = arg
+                    self.text_section[-1:-1] = [*setup, load('rax', value_type, address), '    push rax']
+                else:
+                    self.text_section.insert(-1, f'    push {arg}')
                 continue
-            if arg in ['rax', 'rbx', 'rcx', 'rdx', 'rdi', 'rsi', 'r8', 'r9']:
+            if isinstance(arg, tuple):
+                # A load that needs extending or a variable index: (set-up lines, type, address)
+                setup, value_type, address = arg
+                self.text_section.extend(setup)
+                self.text_section.append(load(regs[i], value_type, address))
+                continue
+            if isinstance(arg, int) or arg in ['rax', 'rbx', 'rcx', 'rdx', 'rdi', 'rsi', 'r8', 'r9']:
                 self.text_section.append(f'    mov {regs[i]}, {arg}')
             elif arg.startswith('['):
                 self.text_section.append(f'    mov {regs[i]}, {arg}')
             elif arg.startswith('$'):
-                offset, _ = self.vars[arg[1:]]
-                if ': bytes' in arg:  # String pointer
-                    self.text_section.append(f'    mov {regs[i]}, QWORD PTR [rbp - {offset}]')
-                else:
-                    self.text_section.append(f'    mov {regs[i]}, QWORD PTR [rbp - {offset}]')
+                self.text_section.append(f'    mov {regs[i]}, {self._var_ref(arg[1:])}')
             else:  # Global data reference
                 self.text_section.append(f'    lea {regs[i]}, [{arg} + rip]')
         self.text_section.append('    xor rax, rax')
@@ -363,9 +461,9 @@ class CodeGenerator:
         if self.target_os == 'win64':
             self.text_section.append('    add rsp, 32')  # Cleanup shadow space
     
-    def _gen_ret(self, node):
+    def _patch_frame(self):
         # If this is the first RET in the current function, patch the placeholder
-        if self.func_prologue_index is not None:
+        if self.func_prologue is not None:
             # Calculate minimum stack size for red zone (Linux) or shadow space (Windows)
             if self.target_os == 'linux':
                 min_stack = 128  # Red zone size for System V ABI
@@ -375,30 +473,66 @@ class CodeGenerator:
             final_offset = ((self.stack_offset + min_stack + 63) // 64) * 64
             final_offset = max(final_offset, min_stack)
             
-            self.text_section[self.func_prologue_index] = f'    sub rsp, {final_offset}'
-            # Clear the index so that subsequent RET nodes do not re-patch
-            self.func_prologue_index = None
+            self.func_prologue.text = f'    sub rsp, {final_offset}'
+            # Clear the slot so that subsequent RET nodes do not re-patch
+            self.func_prologue = None
+
+    def _leave(self):
+        # Restore the callee-saved registers and drop the frame
+        for reg, offset in self.saved_regs:
+            self.text_section.append(f'    mov {reg}, QWORD PTR [rbp - {offset}]')
+
+        self.text_section.extend([
+            '    mov rsp, rbp',
+            '    pop rbp'
+        ])
+
+    def _gen_ret(self, node):
+        self._patch_frame()
 
         if node.ret_type != 'void':
             if node.value.startswith('$'):
-                offset, _ = self.vars[node.value[1:]]
                 # Use QWORD PTR and RAX for 64-bit values
-                self.text_section.append(f'    mov rax, QWORD PTR [rbp - {offset}]')
+                self.text_section.append(f'    mov rax, {self._var_ref(node.value[1:])}')
             else:
                 self.text_section.append(f'    mov rax, {node.value}')
 
-        self.text_section.extend([
-            '    mov rsp, rbp',
-            '    pop rbp',
-            '    ret'
+        self._leave()
+        self.text_section.append('    ret')
+
+    def _gen_tail_call(self, node):
+        call = node.call
+        func = call.func if isinstance(call, CallNode) else call.func_name
+        # Generate the call as usual, then keep only its argument set-up:
+        # drop the xor of rax, the call and what follows it
+        self.visit(call)
+        lines = self.text_section
+        at = len(lines) - 1
+        while lines[at] != f'    call {func}':
+            at -= 1
+        del lines[at - 1:]
+        self._patch_frame()
+
+        if node.loop_label is not None:
+            if self.target_os == 'win64':
+                # No shadow space: the call does not happen
+                at = len(lines) - 1
+                while lines[at] != '    sub rsp, 32':
+                    at -= 1
+                del lines[at]
+            lines.append(f'    jmp .{node.loop_label}')
+            return
+        self._leave()
+        lines.extend([
+            '    xor rax, rax',  # Zero out RAX for variadic functions
+            f'    jmp {func}'
         ])
     
     def _gen_func_call_assign(self, node):
-        # Allocate space for the result variable if not exists
-        if node.var_name not in self.vars:
-            offset = self.stack_offset + 16
-            self.vars[node.var_name] = (offset, 'int')
-            self.stack_offset += 8
+        # Allocate space for the result variable if not exists (a call
+        # whose result is dead has no variable)
+        if node.var_name is not None and node.var_name not in self.vars:
+            self._declare(node.var_name, 'int')
         
         # Use the correct platform-specific registers for arguments
         regs = self.param_regs  # Use the platform-specific registers defined in __init__
@@ -412,9 +546,10 @@ class CodeGenerator:
                 # Handle stack arguments if needed
                 continue
             
-            if arg.startswith('$'):
-                offset, _ = self.vars[arg[1:]]
-                self.text_section.append(f'    mov {regs[i]}, QWORD PTR [rbp - {offset}]')
+            if isinstance(arg, int):
+                self.text_section.append(f'    mov {regs[i]}, {arg}')
+            elif arg.startswith('$'):
+                self.text_section.append(f'    mov {regs[i]}, {self._var_ref(arg[1:])}')
             else:
                 self.text_section.append(f'    lea {regs[i]}, [{arg} + rip]')
         
@@ -426,14 +561,25 @@ class CodeGenerator:
             self.text_section.append('    add rsp, 32')
         
         # Store result
-        offset, _ = self.vars[node.var_name]
-        self.text_section.append(f'    mov QWORD PTR [rbp - {offset}], rax')
+        if node.var_name is not None:
+            self.text_section.append(f'    mov {self._var_ref(node.var_name)}, rax')
     
+    def _gen_assign(self, node):
+        if node.name not in self.vars:
+            self._declare(node.name, 'int')
+        ref = self._var_ref(node.name)
+        if ref.startswith('QWORD PTR') and not -2 ** 31 <= node.value < 2 ** 31:
+            # A store to memory takes at most a 32-bit immediate
+            self.text_section.extend([
+                f'    mov rax, {node.value}',
+                f'    mov {ref}, rax'
+            ])
+        else:
+            self.text_section.append(f'    mov {ref}, {node.value}')
+
     def _gen_str_decl(self, node):
-        # Allocate stack space first
-        offset = self.stack_offset + 16
-        self.vars[node.name] = (offset, 'bytes')
-        self.stack_offset += 8  # Allocate space for pointer
+        # Allocate space for the pointer first
+        ref = self._declare(node.name, 'bytes')
         
         # Create unique label
         label = f'..LC{len(self.data_section)//4}'
@@ -447,15 +593,13 @@ class CodeGenerator:
         # Store address in allocated space
         self.text_section.extend([
             f'    lea rax, [{label} + rip]',
-            f'    mov QWORD PTR [rbp - {offset}], rax'
+            f'    mov {ref}, rax'
         ])
     
     def _gen_cmp(self, node):
         def get_operand(operand):
             if operand.startswith('$'):
-                var_name = operand[1:]
-                var_offset, var_type = self.vars[var_name]
-                return f'QWORD PTR [rbp - {var_offset}]'
+                return self._var_ref(operand[1:])
             return operand
         
         left = get_operand(node.left)
@@ -479,44 +623,128 @@ class CodeGenerator:
             f'    .space {node.size}'
         ])
     
+    def _element(self, node, name, index, scratch):
+        """(set-up lines, element type, address) of element ``index`` of array ``name``.
+
+        A variable ``index`` scales into the address, loaded into ``scratch``
+        by the set-up lines unless it lives in a register. In bounds-check
+        mode the index is checked here, unless ``node`` is in safe_indexes.
+        """
+        if name not in self.vars:
+            raise ValueError(f"Array variable {name} not declared")
+        base_offset, var_type = self.vars[name]
+        m = _ARRAY_TYPE_RE.match(var_type)
+        if m is None:
+            raise ValueError(f"Variable {name} is not an array")
+        element_type, count = m.group(1), int(m.group(2))
+        element_size = value_size(element_type)
+        checked = self.bounds_checks and id(node) not in self.safe_indexes
+        if isinstance(index, int):
+            if checked and not 0 <= index < count:
+                self.text_section.append(f'    jmp {self._bounds_label()}')
+            return [], element_type, f'[rbp - {base_offset - index * element_size}]'
+        index_name = index[1:]
+        if index_name not in self.vars:
+            raise ValueError(f"Variable {index_name} not declared for array index")
+        ref = self._var_ref(index_name)
+        if checked:
+            # Unsigned, so that a negative index fails as well
+            self.text_section.extend([
+                f'    cmp {ref}, {count}',
+                f'    jae {self._bounds_label()}'
+            ])
+        setup = []
+        if ref.startswith('QWORD PTR'):
+            setup.append(f'    mov {scratch}, {ref}')
+            ref = scratch
+        return setup, element_type, f'[rbp - {base_offset} + {ref}*{element_size}]'
+
+    def _bounds_label(self):
+        if self.bounds_label is None:
+            self.bounds_label = f'.{self.emitter.functions[-1][0]}.bounds'
+        return self.bounds_label
+
     def _gen_array_assign(self, node):
         """
         Generates code for an array element assignment.
-        Example: "$arr[0] = 10;" will store 10 into the first element of the array.
+        Example: "$arr[0] = 10;" will store 10 into the first element of the array,
+        "$arr[$i] = $x;" stores x into element i.
         """
-        if node.var_name not in self.vars:
-            raise ValueError(f"Array variable {node.var_name} not declared")
-        base_offset, var_type = self.vars[node.var_name]
-        element_offset = base_offset + node.index * 8  # assuming 8 bytes per element
+        setup, element_type, address = self._element(node, node.var_name, node.index, 'rcx')
+        self.text_section.extend(setup)
         if isinstance(node.value, int):
-            self.text_section.append(f'    mov QWORD PTR [rbp - {element_offset}], {node.value}')
+            self.text_section.append(store(address, element_type, str(node.value)))
         elif isinstance(node.value, str):
             # Handle cases where the right-hand side is a variable reference (e.g., $x)
             if node.value.startswith('$'):
                 ref_var = node.value[1:]
                 if ref_var not in self.vars:
                     raise ValueError(f"Variable {ref_var} not declared")
-                off, _ = self.vars[ref_var]
-                self.text_section.append(f'    mov rax, QWORD PTR [rbp - {off}]')
-                self.text_section.append(f'    mov QWORD PTR [rbp - {element_offset}], rax')
+                self.text_section.append(f'    mov rax, {self._var_ref(ref_var)}')
+                self.text_section.append(store(address, element_type, 'rax'))
             else:
-                self.text_section.append(f'    mov QWORD PTR [rbp - {element_offset}], {node.value}')
+                self.text_section.append(store(address, element_type, node.value))
+
+    def _gen_array_get(self, node):
+        # The index is read before the result gets its slot: it may be the same variable
+        setup, element_type, address = self._element(node, node.array, node.index, 'rax')
+        self.text_section.extend(setup)
+        self.text_section.append(load('rax', element_type, address))
+        ref = self._declare(node.var_name, node.var_type)
+        self.text_section.append(f'    mov {ref}, rax')
     
+    def _vector_array(self, operand):
+        """(rbp offset of element 0, length) of the int array named by a vector operand."""
+        name = operand.lstrip('$')
+        if name not in self.vars:
+            raise ValueError(f"Variable {name} not declared")
+        base_offset, var_type = self.vars[name]
+        m = _ARRAY_TYPE_RE.fullmatch(var_type)
+        if m is None or m.group(1) not in ELEMENT_TYPES:
+            raise ValueError(f"Vector operand {name} is not an int array")
+        return base_offset, int(m.group(2))
+
+    def _gen_vector_op(self, node):
+        """
+        Generates code for a vector statement, e.g. "$c: int[8] = vadd $a, $b;"
+        or "$s: int = vsum $a;". See vector.py.
+        """
+        left, count = self._vector_array(node.left)
+        label = f'.{self.emitter.functions[-1][0]}.vec{self.vector_loops}'
+        self.vector_loops += 1
+        if node.op == 'vsum':
+            self.text_section.extend(lower('vsum', count, None, left, None, self.vector_units, label))
+            if node.var_name not in self.vars:
+                self._declare(node.var_name, node.var_type)
+            self.text_section.append(f'    mov {self._var_ref(node.var_name)}, rax')
+            return
+        right, right_count = self._vector_array(node.right)
+        m = _ARRAY_TYPE_RE.fullmatch(node.var_type)
+        if right_count != count or m is None or m.group(1) not in ELEMENT_TYPES or int(m.group(2)) != count:
+            raise ValueError(f"{node.op} of {node.left} and {node.right} needs int arrays of the length of "
+                             f"{node.var_type}")
+        location = self.vars.get(node.var_name)
+        if location is not None and location[1] == node.var_type:
+            dst = location[0]  # Overwritten in place, so that a loop can update it
+        else:
+            self.stack_offset += count * ELEMENT_SIZE
+            dst = self.stack_offset + 8
+            self.vars[node.var_name] = (dst, node.var_type)
+        self.text_section.extend(lower(node.op, count, dst, left, right, self.vector_units, label))
+
     def _gen_get(self, node):
-        # Allocate stack space for the new variable
-        offset = self.stack_offset + 16
-        self.vars[node.var_name] = (offset, node.var_type)
-        self.stack_offset += 8
+        # Allocate space for the new variable
+        ref = self._declare(node.var_name, node.var_type)
 
         # Determine the source variable name (strip leading '$' if present)
         target_name = node.target.lstrip('$')
         if target_name not in self.vars:
             raise ValueError(f"Variable '{target_name}' not declared for get operation")
-        source_offset, _ = self.vars[target_name]
+        source = self._var_ref(target_name)
 
         # Load the value from the target variable into rax and store it to the new variable's slot
-        self.text_section.append(f'    mov rax, QWORD PTR [rbp - {source_offset}]')
-        self.text_section.append(f'    mov QWORD PTR [rbp - {offset}], rax')
+        self.text_section.append(f'    mov rax, {source}')
+        self.text_section.append(f'    mov {ref}, rax')
     
     def _gen_push(self, node):
         if node.value.startswith('"'):
@@ -537,96 +765,97 @@ class CodeGenerator:
             var_name = node.value[1:]
             if var_name not in self.vars:
                 raise ValueError(f"Variable {var_name} not declared for push operation")
-            offset, _ = self.vars[var_name]
             self.text_section.extend([
-                f'    mov rax, QWORD PTR [rbp - {offset}]',
+                f'    mov rax, {self._var_ref(var_name)}',
                 '    push rax'
             ])
         elif any(node.value.startswith(op) for op in ['add ', 'sub ', 'mul ', 'div ', 'shl ', 'shr ']):
             # Novo tratamento para operações aritméticas
             op, rest = node.value.split(' ', 1)
-            left, right = rest.split(',', 1)
-            left = left.strip()
-            right = right.strip()
-
-            # Carrega operando esquerdo
-            if left.startswith('$'):
-                l_var = left[1:]
-                l_offset, _ = self.vars[l_var]
-                self.text_section.append(f'    mov rax, QWORD PTR [rbp - {l_offset}]')
-            else:
-                self.text_section.append(f'    mov rax, {left}')
+            left, right = (operand.strip() for operand in rest.split(',', 1))
+            left = self._var_ref(left[1:]) if left.startswith('$') else left
+            right = self._var_ref(right[1:]) if right.startswith('$') else right
 
-            # Carrega operando direito
-            if right.startswith('$'):
-                r_var = right[1:]
-                r_offset, _ = self.vars[r_var]
-                self.text_section.append(f'    mov rbx, QWORD PTR [rbp - {r_offset}]')
+            if self.isel is not None:
+                # Shifts go by whatever is in cl, like the fixed sequences below
+                self.text_section.extend(self.isel.arith(op, left, 'cl' if op in ('shl', 'shr') else right))
             else:
-                self.text_section.append(f'    mov rbx, {right}')
-
-            # Gera instrução da operação
-            if op == 'add':
-                self.text_section.append('    add rax, rbx')
-            elif op == 'sub':
-                self.text_section.append('    sub rax, rbx')
-            elif op == 'mul':
-                self.text_section.append('    imul rax, rbx')
-            elif op == 'div':
+                # Carrega os operandos
                 self.text_section.extend([
-                    '    cqo',
-                    '    idiv rbx'
+                    f'    mov rax, {left}',
+                    f'    mov rbx, {right}'
                 ])
-            elif op == 'shl':
-                self.text_section.append('    shl rax, cl')
-            elif op == 'shr':
-                self.text_section.append('    shr rax, cl')
+
+                # Gera instrução da operação
+                if op == 'add':
+                    self.text_section.append('    add rax, rbx')
+                elif op == 'sub':
+                    self.text_section.append('    sub rax, rbx')
+                elif op == 'mul':
+                    self.text_section.append('    imul rax, rbx')
+                elif op == 'div':
+                    self.text_section.extend([
+                        '    cqo',
+                        '    idiv rbx'
+                    ])
+                elif op == 'shl':
+                    self.text_section.append('    shl rax, cl')
+                elif op == 'shr':
+                    self.text_section.append('    shr rax, cl')
 
             self.text_section.append('    push rax')
         else:
             # Assume valor inteiro literal
             self.text_section.append(f'    push {node.value}')
-        
-        self.stack_offset += 8
+        # The pushed value lives below rsp, outside the frame: no slot to count
     
     def _gen_pop(self, node):
-        offset = self.stack_offset + 16
-        self.vars[node.var_name] = (offset, node.var_type)
-        
+        if node.var_name is None:
+            # The popped value is dead
+            self.text_section.append('    add rsp, 8')
+            return
         # Aloca espaço para a variável sem ajustar o offset posteriormente
-        self.stack_offset += 8
-        
-        if node.var_type == 'bytes':
-            self.text_section.append(f'    pop QWORD PTR [rbp - {offset}]')
-        else:
-            self.text_section.append(f'    pop QWORD PTR [rbp - {offset}]')
+        ref = self._declare(node.var_name, node.var_type)
+        self.text_section.append(f'    pop {ref}')
     
     def _finalize_asm(self):
-        assembly = [
-            '.intel_syntax noprefix',
-        ]
+        out = io.StringIO()
+        self.write_asm(out)
+        return out.getvalue()
+
+    def write_asm(self, out):
+        out.write('.intel_syntax noprefix\n')
         
         # Add platform-specific sections
         if self.target_os == 'linux':
-            assembly.extend([
-                '.section .note.GNU-stack,"",@progbits',
-                '.section .note.gnu.property,"a"',
-                '    .align 8',
-                '    .long 1f - 0f',
-                '    .long 4f - 1f',
-                '    .long 5',
-                '0: .asciz "GNU"',
-                '1: .align 8',
-                '    .long 0xc0000002',
-                '    .long 3f - 2f',
-                '2: .long 0x3',
-                '3: .align 8',
-                '4:'
-            ])
+            out.write('\n'.join(LINUX_NOTE_SECTIONS))
+            out.write('\n')
         
-        assembly.extend(self.data_section)
-        assembly.append('')
-        assembly.append('.text')
-        assembly.extend(self.text_section)
-        assembly.append('')
-        return '\n'.join(assembly)
+        for line in self.data_section:
+            out.write(line)
+            out.write('\n')
+        out.write('\n.text\n')
+        self.emitter.write(out)
+
+    # Node type -> generator; the remaining handlers are defined above
+    visit_BssDefNode = _gen_bss_def
+    visit_DataDefNode = _gen_data_def
+    visit_ExternNode = _gen_extern
+    visit_FuncDefNode = _gen_func_def
+    visit_CallNode = _gen_call
+    visit_RetNode = _gen_ret
+    visit_VarDeclNode = _gen_var_decl
+    visit_AddressOfNode = _gen_var_decl
+    visit_BinOpNode = _gen_bin_op
+    visit_FuncCallAssignNode = _gen_func_call_assign
+    visit_AssignNode = _gen_assign
+    visit_StrDeclNode = _gen_str_decl
+    visit_CmpNode = _gen_cmp
+    visit_JumpNode = _gen_jump
+    visit_ArrayAssignNode = _gen_array_assign
+    visit_ArrayGetNode = _gen_array_get
+    visit_VectorOpNode = _gen_vector_op
+    visit_GetNode = _gen_get
+    visit_PushNode = _gen_push
+    visit_PopNode = _gen_pop
+    visit_TailCallNode = _gen_tail_call
@@ -0,0 +1,281 @@
+"""Constant folding and propagation on the AST.
+
+Works through each function in order, remembering which variables hold a
+known integer. Known values replace variable operands, operations on two
+known values become plain assignments, and a cmp of two known values
+decides its jumps at compile time. Everything known is forgotten at each
+label, since another path may reach it, and variables whose address is
+taken are never tracked.
+"""
+import operator
+import re
+from collections import Counter
+
+from parser_lexer import (AddressOfNode, AssignNode, BinOpNode, CallNode, CmpNode,
+                          FuncCallAssignNode, JumpNode, PushNode, RetNode, VarDeclNode, ArrayAccessNode,
+                          ArrayAssignNode, ArrayGetNode)
+from ir import VarRefs, split_functions
+from visitor import NodeTransformer
+
+# Plain decimal only: the assembler reads a leading 0 as octal
+_INT_RE = re.compile(r'-?(?:0|[1-9]\d*)$')
+_ARRAY_TYPE_RE = re.compile(r'\w+\[\d+\]')
+
+_INT64_MIN = -2 ** 63
+
+_CONDITIONS = {
+    'je': operator.eq,
+    'jne': operator.ne,
+    'jl': operator.lt,
+    'jle': operator.le,
+    'jg': operator.gt,
+    'jge': operator.ge,
+}
+
+
+def _wrap(value):
+    """Truncate to a signed 64-bit integer, as the machine does."""
+    value &= (1 << 64) - 1
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def fits_imm32(value):
+    return -2 ** 31 <= value < 2 ** 31
+
+
+def evaluate(op, left, right):
+    """The value the generated code would compute, or None if it must run."""
+    if op == 'add':
+        return _wrap(left + right)
+    if op == 'sub':
+        return _wrap(left - right)
+    if op == 'mul':
+        return _wrap(left * right)
+    if op == 'div':
+        # Leave the faulting cases to fault at run time
+        if right == 0 or (left == _INT64_MIN and right == -1):
+            return None
+        quotient = abs(left) // abs(right)  # idiv truncates toward zero
+        return quotient if (left < 0) == (right < 0) else -quotient
+    if op == 'shl':
+        return _wrap(left << (right & 63))
+    if op == 'shr':
+        return _wrap((left & ((1 << 64) - 1)) >> (right & 63))
+    return None
+
+
+class ConstantFolder(NodeTransformer):
+    """Fold and propagate constants; ``run`` streams the rewritten nodes.
+
+    ``counts`` records how many operands were propagated, operations
+    folded and branches decided.
+    """
+
+    def __init__(self):
+        self.enums = {}
+        self.structs = {}
+        self.known = {}
+        self.pinned = set()
+        self.flags = None  # (left, right) of a cmp removed as known
+        self.counts = Counter()
+        self._refs = VarRefs(self.structs)
+
+    def run(self, nodes):
+        for unit in split_functions(nodes):
+            self.known = {}
+            self.pinned = {node.target.lstrip('$') for node in unit if isinstance(node, AddressOfNode)}
+            yield from self.transform(unit)
+
+    def visit(self, node):
+        # Only the jumps straight after a cmp read its flags
+        if not isinstance(node, JumpNode):
+            self.flags = None
+        return super().visit(node)
+
+    def _value(self, operand):
+        if isinstance(operand, int):
+            return operand
+        if not isinstance(operand, str):
+            return None
+        if operand.startswith('$'):
+            return self.known.get(operand[1:])
+        if _INT_RE.match(operand):
+            return int(operand)
+        return None
+
+    def _propagate(self, operand, imm32=True):
+        """``operand`` with a known variable replaced by its value as a string."""
+        value = self._value(operand)
+        if value is None or not operand.startswith('$') or (imm32 and not fits_imm32(value)):
+            return operand
+        self.counts['propagated'] += 1
+        return str(value)
+
+    def _set(self, name, value):
+        if value is None or name in self.pinned:
+            self.known.pop(name, None)
+        else:
+            self.known[name] = value
+
+    def generic_visit(self, node):
+        for name in self._refs.visit(node)[0]:
+            self.known.pop(name, None)
+        return None
+
+    def visit_FuncDefNode(self, node):
+        self.known.clear()
+
+    def visit_LabelNode(self, node):
+        self.known.clear()
+
+    def visit_StructDefNode(self, node):
+        self.structs[node.name] = node.fields
+
+    def visit_EnumDefNode(self, node):
+        self.enums[node.name] = {variant: i for i, variant in enumerate(node.variants)}
+
+    def visit_VarDeclNode(self, node):
+        # Mirrors the cases CodeGenerator._gen_var_decl distinguishes
+        if isinstance(node.value, list):
+            fields = [(name, self._propagate(value)) for name, value in node.value]
+            self._set(node.name, None)
+            return VarDeclNode(node.name, node.type, fields)
+        if node.type in self.enums:
+            variant = node.value.split('::')[1] if isinstance(node.value, str) and '::' in node.value else None
+            self._set(node.name, self.enums[node.type].get(variant))
+        elif node.type == 'bytes' or node.type in self.structs or _ARRAY_TYPE_RE.match(node.type):
+            self._set(node.name, None)
+        else:
+            self._set(node.name, node.value if isinstance(node.value, int) else None)
+        return None
+
+    def visit_GetNode(self, node):
+        value = self._value(node.target if node.target.startswith('$') else '$' + node.target)
+        if value is None or node.var_type != 'int':
+            self._set(node.var_name, None)
+            return None
+        self._set(node.var_name, value)
+        if not fits_imm32(value):
+            # A declaration stores its value as an immediate; keep the copy
+            return None
+        self.counts['propagated'] += 1
+        # Both declare a new variable, so the copy can simply go
+        return VarDeclNode(node.var_name, 'int', value)
+
+    def visit_BinOpNode(self, node):
+        left, right = self._value(node.left_var), self._value(node.right_var)
+        if left is not None and right is not None:
+            value = evaluate(node.op, left, right)
+            if value is not None:
+                self.counts['folded'] += 1
+                self._set(node.result_var, value)
+                return AssignNode(node.result_var, value)
+        left_operand = self._propagate(node.left_var, imm32=False)
+        right_operand = self._propagate(node.right_var)
+        self._set(node.result_var, None)
+        if (left_operand, right_operand) == (node.left_var, node.right_var):
+            return None
+        return BinOpNode(node.op, node.result_var, left_operand, right_operand)
+
+    def visit_CmpNode(self, node):
+        left, right = self._value(node.left), self._value(node.right)
+        if left is not None and right is not None:
+            self.flags = (left, right)
+            return []
+        # The left operand cannot become an immediate: codegen emits cmp left, rax
+        right_operand = self._propagate(node.right, imm32=False)
+        if right_operand == node.right:
+            return None
+        return CmpNode(node.left, right_operand)
+
+    def visit_JumpNode(self, node):
+        if self.flags is None or node.condition not in _CONDITIONS:
+            return None
+        self.counts['branches'] += 1
+        if _CONDITIONS[node.condition](*self.flags):
+            return JumpNode('jmp', node.label)
+        return []
+
+    def visit_PushNode(self, node):
+        value = node.value
+        if value.startswith('$'):
+            propagated = self._propagate(value)
+            return None if propagated == value else PushNode(propagated)
+        op, _, rest = value.partition(' ')
+        if op not in ('add', 'sub', 'mul', 'div', 'shl', 'shr') or ',' not in rest:
+            return None
+        left, right = (operand.strip() for operand in rest.split(',', 1))
+        left_value, right_value = self._value(left), self._value(right)
+        # push shl/shr shift by whatever is in cl, so they are left alone
+        if left_value is not None and right_value is not None and op not in ('shl', 'shr'):
+            result = evaluate(op, left_value, right_value)
+            if result is not None and fits_imm32(result):
+                self.counts['folded'] += 1
+                return PushNode(str(result))
+        left, right = self._propagate(left, imm32=False), self._propagate(right, imm32=False)
+        new_value = f'{op} {left}, {right}'
+        return None if new_value == value else PushNode(new_value)
+
+    def visit_RetNode(self, node):
+        if node.ret_type == 'void' or not node.value.startswith('$'):
+            return None
+        value = self._propagate(node.value, imm32=False)
+        return None if value == node.value else RetNode(node.ret_type, value)
+
+    def _call_args(self, args):
+        result = []
+        for arg in args:
+            if isinstance(arg, ArrayAccessNode):
+                index = self._index(arg.index)
+                result.append(arg if index == arg.index else ArrayAccessNode(arg.var_name, index))
+                continue
+            value = self._value(arg) if isinstance(arg, str) and arg.startswith('$') else None
+            if value is not None and fits_imm32(value):
+                self.counts['propagated'] += 1
+                result.append(value)
+            else:
+                result.append(arg)
+        return result
+
+    def visit_CallNode(self, node):
+        args = self._call_args(node.args)
+        return None if args == node.args else CallNode(node.func, args)
+
+    def visit_FuncCallAssignNode(self, node):
+        self._set(node.var_name, None)
+        args = self._call_args(node.args)
+        return None if args == node.args else FuncCallAssignNode(node.var_name, node.func_name, args)
+
+    def _index(self, index):
+        """An array index with a known variable replaced by its value."""
+        value = self._value(index) if isinstance(index, str) else None
+        # The index times the element size becomes a displacement
+        if value is None or not fits_imm32(value * 8):
+            return index
+        self.counts['propagated'] += 1
+        return value
+
+    def visit_ArrayAssignNode(self, node):
+        self._set(node.var_name, None)
+        index = self._index(node.index)
+        value = self._value(node.value) if isinstance(node.value, str) and node.value.startswith('$') else None
+        if value is not None and fits_imm32(value):
+            self.counts['propagated'] += 1
+        else:
+            value = node.value
+        if index == node.index and value == node.value:
+            return None
+        return ArrayAssignNode(node.var_name, index, value)
+
+    def visit_ArrayGetNode(self, node):
+        index = self._index(node.index)
+        self._set(node.var_name, None)
+        return None if index == node.index else ArrayGetNode(node.var_name, node.var_type, node.array, index)
+
+
+def fold_constants(nodes, counts=None):
+    """Stream ``nodes`` through a ConstantFolder, adding its counts to ``counts``."""
+    folder = ConstantFolder()
+    yield from folder.run(nodes)
+    if counts is not None:
+        counts.update(folder.counts)
@@ -0,0 +1,197 @@
+"""Dead code elimination.
+
+Three kinds of dead code are removed:
+
+- functions that no root reaches through calls or other references to
+  their name (remove_dead_functions, over the whole program);
+- blocks of a function that cannot be reached from its entry;
+- stores to variables that are not read before they are written again.
+
+Codegen binds a variable name to a stack slot in source order, not along
+control flow, so a store is only dropped when the variable has a single
+slot and dropping it cannot leave a later reference without a slot.
+Nodes that declare something outside the function body (data, externs,
+types, ``use runtime``) are always kept.
+"""
+import re
+
+from ir import compute_liveness, relink, split_functions
+from parser_lexer import (AddressOfNode, ArrayGetNode, AssignNode, BinOpNode, BssDefNode, DataDefNode,
+                          EnumDefNode, ExternNode, FuncCallAssignNode, FuncDefNode, GetNode,
+                          PopNode, StrDeclNode, StructDefNode, UseRuntimeNode, VarDeclNode,
+                          VectorOpNode)
+
+DECLARATIONS = (DataDefNode, ExternNode, StructDefNode, EnumDefNode, BssDefNode, UseRuntimeNode)
+
+# Nodes that always give their variable a new slot. The other stores
+# (BinOpNode, VectorOpNode, FuncCallAssignNode, AssignNode) only do so
+# when it has none.
+_FRESH_SLOT = (VarDeclNode, StrDeclNode, GetNode, ArrayGetNode, PopNode, AddressOfNode, FuncDefNode)
+
+_SYMBOL_RE = re.compile(r'\w+')
+
+
+def _symbols(value):
+    """Every identifier-like word in a node field, recursively."""
+    if isinstance(value, str):
+        return _SYMBOL_RE.findall(value)
+    if isinstance(value, (list, tuple)):
+        return [word for item in value for word in _symbols(item)]
+    slots = getattr(type(value), '__slots__', None)
+    if slots:
+        return [word for name in slots for word in _symbols(getattr(value, name))]
+    return []
+
+
+def remove_dead_functions(nodes, counts, options):
+    """Drop the functions that ``main`` and the ``exports`` option never reach.
+
+    A function counts as reached when a reached function calls it or names
+    it anywhere (e.g. passes it as an argument). Without a root defined in
+    the program (a library), every function is kept.
+    """
+    units = list(split_functions(nodes))
+    functions = {unit[0].name: unit for unit in units if type(unit[0]) is FuncDefNode}
+    reached = {name for name in ('main', *options.get('exports', ())) if name in functions}
+    if not reached:
+        yield from (node for unit in units for node in unit)
+        return
+    # Anything outside a function (globals) is reached too
+    pending = [functions[name] for name in reached]
+    pending += [unit for unit in units if type(unit[0]) is not FuncDefNode]
+    while pending:
+        unit = pending.pop()
+        for word in _symbols(unit[1:] if type(unit[0]) is FuncDefNode else unit):
+            if word in functions and word not in reached:
+                reached.add(word)
+                pending.append(functions[word])
+    for unit in units:
+        if type(unit[0]) is not FuncDefNode or unit[0].name in reached:
+            yield from unit
+        else:
+            counts['functions'] += 1
+            yield from (node for node in unit if isinstance(node, DECLARATIONS))
+
+
+def _remove_unreachable(func, counts):
+    reachable = set()
+    pending = [func.entry]
+    while pending:
+        block = pending.pop()
+        if block.index not in reachable:
+            reachable.add(block.index)
+            pending.extend(block.succs)
+    if len(reachable) == len(func.blocks):
+        return False
+    # Names used by reachable code must keep the slot an unreachable
+    # declaration gives them, since codegen binds slots in source order
+    referenced = set()
+    for block in func.blocks:
+        if block.index in reachable:
+            for defs, uses in func.node_refs[block.start:block.end + 1]:
+                referenced.update(defs)
+                referenced.update(uses)
+    kept = []
+    for block in func.blocks:
+        if block.index in reachable or block.defs & referenced:
+            kept.append(block)
+            continue
+        counts['blocks'] += 1
+        declarations = [node for node in block.nodes if isinstance(node, DECLARATIONS)]
+        if declarations:
+            block.nodes = declarations
+            kept.append(block)
+    func.blocks = kept
+    relink(func)
+    return True
+
+
+def _single_slot_variables(func):
+    """Variables that get exactly one slot, with their first reference's position."""
+    first = {}
+    slots = {}
+    for pos, (node, (defs, uses)) in enumerate(zip(func.nodes(), func.node_refs)):
+        for name in uses:
+            if name not in first:
+                first[name] = pos
+                slots[name] = 2  # Read before any write: leave it alone
+        for name in defs:
+            if name not in first:
+                first[name] = pos
+                slots[name] = 1
+            elif isinstance(node, _FRESH_SLOT):
+                slots[name] += 1
+    return {name: first[name] for name, count in slots.items()
+            if count == 1 and name not in func.pinned}
+
+
+def _without_store(node, bounds_checks):
+    """``node`` without its dead store: None to drop it, or a node that keeps its side effects.
+
+    With ``bounds_checks``, array reads may trap and are kept.
+    """
+    if isinstance(node, FuncCallAssignNode):
+        return FuncCallAssignNode(None, node.func_name, node.args)
+    if isinstance(node, PopNode):
+        return PopNode(None, None)
+    if isinstance(node, BinOpNode) and node.op == 'div':
+        return node  # May fault, so it has to run
+    if isinstance(node, ArrayGetNode) and bounds_checks:
+        return node
+    if isinstance(node, VarDeclNode) and isinstance(node.value, list):
+        return node
+    if isinstance(node, (VarDeclNode, StrDeclNode, AssignNode, GetNode, ArrayGetNode, AddressOfNode, BinOpNode,
+                         VectorOpNode)):
+        return None
+    return node
+
+
+def _remove_dead_stores(func, counts, bounds_checks):
+    variables = _single_slot_variables(func)
+    refs = func.node_refs
+    changed = False
+    next_ref = {}  # Position of the next reference kept, in source order
+    for block in reversed(func.blocks):
+        live = set(block.live_out)
+        new_nodes = []
+        for offset in range(len(block.nodes) - 1, -1, -1):
+            node = block.nodes[offset]
+            pos = block.start + offset
+            defs, uses = refs[pos]
+            replacement = node
+            if defs and all(name in variables and name not in live for name in defs):
+                replacement = _without_store(node, bounds_checks)
+                for name in defs:
+                    following = next_ref.get(name)
+                    # Dropping the first store moves the slot to the next reference,
+                    # which therefore has to be a store that does not read the variable
+                    if variables[name] == pos and following is not None and (
+                            name not in refs[following][0] or name in refs[following][1]):
+                        replacement = node
+            if replacement is node:
+                live.difference_update(defs)
+                live.update(uses)
+                for name in defs + uses:
+                    next_ref[name] = pos
+                new_nodes.append(node)
+                continue
+            changed = True
+            counts['stores'] += 1
+            if replacement is not None:
+                live.update(uses)
+                for name in uses:
+                    next_ref[name] = pos
+                new_nodes.append(replacement)
+        new_nodes.reverse()
+        block.nodes = new_nodes
+    return changed
+
+
+def eliminate_dead_code(func, codegen, counts, options):
+    """Remove the unreachable blocks and dead stores of an ir.Function."""
+    compute_liveness(func)
+    if _remove_unreachable(func, counts):
+        compute_liveness(func)
+    # A dropped store can make the stores feeding it dead as well
+    while _remove_dead_stores(func, counts, codegen.bounds_checks):
+        compute_liveness(func)
@@ -0,0 +1,43 @@
+class PrologueSlot:
+    """A line of a function whose text is only known after the body is generated.
+
+    The slot sits in the function buffer like any other line and is patched
+    in place, so later inserts into the buffer never invalidate it.
+    """
+
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+
+class AsmEmitter:
+    """Append-only assembly buffers, one per function.
+
+    Lines emitted before the first function (externs and the like) go to a
+    leading buffer. Buffers are only joined when the assembly is written out,
+    so emitting a function never touches the ones before it.
+    """
+
+    def __init__(self):
+        self.current = []
+        self.functions = [(None, self.current)]
+
+    def begin_function(self, name):
+        self.current = []
+        self.functions.append((name, self.current))
+        return self.current
+
+    def slot(self, text):
+        slot = PrologueSlot(text)
+        self.current.append(slot)
+        return slot
+
+    def write(self, out):
+        for _, lines in self.functions:
+            if lines:
+                out.write('\n'.join(map(str, lines)))
+                out.write('\n')
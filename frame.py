@@ -0,0 +1,70 @@
+"""Stack frame sizing, done once each function has been generated.
+
+Codegen sizes a frame at the function's first ret: the locals allocated
+so far plus 128 bytes, rounded up to 64. Locals allocated after that ret
+are not counted, and a function without a ret keeps a placeholder. Here the
+frame is recomputed from the function's final stack_offset and rounded
+only to the 16 bytes calls need.
+
+On Linux, a leaf function (no calls, no pushes or pops) whose locals fit in
+the 128-byte red zone below the stack pointer does not set up a frame at
+all: its locals are addressed from rsp.
+"""
+import re
+
+from peephole import parse
+
+RED_ZONE = 128
+
+_SIZE_RE = re.compile(r'sub rsp, (\d+)$')
+_FRAME_LINES = {'    push rbp', '    mov rbp, rsp', '    mov rsp, rbp', '    pop rbp'}
+
+
+def frame_size(stack_offset):
+    """Bytes below rbp the locals use: the lowest one is at rbp - (stack_offset + 8)."""
+    return stack_offset + 8 if stack_offset else 0
+
+
+def _is_leaf(lines):
+    for line in lines:
+        if line in _FRAME_LINES:
+            continue
+        insn = parse(line)
+        if insn is None:
+            continue
+        mnemonic, operands = insn
+        if mnemonic in ('call', 'push', 'pop') or any('rsp' in op for op in operands):
+            return False
+        # A jump out of the function (a tail call) leaves with our rsp
+        if mnemonic.startswith('j') and not operands[0].startswith('.'):
+            return False
+    return True
+
+
+def _omit_frame(lines, slot):
+    """Drop the frame of a leaf function and address its locals from rsp."""
+    body = [line for line in lines if line is not slot and line not in _FRAME_LINES]
+    rewritten = [line.replace('[rbp - ', '[rsp - ') if isinstance(line, str) else line for line in body]
+    if any(isinstance(line, str) and 'rbp' in line for line in rewritten):
+        return False
+    lines[:] = rewritten
+    return True
+
+
+def layout_frames(codegen, counts, options):
+    for lines, slot, stack_offset in codegen.frames:
+        if slot is None:
+            continue
+        match = _SIZE_RE.search(slot.text)
+        old_size = int(match.group(1)) if match else 0
+        size = frame_size(stack_offset)
+        if codegen.target_os == 'linux' and size <= RED_ZONE and _is_leaf(lines) and _omit_frame(lines, slot):
+            counts['leaf-functions'] += 1
+            counts['bytes-saved'] += old_size
+            continue
+        size = (size + 15) // 16 * 16
+        if size:
+            slot.text = f'    sub rsp, {size}'
+        else:
+            lines.remove(slot)
+        counts['bytes-saved'] += max(old_size - size, 0)
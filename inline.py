@@ -0,0 +1,257 @@
+"""Inlining of small functions.
+
+A call to a small function is replaced by a copy of its body: each
+parameter becomes a local set from its argument, and each ret stores the
+returned value in the call's result and jumps past the copy. The copy's
+locals and labels get a ``.<n>`` suffix, which no name in SCB source can
+have, so they never clash with the caller's.
+
+Functions are processed bottom-up, callees before their callers, so a
+body is measured and copied with its own calls already inlined. A
+function that still calls itself afterwards is recursive and never
+inlined. A body is small when it has at most ``inline_threshold`` nodes,
+labels aside (an option; DEFAULT_THRESHOLD otherwise).
+
+Only bodies made of scalar locals, arithmetic, compares, jumps and calls
+are copied, and only at call sites whose arguments are variables or
+constants; structs, arrays, pointers and push/pop keep the call. Each
+inlined site is counted as ``<caller>-><callee>``.
+"""
+import re
+
+from dce import DECLARATIONS
+from ir import VarRefs, split_functions
+from parser_lexer import (AssignNode, BinOpNode, CallNode, CmpNode, FuncCallAssignNode, FuncDefNode,
+                          GetNode, JumpNode, LabelNode, RetNode, StrDeclNode, StructDefNode, VarDeclNode)
+from visitor import NodeVisitor
+
+DEFAULT_THRESHOLD = 10
+
+# Plain decimal only: the assembler reads a leading 0 as octal
+_INT_RE = re.compile(r'-?(?:0|[1-9]\d*)$')
+
+
+def _is_value(operand):
+    """A variable or a number: what a result can be set from."""
+    return isinstance(operand, int) or (isinstance(operand, str) and (
+        operand.startswith('$') or _INT_RE.match(operand) is not None))
+
+
+def _is_argument(arg):
+    """A variable or a known constant. Any other argument, even one spelled
+    as a number, is passed as the address of a global."""
+    return isinstance(arg, int) or (isinstance(arg, str) and arg.startswith('$'))
+
+
+def _copy(name, value):
+    """A node setting ``name`` to ``value`` that, like a call's result, reuses its slot."""
+    if isinstance(value, str) and value.startswith('$'):
+        return BinOpNode('add', name, value, '0')
+    return AssignNode(name, int(value))
+
+
+def _callee(node):
+    if type(node) is CallNode:
+        return node.func
+    if type(node) is FuncCallAssignNode:
+        return node.func_name
+    return None
+
+
+class _Renamer(NodeVisitor):
+    """Copy body nodes with the callee's locals and labels suffixed.
+
+    ``visit`` returns the copy, or None for a node that cannot be inlined.
+    """
+
+    def __init__(self, suffix, labels, structs):
+        self.suffix = suffix
+        self.labels = labels
+        self.structs = structs
+
+    def _name(self, name):
+        return name + self.suffix
+
+    def _operand(self, operand):
+        if isinstance(operand, str) and operand.startswith('$'):
+            return '$' + self._name(operand[1:])
+        return operand
+
+    def generic_visit(self, node):
+        return None
+
+    def visit_VarDeclNode(self, node):
+        if (isinstance(node.value, int) and node.type not in self.structs) or (
+                node.type == 'bytes' and isinstance(node.value, str)):
+            return VarDeclNode(self._name(node.name), node.type, node.value)
+        return None
+
+    def visit_StrDeclNode(self, node):
+        return StrDeclNode(self._name(node.name), node.value)
+
+    def visit_AssignNode(self, node):
+        return AssignNode(self._name(node.name), node.value)
+
+    def visit_GetNode(self, node):
+        return GetNode(self._name(node.var_name), node.var_type, self._operand(node.target)
+                       if node.target.startswith('$') else self._name(node.target))
+
+    def visit_BinOpNode(self, node):
+        return BinOpNode(node.op, self._name(node.result_var), self._operand(node.left_var),
+                         self._operand(node.right_var))
+
+    def visit_CmpNode(self, node):
+        return CmpNode(self._operand(node.left), self._operand(node.right))
+
+    def visit_LabelNode(self, node):
+        return LabelNode(self._name(node.name))
+
+    def visit_JumpNode(self, node):
+        if node.label not in self.labels:
+            return None
+        return JumpNode(node.condition, self._name(node.label))
+
+    def _args(self, args):
+        if not all(isinstance(arg, (str, int)) and '->' not in str(arg) for arg in args):
+            return None
+        return [self._operand(arg) for arg in args]
+
+    def visit_CallNode(self, node):
+        args = self._args(node.args)
+        return None if args is None else CallNode(node.func, args)
+
+    def visit_FuncCallAssignNode(self, node):
+        args = self._args(node.args)
+        if args is None:
+            return None
+        return FuncCallAssignNode(node.var_name and self._name(node.var_name), node.func_name, args)
+
+    def visit_RetNode(self, node):
+        if node.ret_type != 'void' and not _is_value(node.value):
+            return None
+        return RetNode(node.ret_type, node.value and self._operand(node.value))
+
+
+class _Template:
+    """The body of an inlinable function, ready to copy into call sites."""
+
+    __slots__ = ('name', 'params', 'body', 'labels')
+
+    def __init__(self, name, params, body):
+        self.name = name
+        self.params = params
+        self.body = body
+        self.labels = {node.name for node in body if type(node) is LabelNode}
+
+
+def _template(unit, threshold, structs):
+    """A _Template of a function unit, or None when it cannot or should not be inlined."""
+    header = unit[0]
+    body = [node for node in unit[1:] if not isinstance(node, DECLARATIONS)]
+    if header.name == 'main' or not body or type(body[-1]) is not RetNode:
+        return None
+    if sum(type(node) is not LabelNode for node in body) > threshold:
+        return None
+    if any(_callee(node) == header.name for node in body):
+        return None  # Recursive
+    # Every variable has to be a parameter or a local, or renaming would
+    # change what it refers to
+    params = [param for param in header.params if param]
+    refs = VarRefs(dict.fromkeys(structs))
+    local_names = set(params)
+    used = set()
+    for node in body:
+        defs, uses = refs.visit(node)
+        local_names.update(defs)
+        used.update(uses)
+    if refs.pinned or not used <= local_names:
+        return None
+    template = _Template(header.name, params, body)
+    renamer = _Renamer('', template.labels, structs)
+    if any(renamer.visit(node) is None for node in body):
+        return None
+    return template
+
+
+def _expand(template, site, number, structs):
+    """The nodes replacing call ``site`` by a copy of ``template``, or None."""
+    args = [arg for arg in site.args if arg != '']
+    if len(args) != len(template.params) or not all(map(_is_argument, args)):
+        return None
+    result = site.var_name if type(site) is FuncCallAssignNode else None
+    suffix = f'.{number}'
+    renamer = _Renamer(suffix, template.labels, structs)
+    nodes = [_copy(param + suffix, arg) for param, arg in zip(template.params, args)]
+    end = f'{template.name}.ret{suffix}'
+    jumps = False
+    for index, node in enumerate(template.body):
+        copy = renamer.visit(node)
+        if type(copy) is not RetNode:
+            nodes.append(copy)
+            continue
+        if result is not None and copy.ret_type != 'void':
+            nodes.append(_copy(result, copy.value))
+        if index != len(template.body) - 1:
+            nodes.append(JumpNode('jmp', end))
+            jumps = True
+    if jumps:
+        nodes.append(LabelNode(end))
+    return nodes
+
+
+def _bottom_up(functions, calls):
+    """Function names, each after every function it calls (cycles broken anywhere)."""
+    order = []
+    seen = set()
+    for root in functions:
+        if root in seen:
+            continue
+        seen.add(root)
+        stack = [(root, iter(calls[root]))]
+        while stack:
+            name, pending = stack[-1]
+            for callee in pending:
+                if callee in functions and callee not in seen:
+                    seen.add(callee)
+                    stack.append((callee, iter(calls[callee])))
+                    break
+            else:
+                stack.pop()
+                order.append(name)
+    return order
+
+
+def inline_functions(nodes, counts, options):
+    """Inline calls to small non-recursive functions; see the module docstring."""
+    threshold = options.get('inline_threshold', DEFAULT_THRESHOLD)
+    units = list(split_functions(nodes))
+    structs = {node.name for unit in units for node in unit if type(node) is StructDefNode}
+    functions = {}
+    for index, unit in enumerate(units):
+        if type(unit[0]) is FuncDefNode:
+            # A name defined twice is left alone
+            functions[unit[0].name] = None if unit[0].name in functions else index
+    functions = {name: index for name, index in functions.items() if index is not None}
+    calls = {name: [_callee(node) for node in units[index] if _callee(node)]
+             for name, index in functions.items()}
+
+    templates = {}
+    number = 0
+    for name in _bottom_up(functions, calls):
+        unit = units[functions[name]]
+        new_unit = [unit[0]]
+        for node in unit[1:]:
+            template = templates.get(_callee(node))
+            expansion = template and _expand(template, node, number, structs)
+            if not expansion:
+                new_unit.append(node)
+                continue
+            number += 1
+            counts['sites'] += 1
+            counts[f'{name}->{template.name}'] += 1
+            new_unit.extend(expansion)
+        units[functions[name]] = new_unit
+        template = _template(new_unit, threshold, structs)
+        if template is not None:
+            templates[name] = template
+    return [node for unit in units for node in unit]
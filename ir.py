@@ -0,0 +1,467 @@
+"""Basic-block IR: each function as a control-flow graph of AST nodes.
+
+A block starts at every label and after every jump, ret and tail call,
+so only its last node can transfer control. Blocks keep their source
+order, so lowering them one after another gives the same code as the
+flat node list. Per block, ``defs`` and ``uses`` (variables read before
+any write in the block) feed a standard backward liveness analysis.
+"""
+import re
+from functools import cached_property
+from itertools import chain
+
+from parser_lexer import (FuncDefNode, JumpNode, LabelNode, RetNode, TailCallNode,
+                          ArrayAccessNode, PointerDerefNode, AddressOfNode, ArrayGetNode, GetNode,
+                          PopNode, StrDeclNode, VarDeclNode, VectorOpNode)
+from visitor import NodeVisitor
+
+_ARRAY_TYPE_RE = re.compile(r'\w+\[\d+\]')
+
+
+def split_functions(nodes):
+    """Group a node stream into units: the nodes before the first function,
+    then each FuncDefNode with the nodes that follow it."""
+    unit = []
+    for node in nodes:
+        if type(node) is FuncDefNode and unit:
+            yield unit
+            unit = []
+        unit.append(node)
+    if unit:
+        yield unit
+
+
+def _var(operand):
+    """The variable named by an operand, or None for literals and globals."""
+    if isinstance(operand, str) and operand.startswith('$'):
+        return operand[1:]
+    return None
+
+
+class VarRefs(NodeVisitor):
+    """Collect the variables each node reads and writes.
+
+    ``visit`` returns ``(defs, uses)``. Variables that must live in memory
+    (arrays, structs, ``&`` targets) are added to ``pinned`` as they are seen;
+    struct definitions are added to ``structs``.
+    """
+
+    def __init__(self, structs):
+        self.structs = structs
+        self.pinned = set()
+
+    def generic_visit(self, node):
+        return (), ()
+
+    def _uses(self, *operands):
+        return tuple(name for name in map(_var, operands) if name)
+
+    def visit_StructDefNode(self, node):
+        self.structs[node.name] = node.fields
+        return (), ()
+
+    def visit_FuncDefNode(self, node):
+        return tuple(node.params), ()
+
+    def visit_VarDeclNode(self, node):
+        if isinstance(node.value, list):
+            # Struct initializer: the fields are stored at fixed offsets
+            self.pinned.add(node.name)
+            return (node.name,), self._uses(*(value for _, value in node.value))
+        if node.type in self.structs or _ARRAY_TYPE_RE.match(node.type):
+            self.pinned.add(node.name)
+        return (node.name,), ()
+
+    def visit_AddressOfNode(self, node):
+        self.pinned.add(node.target.lstrip('$'))
+        return (node.var_name,), ()
+
+    def visit_StrDeclNode(self, node):
+        return (node.name,), ()
+
+    def visit_GetNode(self, node):
+        return (node.var_name,), (node.target.lstrip('$'),)
+
+    def visit_PopNode(self, node):
+        return ((node.var_name,) if node.var_name else ()), ()
+
+    def visit_AssignNode(self, node):
+        return (node.name,), ()
+
+    def visit_BinOpNode(self, node):
+        return (node.result_var,), self._uses(node.left_var, node.right_var)
+
+    def visit_CmpNode(self, node):
+        return (), self._uses(node.left, node.right)
+
+    def visit_RetNode(self, node):
+        return (), self._uses(node.value)
+
+    def visit_PushNode(self, node):
+        operands = node.value.replace(',', ' ').split()
+        return (), self._uses(*operands)
+
+    def visit_ArrayAssignNode(self, node):
+        self.pinned.add(node.var_name)
+        return (), self._uses(node.value, node.index)
+
+    def visit_ArrayGetNode(self, node):
+        self.pinned.add(node.array)
+        return (node.var_name,), self._uses(node.index)
+
+    def visit_VectorOpNode(self, node):
+        arrays = self._uses(node.left, node.right)
+        self.pinned.update(arrays)
+        if node.op != 'vsum':
+            self.pinned.add(node.var_name)
+        return (node.var_name,), arrays
+
+    def visit_FuncCallAssignNode(self, node):
+        return ((node.var_name,) if node.var_name else ()), self._arg_uses(node.args)
+
+    def visit_CallNode(self, node):
+        return (), self._arg_uses(node.args)
+
+    def _arg_uses(self, args):
+        uses = []
+        for arg in args:
+            if isinstance(arg, PointerDerefNode):
+                uses.append(arg.var_name.lstrip('$'))
+            elif isinstance(arg, ArrayAccessNode):
+                self.pinned.add(arg.var_name.lstrip('$'))
+                if _var(arg.index):
+                    uses.append(_var(arg.index))
+            elif isinstance(arg, str) and '->' in arg:
+                self.pinned.add(arg.split('->')[0].strip()[1:])
+            elif _var(arg):
+                uses.append(_var(arg))
+        return tuple(uses)
+
+    def visit_TailCallNode(self, node):
+        return self.visit(node.call)
+
+
+def versioned(name, version):
+    """The name of declaration ``version`` (0 for the first) of variable ``name``."""
+    return name if version == 0 else f'{name}#{version}'
+
+
+def unversioned(name):
+    return name.partition('#')[0]
+
+
+# Declarations codegen always gives new storage; see VersionedVarRefs
+_FRESH_DECLARATIONS = (AddressOfNode, GetNode, PopNode, StrDeclNode, ArrayGetNode, FuncDefNode)
+# Nodes that read their operands before their result is declared
+_READS_FIRST = (ArrayGetNode, VectorOpNode)
+
+
+class VersionedVarRefs(VarRefs):
+    """VarRefs where each declaration that gets new storage is a new variable.
+
+    Codegen binds names to storage in source order, not along control
+    flow: after a second ``$x: int = 7;``, the code generated for later
+    statements uses the new x, while the code before it, even in a loop,
+    still uses the old one. Here the second declaration defines ``x#1``
+    (see versioned), and the uses compiled after it read ``x#1``, so
+    liveness and register allocation keep the two apart.
+
+    Declarations are those CodeGenerator._declare is called for: the
+    nodes in _FRESH_DECLARATIONS, scalar VarDeclNodes, parameters, and
+    any other first store to a name.
+    """
+
+    def __init__(self, structs):
+        super().__init__(structs)
+        self.versions = {}  # Latest declaration of each name
+        self.bound = set()  # Names with storage so far
+
+    def _current(self, names):
+        return tuple(versioned(name, self.versions[name]) if name in self.versions else name
+                     for name in names)
+
+    def _declares(self, node):
+        if isinstance(node, _FRESH_DECLARATIONS):
+            return True
+        if type(node) is VarDeclNode:
+            if isinstance(node.value, list) or node.type in self.structs or _ARRAY_TYPE_RE.match(node.type):
+                return False
+            return isinstance(node.value, int) or node.type == 'bytes' or '::' in str(node.value)
+        return None  # Only if the name has no storage yet
+
+    def visit(self, node):
+        if type(node) is TailCallNode:
+            # The result is never stored
+            return (), self._current(super().visit(node.call)[1])
+        defs, uses = super().visit(node)
+        if isinstance(node, _READS_FIRST):
+            uses = self._current(uses)
+        declares = self._declares(node)
+        for name in defs:
+            if declares or (declares is None and name not in self.bound):
+                self.versions[name] = self.versions.get(name, -1) + 1
+            self.bound.add(name)
+        if not isinstance(node, _READS_FIRST):
+            uses = self._current(uses)
+        return self._current(defs), uses
+
+
+_BLOCK_BOUNDARIES = frozenset([LabelNode, JumpNode, RetNode, TailCallNode])
+
+
+class BasicBlock:
+    __slots__ = ('index', 'label', 'nodes', 'start', 'succs', 'preds', 'defs', 'uses',
+                 'live_in', 'live_out')
+
+    def __init__(self, index, start, nodes):
+        self.index = index
+        self.label = None  # Name of the LabelNode the block starts with
+        self.nodes = nodes
+        self.start = start  # Position of the first node in the function
+        self.succs = []
+        self.preds = []
+        # defs, uses, live_in and live_out are set by compute_liveness
+
+    @property
+    def end(self):
+        """Position of the last node (start - 1 for an empty block)."""
+        return self.start + len(self.nodes) - 1
+
+    def terminator(self):
+        return self.nodes[-1] if self.nodes else None
+
+
+class Function:
+    """One funcdef: its header node and its blocks in source order.
+
+    The blocks are only split out, on first use of ``blocks``, when a pass
+    needs the CFG; until then ``nodes`` simply walks the unit. Positions
+    number the header 0 and the body nodes from 1, in order. Def/use sets,
+    ``node_refs`` and ``pinned`` (the variables that have to stay in
+    memory) are only filled in by compute_liveness.
+    """
+
+    def __init__(self, unit, structs):
+        self.unit = unit
+        self.header = unit[0]
+        self.name = self.header.name  # Dump only: codegen takes names from the nodes
+        self.structs = structs
+        self.pinned = set()
+        self.node_refs = None  # (defs, uses) of every node, by position
+        self.entry_label = None  # Label after the prologue, for calls that loop back
+
+    @cached_property
+    def blocks(self):
+        return _split_blocks(self.unit)
+
+    @property
+    def entry(self):
+        return self.blocks[0]
+
+    def nodes(self):
+        """The header and then every block's nodes, in order."""
+        if 'blocks' not in self.__dict__:
+            return iter(self.unit)
+        return chain((self.header,), chain.from_iterable(block.nodes for block in self.blocks))
+
+    def back_edges(self):
+        """(head, tail) of every edge that jumps backwards: the loops."""
+        return [(succ, block) for block in self.blocks for succ in block.succs
+                if succ.index <= block.index]
+
+
+def build_function(unit, structs):
+    """The IR of a FuncDefNode unit (see split_functions)."""
+    return Function(unit, structs)
+
+
+def _split_blocks(unit):
+    # A block starts at each label and after each jump, ret or tail call
+    starts = [pos + (type(node) is not LabelNode) for pos, node in enumerate(unit)
+              if type(node) in _BLOCK_BOUNDARIES]
+    starts = sorted({1, *starts} - {len(unit)}) if len(unit) > 1 else [1]
+    blocks = [BasicBlock(index, start, unit[start:end]) for index, (start, end)
+              in enumerate(zip(starts, starts[1:] + [max(len(unit), 2)]))]
+    _link(blocks)
+    return blocks
+
+
+def relink(func):
+    """Renumber the blocks and recompute their edges after a pass changed them."""
+    if not func.blocks:
+        func.blocks.append(BasicBlock(0, 1, []))
+    for index, block in enumerate(func.blocks):
+        block.index = index
+        block.label = None
+        block.succs, block.preds = [], []
+    _link(func.blocks)
+
+
+def _link(blocks):
+    labels = {}
+    for block in blocks:
+        if block.nodes and type(block.nodes[0]) is LabelNode:
+            block.label = block.nodes[0].name
+            labels[block.label] = block
+
+    for block in blocks:
+        last = block.nodes[-1] if block.nodes else None
+        cls = type(last)
+        if cls is JumpNode:
+            target = labels.get(last.label)
+            if target is not None:
+                block.succs.append(target)
+                target.preds.append(block)
+            if last.condition == 'jmp':
+                continue
+        elif cls is RetNode or cls is TailCallNode:
+            continue
+        # Falls through to the next block
+        if block.index + 1 < len(blocks):
+            target = blocks[block.index + 1]
+            if target not in block.succs:
+                block.succs.append(target)
+                target.preds.append(block)
+
+
+def _def_use(func, versioned):
+    # A copy: structs defined inside the function are not visible to codegen yet
+    refs = (VersionedVarRefs if versioned else VarRefs)(dict(func.structs))
+    func.node_refs = [refs.visit(func.header)]
+    pos = 1
+    for block in func.blocks:
+        block.start = pos
+        pos += len(block.nodes)
+        block.defs, block.uses = set(), set()
+        for node in block.nodes:
+            defs, uses = refs.visit(node)
+            func.node_refs.append((defs, uses))
+            block.uses.update(name for name in uses if name not in block.defs)
+            block.defs.update(defs)
+    func.pinned = refs.pinned
+
+
+def compute_liveness(func, versioned=False):
+    """Fill in the def/use sets and live_in/live_out of every block.
+
+    Parameters are defined by the header, before the entry block, so they
+    show up as live on entry. With ``versioned``, variables are those of
+    VersionedVarRefs.
+    """
+    _def_use(func, versioned)
+    for block in func.blocks:
+        block.live_in, block.live_out = set(), set()
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(func.blocks):
+            live_out = set().union(*(succ.live_in for succ in block.succs))
+            live_in = block.uses | (live_out - block.defs)
+            if live_out != block.live_out or live_in != block.live_in:
+                block.live_out, block.live_in = live_out, live_in
+                changed = True
+
+
+class NodeFormatter(NodeVisitor):
+    """Render nodes in (roughly) SCB source syntax for IR dumps."""
+
+    def generic_visit(self, node):
+        fields = ', '.join(f'{name}={getattr(node, name)!r}' for name in type(node).__slots__)
+        return f'{type(node).__name__}({fields})'
+
+    def _arg(self, arg):
+        if isinstance(arg, PointerDerefNode):
+            return f'{arg.var_name}<{arg.index}>'
+        if isinstance(arg, ArrayAccessNode):
+            return f'{arg.var_name}[{arg.index}]'
+        return str(arg)
+
+    def visit_FuncDefNode(self, node):
+        return f"funcdef %{node.name}({', '.join(node.params)})"
+
+    def visit_LabelNode(self, node):
+        return f'.{node.name}:'
+
+    def visit_JumpNode(self, node):
+        return f'{node.condition} .{node.label}'
+
+    def visit_CmpNode(self, node):
+        return f'cmp {node.left}, {node.right}'
+
+    def visit_RetNode(self, node):
+        return f'ret {node.ret_type}' + (f' {node.value}' if node.value is not None else '')
+
+    def visit_VarDeclNode(self, node):
+        value = node.value
+        if isinstance(value, list):
+            value = node.type + ' { ' + ', '.join(f'${name}: {v}' for name, v in value) + ' }'
+        elif node.type == 'bytes':
+            value = f'"{value}"'
+        return f'${node.name}: {node.type} = {value}'
+
+    def visit_StrDeclNode(self, node):
+        return f'${node.name}: bytes = "{node.value}"'
+
+    def visit_AssignNode(self, node):
+        return f'${node.name} = {node.value}'
+
+    def visit_GetNode(self, node):
+        return f'${node.var_name}: {node.var_type} = get {node.target}'
+
+    def visit_BinOpNode(self, node):
+        return f'${node.result_var} = {node.op} {node.left_var}, {node.right_var}'
+
+    def visit_AddressOfNode(self, node):
+        return f'${node.var_name}: {node.var_type} = &{node.target}'
+
+    def visit_ArrayAssignNode(self, node):
+        return f'${node.var_name}[{node.index}] = {node.value}'
+
+    def visit_ArrayGetNode(self, node):
+        return f'${node.var_name}: {node.var_type} = ${node.array}[{node.index}]'
+
+    def visit_VectorOpNode(self, node):
+        operands = node.left if node.right is None else f'{node.left}, {node.right}'
+        return f'${node.var_name}: {node.var_type} = {node.op} {operands}'
+
+    def visit_PushNode(self, node):
+        return f'push {node.value}'
+
+    def visit_PopNode(self, node):
+        if node.var_name is None:
+            return 'pop'
+        return f'${node.var_name}: {node.var_type} = pop'
+
+    def visit_CallNode(self, node):
+        return f"call %{node.func}({', '.join(map(self._arg, node.args))})"
+
+    def visit_FuncCallAssignNode(self, node):
+        if node.var_name is None:
+            return f"call %{node.func_name}({', '.join(map(self._arg, node.args))})"
+        return f"${node.var_name} = call %{node.func_name}({', '.join(map(self._arg, node.args))})"
+
+    def visit_TailCallNode(self, node):
+        target = f' -> .{node.loop_label}' if node.loop_label else ''
+        return f'tail {self.visit(node.call)}{target}'
+
+
+def _names(names):
+    return ' '.join(sorted(names)) or '-'
+
+
+def format_function(func):
+    """A textual dump of a function's blocks, edges and liveness."""
+    formatter = NodeFormatter()
+    lines = [formatter.visit(func.header)]
+    if func.pinned:
+        lines.append(f'  in memory: {_names(func.pinned)}')
+    for block in func.blocks:
+        title = f'b{block.index}' + (' (entry)' if block.index == 0 else '')
+        lines.append(f'  {title}  preds: {_names(f"b{b.index}" for b in block.preds)}'
+                     f'  succs: {_names(f"b{b.index}" for b in block.succs)}')
+        lines.append(f'    live in:  {_names(block.live_in)}')
+        lines.append(f'    defs: {_names(block.defs)}  uses: {_names(block.uses)}')
+        for node in block.nodes:
+            lines.append(f'    {formatter.visit(node)}')
+        lines.append(f'    live out: {_names(block.live_out)}')
+    return '\n'.join(lines)
@@ -0,0 +1,259 @@
+"""Instruction selection for SCB arithmetic.
+
+Codegen asks an InstructionSelector for the instructions computing
+``left op right`` into rax, for ``add``, ``sub``, ``mul``, ``div``,
+``shl`` and ``shr``. Operands are what codegen would otherwise use
+directly: registers, memory references and decimal immediates.
+
+Every rule proposes candidate sequences and a small cost model, roughly
+the latency of each instruction (COSTS), picks the cheapest. Rules cover
+``lea`` for additions and multiplications by 2, 3, 4, 5, 8 and 9, shifts
+for powers of two and division by a constant through a multiplication by
+its reciprocal ("magic number", Hacker's Delight 10-1). Division keeps
+idiv's semantics: quotients are truncated toward zero, and dividing by 0
+or -1 still goes through idiv, which faults where the program would.
+"""
+import re
+from collections import Counter
+
+from peephole import is_register, parse
+
+# Rough latency in cycles of each instruction on its register form
+COSTS = {
+    'mov': 1, 'lea': 1, 'xor': 1, 'add': 1, 'sub': 1, 'neg': 1,
+    'shl': 1, 'shr': 1, 'sar': 1, 'cqo': 1,
+    'imul': 3, 'idiv': 40,
+}
+MEMORY_COST = 3  # Extra for an operand in memory
+CL_SHIFT_COST = 1  # Extra for a shift by cl (two micro-ops)
+WIDE_MUL_COST = 1  # Extra for the one-operand imul, which also writes rdx
+
+# Plain decimal only: the assembler reads a leading 0 as octal
+_INT_RE = re.compile(r'-?(?:0|[1-9]\d*)$')
+_LEA_SCALES = (2, 4, 8)
+
+
+def _imm(operand):
+    """The value of an immediate operand, or None."""
+    if isinstance(operand, int):
+        return operand
+    if isinstance(operand, str) and _INT_RE.match(operand):
+        return int(operand)
+    return None
+
+
+def _fits_imm32(value):
+    return -2 ** 31 <= value < 2 ** 31
+
+
+def cost(lines):
+    """Estimated cycles of a sequence of instruction lines."""
+    total = 0
+    for line in lines:
+        mnemonic, operands = parse(line)
+        total += COSTS[mnemonic]
+        if mnemonic != 'lea' and any('[' in op for op in operands):
+            total += MEMORY_COST
+        if operands and operands[-1] == 'cl':
+            total += CL_SHIFT_COST
+        if mnemonic == 'imul' and len(operands) == 1:
+            total += WIDE_MUL_COST
+    return total
+
+
+def _load(operand):
+    return [f'    mov rax, {operand}']
+
+
+def _operand(value):
+    """``value`` as a second operand: immediates that do not fit go through rcx."""
+    imm = _imm(value)
+    if imm is not None and not _fits_imm32(imm):
+        return [f'    mov rcx, {imm}'], 'rcx'
+    return [], value
+
+
+def _offset(value):
+    return f' + {value}' if value >= 0 else f' - {-value}'
+
+
+def _generic(op, left, right):
+    mnemonic = {'add': 'add', 'sub': 'sub', 'mul': 'imul'}[op]
+    setup, right = _operand(right)
+    return setup + _load(left) + [f'    {mnemonic} rax, {right}']
+
+
+def _add(left, right):
+    if _imm(left) is not None and _imm(right) is None:
+        left, right = right, left
+    yield 'add', _generic('add', left, right)
+    value = _imm(right)
+    if value == 0:
+        yield 'identity', _load(left)
+    if not is_register(left):
+        return
+    if is_register(right):
+        yield 'lea', [f'    lea rax, [{left} + {right}]']
+    elif value is not None and _fits_imm32(value):
+        yield 'lea', [f'    lea rax, [{left}{_offset(value)}]']
+
+
+def _sub(left, right):
+    yield 'sub', _generic('sub', left, right)
+    value = _imm(right)
+    if value == 0:
+        yield 'identity', _load(left)
+    if _imm(left) == 0 and _imm(right) is None:
+        yield 'neg', _load(right) + ['    neg rax']
+    if is_register(left) and value is not None and _fits_imm32(-value):
+        yield 'lea', [f'    lea rax, [{left}{_offset(-value)}]']
+
+
+def _multiply_by(operand, factor):
+    """Candidate sequences computing ``operand * factor`` for factor > 0 without imul."""
+    shift = (factor & -factor).bit_length() - 1
+    odd = factor >> shift
+    if odd == 1:
+        if is_register(operand) and factor in _LEA_SCALES:
+            yield 'lea', [f'    lea rax, [{operand}*{factor}]']
+        yield 'shift', _load(operand) + ([f'    shl rax, {shift}'] if shift else [])
+        return
+    if odd in (3, 5, 9):
+        if is_register(operand):
+            lines = [f'    lea rax, [{operand} + {operand}*{odd - 1}]']
+        else:
+            lines = _load(operand) + [f'    lea rax, [rax + rax*{odd - 1}]']
+        yield 'lea', lines + ([f'    shl rax, {shift}'] if shift else [])
+
+
+def _mul(left, right):
+    if _imm(left) is not None and _imm(right) is None:
+        left, right = right, left
+    yield 'imul', _generic('mul', left, right)
+    factor = _imm(right)
+    if factor is None:
+        return
+    if factor == 0:
+        yield 'zero', ['    xor eax, eax']
+        return
+    for name, lines in _multiply_by(left, abs(factor)):
+        yield name, lines + (['    neg rax'] if factor < 0 else [])
+
+
+def magic(divisor):
+    """(multiplier, shift) for signed 64-bit division by ``divisor``, 2 <= |divisor| < 2**63.
+
+    The high 64 bits of n * multiplier, corrected by n when the multiplier's
+    sign differs from the divisor's, shifted right arithmetically and
+    rounded toward zero, are n / divisor.
+    """
+    two63 = 1 << 63
+    ad = abs(divisor)
+    t = two63 + (1 if divisor < 0 else 0)
+    anc = t - 1 - t % ad  # Absolute value of nc
+    p = 63
+    q1, r1 = divmod(two63, anc)
+    q2, r2 = divmod(two63, ad)
+    while True:
+        p += 1
+        q1, r1 = 2 * q1, 2 * r1
+        if r1 >= anc:
+            q1, r1 = q1 + 1, r1 - anc
+        q2, r2 = 2 * q2, 2 * r2
+        if r2 >= ad:
+            q2, r2 = q2 + 1, r2 - ad
+        delta = ad - r2
+        if not (q1 < delta or (q1 == delta and r1 == 0)):
+            break
+    multiplier = (q2 + 1) % (1 << 64)
+    if divisor < 0:
+        multiplier = -multiplier % (1 << 64)
+    if multiplier >= two63:
+        multiplier -= 1 << 64
+    return multiplier, p - 64
+
+
+def _div(left, right):
+    divisor = _imm(right)
+    if divisor is None:
+        yield 'idiv', _load(left) + ['    cqo', f'    idiv {right}']
+        return
+    yield 'idiv', _load(left) + [f'    mov rcx, {divisor}', '    cqo', '    idiv rcx']
+    if divisor == 1:
+        yield 'identity', _load(left)
+    if divisor in (0, 1, -1) or not -2 ** 63 < divisor < 2 ** 63:
+        return
+    negate = ['    neg rax'] if divisor < 0 else []
+    ad = abs(divisor)
+    if ad & (ad - 1) == 0:
+        # Add |d| - 1 to negative dividends so that the shift rounds toward zero
+        shift = ad.bit_length() - 1
+        if shift == 1:
+            bias = ['    mov rdx, rax', '    shr rdx, 63']
+        else:
+            bias = ['    mov rdx, rax', '    sar rdx, 63', f'    shr rdx, {64 - shift}']
+        yield 'shift-div', _load(left) + bias + ['    add rax, rdx', f'    sar rax, {shift}'] + negate
+        return
+    multiplier, shift = magic(divisor)
+    dividend = left if is_register(left) else 'rcx'
+    lines = _load(left)
+    correction = []
+    if multiplier < 0 < divisor:
+        correction = [f'    add rdx, {dividend}']
+    elif divisor < 0 < multiplier:
+        correction = [f'    sub rdx, {dividend}']
+    if correction and dividend == 'rcx':
+        lines.append('    mov rcx, rax')
+    lines += [f'    mov rdx, {multiplier}', '    imul rdx'] + correction
+    if shift:
+        lines.append(f'    sar rdx, {shift}')
+    # Round toward zero: add one to a negative quotient
+    lines += ['    mov rax, rdx', '    shr rax, 63', '    add rax, rdx']
+    yield 'magic-div', lines
+
+
+def _shift(mnemonic):
+    def candidates(left, right):
+        if right == 'cl':
+            yield mnemonic, _load(left) + [f'    {mnemonic} rax, cl']
+            return
+        count = _imm(right)
+        if count is None:
+            yield mnemonic, _load(left) + [f'    mov rcx, {right}', f'    {mnemonic} rax, cl']
+            return
+        # The processor only uses the low six bits of the count
+        count &= 63
+        yield mnemonic, _load(left) + ([f'    {mnemonic} rax, {count}'] if count else [])
+        if mnemonic == 'shl' and is_register(left) and 1 << count in _LEA_SCALES:
+            yield 'lea', [f'    lea rax, [{left}*{1 << count}]']
+    return candidates
+
+
+_RULES = {
+    'add': _add,
+    'sub': _sub,
+    'mul': _mul,
+    'div': _div,
+    'shl': _shift('shl'),
+    'shr': _shift('shr'),
+}
+
+
+class InstructionSelector:
+    """Pick the cheapest sequence for each arithmetic operation.
+
+    ``counts`` records how often each kind of sequence (``lea``,
+    ``shift``, ``magic-div``, ``idiv``...) was chosen.
+    """
+
+    def __init__(self, counts=None):
+        self.counts = Counter() if counts is None else counts
+
+    def arith(self, op, left, right):
+        """Lines computing ``left op right`` into rax; clobbers rcx and rdx.
+
+        A ``right`` of ``cl`` shifts by whatever cl holds.
+        """
+        name, lines = min(_RULES[op](left, right), key=lambda c: (cost(c[1]), len(c[1])))
+        self.counts[name] += 1
+        return lines
@@ -0,0 +1,143 @@
+"""Memory layout of SCB types.
+
+Scalars are ``int8``, ``int16``, ``int32``, ``int64`` and ``byte`` (an
+unsigned int8), each aligned to its size. ``int``, ``bytes``, pointers,
+enums and any other named type take 8 bytes. A struct lays its fields
+out in declaration order, each at the next offset aligned for it; the
+struct is aligned like its most aligned field and padded to a multiple
+of that. A field of struct type holds the whole nested struct.
+
+Layouts maps each ``structdef`` to its StructLayout, computed once when
+the definition is seen. Field lookups, including chains like
+``a->b->c``, are dictionary lookups from then on.
+"""
+import re
+
+SCALAR_SIZES = {'int8': 1, 'int16': 2, 'int32': 4, 'int64': 8, 'byte': 1}
+WORD = 8  # Size of every other non-struct type
+
+_PTR = {1: 'BYTE PTR', 2: 'WORD PTR', 4: 'DWORD PTR', 8: 'QWORD PTR'}
+_UNSIGNED = {'byte'}
+_RAX = {1: 'al', 2: 'ax', 4: 'eax', 8: 'rax'}
+_INT_RE = re.compile(r'-?\d+$')
+
+
+def _align_up(value, alignment):
+    return (value + alignment - 1) // alignment * alignment
+
+
+class Field:
+    __slots__ = ('name', 'type', 'offset', 'size')
+
+    def __init__(self, name, type, offset, size):
+        self.name = name
+        self.type = type
+        self.offset = offset
+        self.size = size
+
+
+class StructLayout:
+    """Fields of a struct by name, its size and its alignment, in bytes."""
+
+    __slots__ = ('name', 'fields', 'size', 'align')
+
+    def __init__(self, name, fields, size, align):
+        self.name = name
+        self.fields = fields
+        self.size = size
+        self.align = align
+
+
+class Layouts:
+    """The layout of every struct defined so far."""
+
+    def __init__(self):
+        self.structs = {}
+
+    def __contains__(self, type):
+        return type in self.structs
+
+    def size(self, type):
+        if type in self.structs:
+            return self.structs[type].size
+        return SCALAR_SIZES.get(type, WORD)
+
+    def align(self, type):
+        if type in self.structs:
+            return self.structs[type].align
+        return SCALAR_SIZES.get(type, WORD)
+
+    def define(self, name, fields):
+        """Lay out struct ``name`` from its (field, type) pairs; a redefinition replaces it."""
+        offset = 0
+        align = 1
+        layout = {}
+        for field, type in fields:
+            size, field_align = self.size(type), self.align(type)
+            offset = _align_up(offset, field_align)
+            layout[field] = Field(field, type, offset, size)
+            offset += size
+            align = max(align, field_align)
+        self.structs[name] = StructLayout(name, layout, _align_up(offset, align), align)
+        return self.structs[name]
+
+    def resolve(self, type, path):
+        """(offset, type) of the field reached from a ``type`` value through the field names of ``path``.
+
+        The walk stops at the first type that is not a struct; a missing
+        field raises KeyError.
+        """
+        offset = 0
+        for field in path:
+            if type not in self.structs:
+                break
+            entry = self.structs[type].fields[field]
+            offset += entry.offset
+            type = entry.type
+        return offset, type
+
+
+def value_size(type):
+    """Bytes a load or store of a ``type`` value moves: structs move their first word."""
+    return SCALAR_SIZES.get(type, WORD)
+
+
+def load(reg, type, address):
+    """The instruction loading a ``type`` value at ``address`` (``[...]``) into 64-bit ``reg``.
+
+    Narrower values are sign-extended, or zero-extended for ``byte``.
+    """
+    size = value_size(type)
+    operand = f'{_PTR[size]} {address}'
+    if size == WORD:
+        return f'    mov {reg}, {operand}'
+    if type in _UNSIGNED:
+        return f'    movzx {reg}, {operand}'
+    if size == 4:
+        return f'    movsxd {reg}, {operand}'
+    return f'    movsx {reg}, {operand}'
+
+
+def store(address, type, value):
+    """The instruction storing the low bytes of rax, or an immediate ``value``, as a ``type`` at ``address``.
+
+    Immediates are truncated to the field's width, as a store of rax is.
+    """
+    size = value_size(type)
+    if value == 'rax':
+        value = _RAX[size]
+    elif size < WORD and _INT_RE.match(value):
+        value = int(value) & (1 << 8 * size) - 1
+    return f'    mov {_PTR[size]} {address}, {value}'
+
+
+def copy(dst, src, size):
+    """Lines copying ``size`` bytes from rbp - ``src`` to rbp - ``dst`` through rax, widest moves first."""
+    lines = []
+    offset = 0
+    for width in (8, 4, 2, 1):
+        while size - offset >= width:
+            lines += [f'    mov {_RAX[width]}, {_PTR[width]} [rbp - {src - offset}]',
+                      f'    mov {_PTR[width]} [rbp - {dst - offset}], {_RAX[width]}']
+            offset += width
+    return lines
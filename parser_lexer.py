@@ -1,6 +1,16 @@
 import re
+import sys
+
+from visitor import TokenDispatcher
+
+_intern = sys.intern
+
+# Element-wise operations on arrays, $c: int[N] = vadd $a, $b; (see vector.py)
+VECTOR_BINARY_OPS = ('vadd', 'vsub', 'vmul', 'vmin', 'vmax')
 
 class Token:
+    __slots__ = ('type', 'value')
+
     def __init__(self, type_, value):
         self.type = type_
         self.value = value
@@ -8,108 +18,186 @@ class Token:
     def __repr__(self):
         return f"Token({self.type}, {self.value})"
 
+# All token patterns are compiled once, at import time.
+_DATADEF_RE = re.compile(r'datadef\s+(\w+):\s+bytes\s*=\s*"(.*)";')
+_EXTERN_RE = re.compile(r'extern\s+%(\w+);')
+_FUNCDEF_RE = re.compile(r'funcdef\s+%(\w+)\((.*)\)\s*->\s*\w+\s*{')
+_CALL_RE = re.compile(r'call\s+%(\w+)\((.*)\);')
+_CALL_POINTER_ARG_RE = re.compile(r'(\$?\w+)<(\d+)>')
+_CALL_ARRAY_ARG_RE = re.compile(r'(\$?\w+)\[(\d+|\$\w+)\]')
+_RET_RE = re.compile(r'ret\s+(void|\w+)(?:\s+(\$?\w+))?;')
+_POP_RE = re.compile(r'\$(\w+):\s*(\w+)\s*=\s*pop;')
+_ARRAY_ASSIGN_START_RE = re.compile(r'^\$\w+\[')
+_GET_SEARCH_RE = re.compile(r'=\s*get\s+\$?\w+\s*;')
+_GET_RE = re.compile(r'\$(\w+)\*?:\s*([\w\[\]]+)\s*=\s*get\s+(\$?\w+)\s*;')
+_VAR_DECL_RE = re.compile(
+    r'\$(\w+)\*?:\s*([\w\[\]]+)\s*=\s*'  # allow types like int[10]
+    r'(?:call\s+%(\w+)\((.*)\)|'
+    r'(\w+)\s*{([^}]*)}|'              # Struct initializer
+    r'(\w+)::(\w+)|'                   # Enum value
+    r'array\s+((?:-?\d+\s*,\s*)*-?\d+)|'
+    r'(\$?\w+)<(\d+)>|'                # Pointer dereference uses "<...>"
+    r'(\$?\w+)\[(\d+|\$\w+)\]|'       # Array access uses "[...]", by constant or variable
+    r'&(\$?\w+)|'                      # Address-of operator
+    r'"([^"]*)"|'                       # String literal
+    r'(\d+)|'                           # Number
+    r'([a-z]+)\s+(\$?\w+),\s*(\$?\w+)|'  # BinOp, or a vector operation
+    r'(vsum)\s+(\$\w+)'                 # Horizontal sum of an array
+    r')\s*;'
+)
+_STRUCT_FIELD_INIT_RE = re.compile(r'\$(\w+):\s*(?:"([^"]+)"|(\$?\w+))')
+_LABEL_RE = re.compile(r'^\.(\w+):$')
+_CMP_RE = re.compile(r'cmp\s+(\$?\w+),\s*(\$?\w+);')
+_JUMP_RE = re.compile(r'(jge|je|jg|jl|jne|jle|jmp)\s+\.(\w+);')
+_STRUCTDEF_RE = re.compile(
+    r'structdef\s+(\w+)\s*{\s*((?:[\s\$]*\w+:\s*\w+;?\s*)*)\s*}',
+    re.DOTALL
+)
+_STRUCT_FIELD_SPLIT_RE = re.compile(r';\s*')
+_STRUCT_FIELD_RE = re.compile(r'\$(\w+):\s*(\w+)')
+_ENUMDEF_RE = re.compile(
+    r'enumdef\s+(\w+)\s*{\s*((?:[\s\w,]+\s*)*)\s*}',
+    re.DOTALL
+)
+_BSSDEF_RE = re.compile(r'bssdef\s+(\w+):\s+bytesbuff\s*=\s*(\d+);')
+_ARRAY_ASSIGN_RE = re.compile(r'\$(\w+)\[(\d+|\$\w+)\]\s*=\s*(.+);')
+_INT_LITERAL_RE = re.compile(r'^-?\d+$')
+
+
+def _array_index(text):
+    """An array index: a constant as an int, a variable as its ``$name``."""
+    return text if text.startswith('$') else int(text)
+
+
+# Statements are dispatched on the first character of the line. Each entry is
+# the keyword prefix a line must start with and the name of the matcher that
+# handles it; lines that do not start with their keyword fall back to
+# Lexer._match_other, exactly like the end of the old elif cascade.
+_LEADING_KEYWORDS = {
+    '.': ('.', '_match_label'),
+    'd': ('datadef', '_match_datadef'),
+    'e': ('extern', '_match_extern'),
+    'f': ('funcdef', '_match_funcdef'),
+    'c': ('call', '_match_call'),
+    'r': ('ret', '_match_ret'),
+    'p': ('push', '_match_push'),
+}
+
 class Lexer:
     def __init__(self, source):
-        self.source = source.split('\n')
+        # Either the whole program text or an open file; a file is read
+        # lazily, one line at a time, by iter_tokens().
+        self.source = source.split('\n') if isinstance(source, str) else source
         self.pos = 0
         self.current_line = 0
+        self._dispatch = {
+            first: (keyword, getattr(self, matcher))
+            for first, (keyword, matcher) in _LEADING_KEYWORDS.items()
+        }
     
     def tokenize(self):
-        tokens = []
+        return list(self.iter_tokens())
+
+    def iter_tokens(self):
+        """Yield tokens one at a time without materialising the whole stream."""
         in_struct = False
         struct_lines = []
         in_enum = False
         enum_lines = []
+        dispatch = self._dispatch
         for line in self.source:
             line = line.strip()
-            if not line or line.startswith('//'):
+            if not line:
+                continue
+            first = line[0]
+            if first == '/' and line.startswith('//'):
                 continue
 
             # Check for use runtime first
-            use_runtime = self._match_use_runtime(line)
-            if use_runtime:
-                tokens.append(use_runtime)
-                continue
-                
-            if line.startswith('structdef'):
-                in_struct = True
-                struct_lines = [line]
-                continue
-                
-            if in_struct:
-                struct_lines.append(line)
-                if '}' in line:
-                    full_struct = ' '.join(struct_lines)
-                    tokens.append(self._match_structdef(full_struct))
-                    in_struct = False
+            if first == 'u' and line == 'use runtime;':
+                yield Token('USE_RUNTIME', None)
                 continue
-                
-            if line.startswith('enumdef'):
-                in_enum = True
-                enum_lines = [line]
-                continue
-                
-            if in_enum:
-                enum_lines.append(line)
-                if '}' in line:
-                    full_enum = ' '.join(enum_lines)
-                    tokens.append(self._match_enumdef(full_enum))
-                    in_enum = False
-                continue
-                
-            # Add bssdef handling
-            if line.startswith('bssdef'):
-                tokens.append(self._match_bssdef(line))
-                
-            # Add label matching
-            if line.startswith('.'):
-                tokens.append(self._match_label(line))
-            # Match tokens
-            elif line.startswith('datadef'):
-                tokens.append(self._match_datadef(line))
-            elif line.startswith('extern'):
-                tokens.append(self._match_extern(line))
-            elif line.startswith('funcdef'):
-                tokens.append(self._match_funcdef(line))
-            elif line.startswith('call'):
-                tokens.append(self._match_call(line))
-            elif line.startswith('ret'):
-                tokens.append(self._match_ret(line))
-            elif line.startswith('push'):
-                value = line.split(' ', 1)[1].rstrip(';')
-                tokens.append(Token('PUSH', value))
-            elif '= pop' in line:
-                match = re.match(r'\$(\w+):\s*(\w+)\s*=\s*pop;', line)
-                if match:
-                    tokens.append(Token('POP', (match.group(1), match.group(2))))
-            elif line.startswith('$'):
+
+            # Struct and enum bodies span several lines; only lines that can
+            # start or continue one of them need the slower state handling.
+            if in_struct or in_enum or first in 'seb':
+                if line.startswith('structdef'):
+                    in_struct = True
+                    struct_lines = [line]
+                    continue
+
+                if in_struct:
+                    struct_lines.append(line)
+                    if '}' in line:
+                        full_struct = ' '.join(struct_lines)
+                        yield self._match_structdef(full_struct)
+                        in_struct = False
+                    continue
+
+                if line.startswith('enumdef'):
+                    in_enum = True
+                    enum_lines = [line]
+                    continue
+
+                if in_enum:
+                    enum_lines.append(line)
+                    if '}' in line:
+                        full_enum = ' '.join(enum_lines)
+                        yield self._match_enumdef(full_enum)
+                        in_enum = False
+                    continue
+
+                # A bssdef line is still offered to the statement matchers below
+                if line.startswith('bssdef'):
+                    yield self._match_bssdef(line)
+
+            rule = dispatch.get(first)
+            if rule is not None and line.startswith(rule[0]):
+                token = rule[1](line)
+            elif first == '$' and '= pop' not in line:
                 # If the line starts with $<name>[..., it's an array element assignment.
-                if re.match(r'^\$\w+\[', line):
-                    tokens.append(self._match_array_assign(line))
+                if _ARRAY_ASSIGN_START_RE.match(line):
+                    token = self._match_array_assign(line)
                 else:
-                    tokens.append(self._match_var_decl(line))
-            elif 'add' in line:
-                tokens.append(self._match_binop(line))
-            elif line.startswith('cmp'):
-                tokens.append(self._match_cmp(line))
-            elif line.startswith('j'):
-                tokens.append(self._match_jump(line))
-        return tokens
+                    token = self._match_var_decl(line)
+            else:
+                token = self._match_other(line)
+            if token is not None:
+                yield token
+
+    def _match_other(self, line):
+        # Lines without a leading keyword of their own: pops, compares and jumps
+        if '= pop' in line:
+            match = _POP_RE.match(line)
+            if match:
+                return Token('POP', (match.group(1), match.group(2)))
+            return None
+        if 'add' in line:
+            raise SyntaxError(f"Invalid statement: {line}")
+        if line.startswith('cmp'):
+            return self._match_cmp(line)
+        if line.startswith('j'):
+            return self._match_jump(line)
+        return None
+
+    def _match_push(self, line):
+        value = line.split(' ', 1)[1].rstrip(';')
+        return Token('PUSH', value)
     
     def _match_datadef(self, line):
-        match = re.match(r'datadef\s+(\w+):\s+bytes\s*=\s*"(.*)";', line)
+        match = _DATADEF_RE.match(line)
         if match:
             return Token('DATA_DEF', (match.group(1), match.group(2)))
         raise SyntaxError(f"Invalid datadef: {line}")
     
     def _match_extern(self, line):
-        match = re.match(r'extern\s+%(\w+);', line)
+        match = _EXTERN_RE.match(line)
         if match:
             return Token('EXTERN', match.group(1))
         raise SyntaxError(f"Invalid extern: {line}")
     
     def _match_funcdef(self, line):
-        match = re.match(r'funcdef\s+%(\w+)\((.*)\)\s*->\s*\w+\s*{', line)
+        match = _FUNCDEF_RE.match(line)
         if match:
             # Strip $ and * from parameter names
             params = [p.split(':')[0].strip().lstrip('$').lstrip('*') for p in match.group(2).split(',')]
@@ -117,28 +205,28 @@ class Lexer:
         raise SyntaxError(f"Invalid funcdef: {line}")
     
     def _match_call(self, line):
-        match = re.match(r'call\s+%(\w+)\((.*)\);', line)
+        match = _CALL_RE.match(line)
         if match:
             func = match.group(1)
             args = []
             for arg in match.group(2).split(','):
                 arg = arg.split(':')[0].strip()
                 # Check for pointer dereference using "<>"
-                pointer_match = re.match(r'(\$?\w+)<(\d+)>', arg)
+                pointer_match = '<' in arg and _CALL_POINTER_ARG_RE.match(arg)
                 if pointer_match:
                     args.append(PointerDerefNode(pointer_match.group(1), int(pointer_match.group(2))))
                     continue
                 # Check for array access using "[]"
-                array_match = re.match(r'(\$?\w+)\[(\d+)\]', arg)
+                array_match = '[' in arg and _CALL_ARRAY_ARG_RE.match(arg)
                 if array_match:
-                    args.append(ArrayAccessNode(array_match.group(1), int(array_match.group(2))))
+                    args.append(ArrayAccessNode(array_match.group(1), _array_index(array_match.group(2))))
                     continue
                 args.append(arg)
             return Token('CALL', (func, args))
         raise SyntaxError(f"Invalid call: {line}")
     
     def _match_ret(self, line):
-        match = re.match(r'ret\s+(void|\w+)(?:\s+(\$?\w+))?;', line)
+        match = _RET_RE.match(line)
         if match:
             ret_type = match.group(1)
             value = match.group(2) if ret_type != 'void' else None
@@ -148,35 +236,14 @@ class Lexer:
     def _match_var_decl(self, line):
         # NEW: Handle "get" keyword for variable declarations, e.g.,
         # "$x2: int = get $x;"
-        if re.search(r'=\s*get\s+\$?\w+\s*;', line):
-            match = re.match(r'\$(\w+)\*?:\s*([\w\[\]]+)\s*=\s*get\s+(\$?\w+)\s*;', line)
+        if 'get' in line and _GET_SEARCH_RE.search(line):
+            match = _GET_RE.match(line)
             if match:
                 var_name = match.group(1)
                 var_type = match.group(2)
                 target = match.group(3)
                 return Token('GET', (var_name, var_type, target))
-        # Updated regex pattern to support array initializers and types like int[10]
-        struct_init = r'(\w+)\s*{([^}]*)}'
-        enum_value = r'(\w+)::(\w+)'
-        # NEW: Pointer dereference uses "<...>"
-        pointer_access = r'(\$?\w+)<(\d+)>'
-        # Update array access to use square brackets: "[...]"
-        array_access = r'(\$?\w+)\[(\d+)\]'
-        pattern = (
-            r'\$(\w+)\*?:\s*([\w\[\]]+)\s*=\s*'  # allow types like int[10]
-            r'(?:call\s+%(\w+)\((.*)\)|'
-            f'{struct_init}|'
-            f'{enum_value}|'
-            r'array\s+((?:-?\d+\s*,\s*)*-?\d+)|'
-            f'{pointer_access}|'  # NEW alternative for pointer dereference
-            f'{array_access}|'    # Updated alternative for array access
-            r'&(\$?\w+)|'        # Address-of operator
-            r'"([^"]*)"|'        # String literal
-            r'(\d+)|'            # Number
-            r'([a-z]+)\s+(\$?\w+),\s*(\$?\w+)'  # BinOp
-            r')\s*;'
-        )
-        match = re.match(pattern, line)
+        match = _VAR_DECL_RE.match(line)
         if not match:
             raise SyntaxError(f"Invalid declaration: {line}")
         
@@ -190,7 +257,7 @@ class Lexer:
             # Split by comma and process each field individually
             for part in fields_text.split(','):
                 part = part.strip()
-                m_field = re.match(r'\$(\w+):\s*(?:"([^"]+)"|(\$?\w+))', part)
+                m_field = _STRUCT_FIELD_INIT_RE.match(part)
                 if m_field:
                     name = m_field.group(1)
                     # Preserve quotes for string literals so that codegen can recognize them
@@ -203,67 +270,63 @@ class Lexer:
             return Token('VAR_DECL', (var_name, var_type, match.group(9)))
         elif match.group(10):  # Pointer dereference (e.g. $ptr<0>)
             return Token('POINTER_DEREF', (var_name, int(match.group(11))))
-        elif match.group(12):  # Array access (e.g. $arr[0])
-            return Token('ARRAY_ACCESS', (var_name, int(match.group(13))))
+        elif match.group(12):  # Array access (e.g. $arr[0] or $arr[$i])
+            return Token('ARRAY_ACCESS', (var_name, var_type, match.group(12).lstrip('$'),
+                                          _array_index(match.group(13))))
         elif match.group(14):  # Address-of
             return Token('ADDRESS_OF', (var_name, var_type, match.group(14)))
         elif match.group(15):  # String literal
             return Token('VAR_DECL', (var_name, var_type, match.group(15)))
         elif match.group(16):  # Number literal
             return Token('VAR_DECL', (var_name, var_type, int(match.group(16))))
+        elif match.group(17) in VECTOR_BINARY_OPS:  # Element-wise on arrays
+            return Token('VECTOR_OP', (match.group(17), var_name, var_type, match.group(18), match.group(19)))
         elif match.group(17):  # BinOp
             return Token('BIN_OP', (match.group(17), var_name, match.group(18), match.group(19)))
+        elif match.group(20):  # vsum
+            return Token('VECTOR_OP', (match.group(20), var_name, var_type, match.group(21), None))
         
         raise SyntaxError(f"Invalid declaration: {line}")
 
     def _match_label(self, line):
-        match = re.match(r'^\.(\w+):$', line)
+        match = _LABEL_RE.match(line)
         if match:
             return Token('LABEL', match.group(1))
         raise SyntaxError(f"Invalid label: {line}")
 
     def _match_cmp(self, line):
-        match = re.match(r'cmp\s+(\$?\w+),\s*(\$?\w+);', line)
+        match = _CMP_RE.match(line)
         if match:
             return Token('CMP', (match.group(1), match.group(2)))
         raise SyntaxError(f"Invalid cmp: {line}")
 
     def _match_jump(self, line):
-        valid_jumps = ['jge', 'je', 'jg', 'jl', 'jne', 'jle', 'jmp']
-        match = re.match(r'(' + '|'.join(valid_jumps) + r')\s+\.(\w+);', line)
+        match = _JUMP_RE.match(line)
         if match:
             return Token('JUMP', (match.group(1), match.group(2)))
         raise SyntaxError(f"Invalid jump: {line}")
 
     def _match_structdef(self, line):
         # Allow newlines and multiple spaces
-        match = re.match(
-            r'structdef\s+(\w+)\s*{\s*((?:[\s\$]*\w+:\s*\w+;?\s*)*)\s*}', 
-            line, 
-            re.DOTALL
-        )
+        match = _STRUCTDEF_RE.match(line)
         if not match:
             raise SyntaxError(f"Invalid structdef: {line}")
         
         struct_name = match.group(1)
         fields = []
         # Split fields while ignoring empty entries
-        for field in re.split(r';\s*', match.group(2)):
+        for field in _STRUCT_FIELD_SPLIT_RE.split(match.group(2)):
             field = field.strip()
             if not field:
                 continue
-            name_type = re.match(r'\$(\w+):\s*(\w+)', field)
+            name_type = _STRUCT_FIELD_RE.match(field)
             if name_type:
                 fields.append((name_type.group(1), name_type.group(2)))
             
         return Token('STRUCT_DEF', (struct_name, fields))
 
     def _match_enumdef(self, line):
-        match = re.match(
-            r'enumdef\s+(\w+)\s*{\s*((?:[\s\w,]+\s*)*)\s*}', 
-            line, 
-            re.DOTALL
-        )
+        match = _ENUMDEF_RE.match(line)
         if not match:
             raise SyntaxError(f"Invalid enumdef: {line}")
         
@@ -272,226 +335,340 @@ class Lexer:
         return Token('ENUM_DEF', (enum_name, variants))
 
     def _match_bssdef(self, line):
-        match = re.match(r'bssdef\s+(\w+):\s+bytesbuff\s*=\s*(\d+);', line)
+        match = _BSSDEF_RE.match(line)
         if match:
             return Token('BSS_DEF', (match.group(1), int(match.group(2))))
         raise SyntaxError(f"Invalid bssdef: {line}")
 
     def _match_array_assign(self, line):
         # Matches an array element assignment e.g., "$arr[0] = 10;"
-        match = re.match(r'\$(\w+)\[(\d+)\]\s*=\s*(.+);', line)
+        match = _ARRAY_ASSIGN_RE.match(line)
         if match:
             var_name = match.group(1)
-            index = int(match.group(2))
+            index = _array_index(match.group(2))
             value_str = match.group(3).strip()
             # If value is a number, convert it to int; else leave as string (e.g. variable reference).
-            if re.match(r'^-?\d+$', value_str):
+            if _INT_LITERAL_RE.match(value_str):
                 value = int(value_str)
             else:
                 value = value_str
             return Token('ARRAY_ASSIGN', (var_name, index, value))
         raise SyntaxError(f"Invalid array assignment: {line}")
 
-    def _match_use_runtime(self, line):
-        if line.strip() == 'use runtime;':
-            return Token('USE_RUNTIME', None)
-        return None
-
 class ASTNode:
-    pass
+    # Slotted: a program can have millions of nodes, and a per-instance
+    # __dict__ would dominate their memory.
+    __slots__ = ()
 
 class StrDeclNode(ASTNode):
+    __slots__ = ('name', 'value')
+
     def __init__(self, name, value):
-        self.name = name
+        self.name = _intern(name)
         self.value = value
 
 class DataDefNode(ASTNode):
+    __slots__ = ('name', 'value')
+
     def __init__(self, name, value):
-        self.name = name
+        self.name = _intern(name)
         self.value = value
 
 class ExternNode(ASTNode):
+    __slots__ = ('name',)
+
     def __init__(self, name):
-        self.name = name
+        self.name = _intern(name)
 
 class FuncDefNode(ASTNode):
+    __slots__ = ('name', 'params')
+
     def __init__(self, name, params):
-        self.name = name
+        self.name = _intern(name)
         self.params = params
 
 class CallNode(ASTNode):
+    __slots__ = ('func', 'args')
+
     def __init__(self, func, args):
-        self.func = func
+        self.func = _intern(func)
         self.args = args
 
 class RetNode(ASTNode):
+    __slots__ = ('ret_type', 'value')
+
     def __init__(self, ret_type, value):
         self.ret_type = ret_type
         self.value = value
 
 class VarDeclNode(ASTNode):
+    __slots__ = ('name', 'type', 'value')
+
     def __init__(self, name, var_type, value):
-        self.name = name
+        self.name = _intern(name)
         self.type = var_type  # 'int', 'bytes', or struct name
         self.value = value
 
 # NEW: Define a new AST node for the "get" operation
 class GetNode(ASTNode):
+    __slots__ = ('var_name', 'var_type', 'target')
+
     def __init__(self, var_name, var_type, target):
-        self.var_name = var_name
+        self.var_name = _intern(var_name)
         self.var_type = var_type
         self.target = target
 
 class BinOpNode(ASTNode):
+    __slots__ = ('op', 'result_var', 'left_var', 'right_var')
+
     def __init__(self, op, result_var, left_var, right_var):
         self.op = op
         self.result_var = result_var
         self.left_var = left_var
         self.right_var = right_var
 
+class VectorOpNode(ASTNode):
+    """``$var_name: var_type = op left, right``; ``right`` is None for vsum."""
+    __slots__ = ('op', 'var_name', 'var_type', 'left', 'right')
+
+    def __init__(self, op, var_name, var_type, left, right):
+        self.op = op
+        self.var_name = _intern(var_name)
+        self.var_type = var_type
+        self.left = left
+        self.right = right
+
 class FuncCallAssignNode(ASTNode):
+    __slots__ = ('var_name', 'func_name', 'args')
+
     def __init__(self, var_name, func_name, args):
-        self.var_name = var_name
-        self.func_name = func_name
+        # None once dead code elimination finds the result unused
+        self.var_name = var_name and _intern(var_name)
+        self.func_name = _intern(func_name)
         self.args = args
 
+class TailCallNode(ASTNode):
+    __slots__ = ('call', 'loop_label')
+
+    def __init__(self, call, loop_label=None):
+        # Made by the tail-calls pass from a CallNode or FuncCallAssignNode
+        # and the ret of its result; loop_label is set when it calls itself
+        self.call = call
+        self.loop_label = loop_label
+
 class LabelNode(ASTNode):
+    __slots__ = ('name',)
+
     def __init__(self, name):
-        self.name = name
+        self.name = _intern(name)
 
 class CmpNode(ASTNode):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
 
 class JumpNode(ASTNode):
+    __slots__ = ('condition', 'label')
+
     def __init__(self, condition, label):
         self.condition = condition
-        self.label = label
+        self.label = _intern(label)
 
 class StructDefNode(ASTNode):
+    __slots__ = ('name', 'fields')
+
     def __init__(self, name, fields):
-        self.name = name
+        self.name = _intern(name)
         self.fields = fields
 
 class EnumDefNode(ASTNode):
+    __slots__ = ('name', 'variants')
+
     def __init__(self, name, variants):
-        self.name = name
+        self.name = _intern(name)
         self.variants = variants
 
 class BssDefNode(ASTNode):
+    __slots__ = ('name', 'size')
+
     def __init__(self, name, size):
-        self.name = name
+        self.name = _intern(name)
         self.size = size
 
 class ArrayAccessNode(ASTNode):
+    __slots__ = ('var_name', 'index')
+
     def __init__(self, var_name, index):
-        self.var_name = var_name
+        self.var_name = _intern(var_name)
         self.index = index
 
 class AddressOfNode(ASTNode):
+    __slots__ = ('var_name', 'var_type', 'target')
+
     def __init__(self, var_name, var_type, target):
-        self.var_name = var_name
+        self.var_name = _intern(var_name)
         self.var_type = var_type
         self.target = target
 
 class PointerDerefNode(ASTNode):
+    __slots__ = ('var_name', 'index')
+
     def __init__(self, var_name, index):
-        self.var_name = var_name
+        self.var_name = _intern(var_name)
+        self.index = index
+
+class ArrayGetNode(ASTNode):
+    __slots__ = ('var_name', 'var_type', 'array', 'index')
+
+    def __init__(self, var_name, var_type, array, index):
+        self.var_name = _intern(var_name)
+        self.var_type = var_type
+        self.array = _intern(array)
         self.index = index
 
 class ArrayAssignNode(ASTNode):
+    __slots__ = ('var_name', 'index', 'value')
+
     def __init__(self, var_name, index, value):
-        self.var_name = var_name
+        self.var_name = _intern(var_name)
         self.index = index
         self.value = value
 
 class PushNode(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
 class PopNode(ASTNode):
+    __slots__ = ('var_name', 'var_type')
+
     def __init__(self, var_name, var_type):
-        self.var_name = var_name
+        # None once dead code elimination finds the value unused
+        self.var_name = var_name and _intern(var_name)
         self.var_type = var_type
 
-class UseRuntimeNode:
+# Produced by the optimisation passes, never by the parser: store a known
+# value in a variable, declaring it first if needed (like BinOpNode does).
+class AssignNode(ASTNode):
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name, value):
+        self.name = _intern(name)
+        self.value = value
+
+class UseRuntimeNode(ASTNode):
+    __slots__ = ()
+
     def __init__(self):
         pass
 
-class Parser:
+class Parser(TokenDispatcher):
     def __init__(self, tokens):
+        # Any iterable of tokens works, including Lexer.iter_tokens()
         self.tokens = tokens
         self.pos = 0
     
     def parse(self):
-        ast = []
-        while self.pos < len(self.tokens):
-            token = self.tokens[self.pos]
-            if token.type == 'LABEL':
-                ast.append(LabelNode(token.value))
-            elif token.type == 'DATA_DEF':
-                ast.append(DataDefNode(*token.value))
-            elif token.type == 'EXTERN':
-                ast.append(ExternNode(token.value))
-            elif token.type == 'FUNCDEF':
-                ast.append(FuncDefNode(*token.value))
-            elif token.type == 'CALL':
-                ast.append(CallNode(*token.value))
-            elif token.type == 'RET':
-                ast.append(RetNode(token.value[0], token.value[1]))
-            elif token.type == 'GET':
-                # NEW: Handle "get" declarations
-                name, var_type, target = token.value
-                ast.append(GetNode(name, var_type, target))
-            elif token.type == 'VAR_DECL':
-                if len(token.value) == 3:  # Struct initializer or similar
-                    name, var_type, value = token.value
-                    ast.append(VarDeclNode(name, var_type, value))
-                else:  # Regular variable declaration
-                    name, value = token.value
-                    var_type = 'int' if isinstance(value, int) else 'bytes'
-                    ast.append(VarDeclNode(name, var_type, value))
-            elif token.type == 'ARRAY_ASSIGN':
-                var_name, index, value = token.value
-                ast.append(ArrayAssignNode(var_name, int(index), value))
-            elif token.type == 'POINTER_DEREF':
-                var_name, index = token.value
-                ast.append(PointerDerefNode(var_name, index))
-            elif token.type == 'BIN_OP':
-                op, result_var, left, right = token.value
-                ast.append(BinOpNode(op, result_var, left, right))
-            elif token.type == 'FUNC_CALL_ASSIGN':
-                ast.append(FuncCallAssignNode(*token.value))
-            elif token.type == 'STR_DECL':
-                ast.append(StrDeclNode(*token.value))
-            elif token.type == 'CMP':
-                ast.append(CmpNode(*token.value))
-            elif token.type == 'JUMP':
-                ast.append(JumpNode(*token.value))
-            elif token.type == 'STRUCT_DEF':
-                name, fields = token.value
-                ast.append(StructDefNode(name, fields))
-            elif token.type == 'ENUM_DEF':
-                name, variants = token.value
-                ast.append(EnumDefNode(name, variants))
-            elif token.type == 'ENUM_VALUE':
-                name, var_type, value = token.value
-                ast.append(VarDeclNode(name, var_type, value))
-            elif token.type == 'BSS_DEF':
-                name, size = token.value
-                ast.append(BssDefNode(name, size))
-            elif token.type == 'ARRAY_ACCESS':
-                var_name, index = token.value
-                ast.append(ArrayAccessNode(var_name, int(index)))
-            elif token.type == 'ADDRESS_OF':
-                var_name, var_type, target = token.value
-                ast.append(AddressOfNode(var_name, var_type, target))
-            elif token.type == 'PUSH':
-                ast.append(PushNode(token.value))
-            elif token.type == 'POP':
-                ast.append(PopNode(*token.value))
-            elif token.type == 'USE_RUNTIME':
-                ast.append(UseRuntimeNode())
+        return list(self.iter_parse())
+
+    def iter_parse(self):
+        """Yield top-level AST nodes one at a time as tokens arrive."""
+        visit = self.visit
+        for token in self.tokens:
+            node = visit(token)
+            if node is not None:
+                yield node
             self.pos += 1
-        return ast
+
+    # One handler per token type; see visitor.TokenDispatcher
+    def parse_label(self, token):
+        return LabelNode(token.value)
+
+    def parse_data_def(self, token):
+        return DataDefNode(*token.value)
+
+    def parse_extern(self, token):
+        return ExternNode(token.value)
+
+    def parse_funcdef(self, token):
+        return FuncDefNode(*token.value)
+
+    def parse_call(self, token):
+        return CallNode(*token.value)
+
+    def parse_ret(self, token):
+        return RetNode(token.value[0], token.value[1])
+
+    def parse_get(self, token):
+        name, var_type, target = token.value
+        return GetNode(name, var_type, target)
+
+    def parse_var_decl(self, token):
+        if len(token.value) == 3:  # Struct initializer or similar
+            name, var_type, value = token.value
+            return VarDeclNode(name, var_type, value)
+        # Regular variable declaration
+        name, value = token.value
+        var_type = 'int' if isinstance(value, int) else 'bytes'
+        return VarDeclNode(name, var_type, value)
+
+    def parse_array_assign(self, token):
+        return ArrayAssignNode(*token.value)
+
+    def parse_pointer_deref(self, token):
+        var_name, index = token.value
+        return PointerDerefNode(var_name, index)
+
+    def parse_bin_op(self, token):
+        op, result_var, left, right = token.value
+        return BinOpNode(op, result_var, left, right)
+
+    def parse_vector_op(self, token):
+        return VectorOpNode(*token.value)
+
+    def parse_func_call_assign(self, token):
+        return FuncCallAssignNode(*token.value)
+
+    def parse_str_decl(self, token):
+        return StrDeclNode(*token.value)
+
+    def parse_cmp(self, token):
+        return CmpNode(*token.value)
+
+    def parse_jump(self, token):
+        return JumpNode(*token.value)
+
+    def parse_struct_def(self, token):
+        name, fields = token.value
+        return StructDefNode(name, fields)
+
+    def parse_enum_def(self, token):
+        name, variants = token.value
+        return EnumDefNode(name, variants)
+
+    def parse_enum_value(self, token):
+        name, var_type, value = token.value
+        return VarDeclNode(name, var_type, value)
+
+    def parse_bss_def(self, token):
+        name, size = token.value
+        return BssDefNode(name, size)
+
+    def parse_array_access(self, token):
+        return ArrayGetNode(*token.value)
+
+    def parse_address_of(self, token):
+        var_name, var_type, target = token.value
+        return AddressOfNode(var_name, var_type, target)
+
+    def parse_push(self, token):
+        return PushNode(token.value)
+
+    def parse_pop(self, token):
+        return PopNode(*token.value)
+
+    def parse_use_runtime(self, token):
+        return UseRuntimeNode()
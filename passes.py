@@ -0,0 +1,165 @@
+"""Optimisation passes, the levels that enable them, and the order they run in.
+
+Each pass works at one stage of the pipeline:
+
+- ``ast`` passes rewrite the node stream between the parser and codegen;
+- ``ir`` passes see each function (an ir.Function) just before it is lowered;
+- ``asm`` passes rewrite the generated assembly before it is written.
+
+A PassManager runs the selected passes stage by stage, in the order of
+PASSES, timing each one when stats are on. Adding a pass means adding it to
+PASSES; the command line, levels and cache key pick it up from there.
+"""
+from collections import Counter, defaultdict
+
+from bounds import elide_bounds_checks
+from constfold import fold_constants
+from dce import eliminate_dead_code, remove_dead_functions
+from frame import layout_frames
+from inline import inline_functions
+from isel import InstructionSelector
+from peephole import PeepholeOptimizer
+from regalloc import allocate_registers
+from stackregs import keep_stack_in_variables
+from stats import NULL_STATS
+from tailcall import optimize_tail_calls
+
+STAGES = ('ast', 'ir', 'asm')
+OPT_LEVELS = (0, 1, 2)
+
+
+class Pass:
+    """A named optimisation, the stage it runs at and the lowest -O level that enables it.
+
+    ``run`` takes what the stage works on, a Counter for the pass's
+    statistics and the PassManager's options: ``(nodes, counts, options)``
+    returning the new node stream for ``ast`` passes, ``(func, codegen,
+    counts, options)`` for ``ir`` passes and ``(codegen, counts, options)``
+    for ``asm`` passes.
+    """
+
+    __slots__ = ('name', 'stage', 'level', 'run', 'help')
+
+    def __init__(self, name, stage, level, run, help):
+        self.name = name
+        self.stage = stage
+        self.level = level
+        self.run = run
+        self.help = help
+
+
+def _const_fold(nodes, counts, options):
+    return fold_constants(nodes, counts)
+
+
+def _regalloc(func, codegen, counts, options):
+    codegen.var_regs = allocate_registers(func)
+    counts['registers'] += len(codegen.var_regs)
+
+
+def _isel(func, codegen, counts, options):
+    # Selection itself happens as codegen lowers the function
+    codegen.isel = InstructionSelector(counts)
+
+
+def _peephole(codegen, counts, options):
+    functions = codegen.emitter.functions
+    optimizer = PeepholeOptimizer(name for name, _ in functions if name)
+    for _, lines in functions:
+        optimizer.optimize(lines)
+    counts.update(optimizer.hits)
+
+
+# In schedule order within each stage
+PASSES = [
+    Pass('inline', 'ast', 2, inline_functions,
+         'Replace calls to small non-recursive functions with their body'),
+    Pass('const-fold', 'ast', 1, _const_fold,
+         'Fold constant expressions and propagate known values'),
+    Pass('dead-functions', 'ast', 2, remove_dead_functions,
+         'Remove functions that main and the --export roots never reach'),
+    Pass('stack-regs', 'ir', 2, keep_stack_in_variables,
+         'Keep the push/pop stack in variables, and so registers, wherever its depth is known'),
+    Pass('dce', 'ir', 1, eliminate_dead_code,
+         'Remove unreachable blocks and stores to variables that are never read'),
+    Pass('tail-calls', 'ir', 2, optimize_tail_calls,
+         'Jump to a callee whose result is returned at once; loop on self-recursion'),
+    Pass('regalloc', 'ir', 2, _regalloc,
+         'Keep scalar locals in registers (linear-scan allocation)'),
+    Pass('isel', 'ir', 1, _isel,
+         'Pick the cheapest instructions for arithmetic: lea, shifts, division by multiplication'),
+    Pass('bounds-elim', 'ir', 1, elide_bounds_checks,
+         'Drop the --bounds-check checks of indexes the surrounding cmp and jumps keep in range'),
+    Pass('frame', 'asm', 1, layout_frames,
+         'Size stack frames exactly and omit the frame of leaf functions (red zone)'),
+    Pass('peephole', 'asm', 1, _peephole,
+         'Rewrite redundant instruction sequences in the generated assembly'),
+]
+PASS_NAMES = {p.name: p for p in PASSES}
+
+
+def select_passes(level=0, enable=(), disable=()):
+    """Names of the passes to run: those of ``level``, plus ``enable``, minus ``disable``.
+
+    Unknown names raise ValueError. The result is in schedule order.
+    """
+    for name in (*enable, *disable):
+        if name not in PASS_NAMES:
+            raise ValueError(f'unknown pass: {name}')
+    return [p.name for p in _scheduled(PASS_NAMES)
+            if (p.level <= level or p.name in enable) and p.name not in disable]
+
+
+def _scheduled(names):
+    """The passes called ``names``, stage by stage and in PASSES order within one."""
+    return sorted((p for p in PASSES if p.name in names), key=lambda p: STAGES.index(p.stage))
+
+
+class PassManager:
+    """Run a set of passes at their stages.
+
+    ``counts`` maps each pass that ran to a Counter of its statistics.
+    ``options`` holds settings some passes read, such as ``exports`` (the
+    functions dead-functions must keep) and ``inline_threshold``.
+    """
+
+    def __init__(self, names=(), stats=NULL_STATS, options=None):
+        self.names = frozenset(names)
+        self.options = options or {}
+        schedule = _scheduled(self.names)
+        self.stages = {stage: [p for p in schedule if p.stage == stage] for stage in STAGES}
+        self.stats = stats
+        self.counts = defaultdict(Counter)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def run_ast(self, nodes):
+        """The node stream after the ``ast`` passes.
+
+        With stats on, each pass runs to completion so that it can be timed;
+        otherwise the passes are chained lazily.
+        """
+        for p in self.stages['ast']:
+            if self.stats.enabled:
+                with self.stats.time_pass(p.name):
+                    nodes = list(p.run(nodes, self.counts[p.name], self.options))
+            else:
+                nodes = p.run(nodes, self.counts[p.name], self.options)
+        return nodes
+
+    def run_ir(self, func, codegen):
+        for p in self.stages['ir']:
+            with self.stats.time_pass(p.name):
+                p.run(func, codegen, self.counts[p.name], self.options)
+
+    def run_asm(self, codegen):
+        for p in self.stages['asm']:
+            with self.stats.time_pass(p.name):
+                p.run(codegen, self.counts[p.name], self.options)
+
+    def report_counts(self, stats):
+        """Add every pass counter to ``stats`` as ``<pass>.<counter>``."""
+        for p in _scheduled(self.counts):
+            for counter, value in sorted(self.counts[p.name].items()):
+                stats.count(f'{p.name}.{counter}', value)
@@ -0,0 +1,316 @@
+"""Peephole optimisation of the generated assembly.
+
+Rules look at a short window of consecutive instructions in one function
+buffer and return a cheaper replacement. Labels, directives and prologue
+slots are never matched, so no rule moves code across a jump target.
+Rules that drop a write to rax or the flags first check, by scanning
+forward, that nothing reads the old value.
+"""
+import re
+from collections import Counter
+
+_REGISTERS = {}
+for _name in ['ax', 'bx', 'cx', 'dx']:
+    for _alias in ['r' + _name, 'e' + _name, _name, _name[0] + 'l', _name[0] + 'h']:
+        _REGISTERS[_alias] = 'r' + _name
+for _name in ['si', 'di', 'bp', 'sp']:
+    for _alias in ['r' + _name, 'e' + _name, _name, _name + 'l']:
+        _REGISTERS[_alias] = 'r' + _name
+for _n in range(8, 16):
+    for _suffix in ['', 'd', 'w', 'b']:
+        _REGISTERS[f'r{_n}{_suffix}'] = f'r{_n}'
+
+# The generator never carries a value in these from one statement to the
+# next, so they are dead at every label and jump.
+SCRATCH_REGISTERS = {'rax'}
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_IMM_RE = re.compile(r'-?(?:0x[0-9a-fA-F]+|\d+)$')
+
+# Arithmetic that reads and writes its first operand and sets the flags
+_ALU_OPS = {'add', 'sub', 'imul', 'and', 'or', 'xor'}
+_FLAG_WRITERS = _ALU_OPS | {'cmp', 'test', 'neg', 'inc', 'dec'}
+_FLAG_READERS_RE = re.compile(r'(?:j(?!mp)|set|cmov|adc|sbb)')
+
+
+def parse(line):
+    """Split an instruction line into (mnemonic, operands); None for anything else."""
+    if not isinstance(line, str) or not line.startswith('    '):
+        return None
+    text = line.strip()
+    if not text or text.startswith('.') or text.endswith(':'):
+        return None
+    mnemonic, _, rest = text.partition(' ')
+    operands = [op.strip() for op in rest.split(',')] if rest else []
+    return mnemonic, operands
+
+
+def registers(operand):
+    """The 64-bit registers an operand reads (all of them, for a memory operand)."""
+    return {_REGISTERS[word] for word in _WORD_RE.findall(operand) if word in _REGISTERS}
+
+
+def is_register(operand):
+    return operand in _REGISTERS
+
+
+def is_memory(operand):
+    return '[' in operand
+
+
+def is_imm32(operand):
+    if not _IMM_RE.match(operand):
+        return False
+    return -2 ** 31 <= int(operand, 0) < 2 ** 31
+
+
+def _effects(insn):
+    """(registers read, registers written) by an instruction, or None if unknown."""
+    mnemonic, ops = insn
+    if mnemonic in ('mov', 'lea', 'movzx', 'movsx', 'movsxd') and len(ops) == 2:
+        dst, src = ops
+        if is_register(dst):
+            return registers(src), {_REGISTERS[dst]}
+        return registers(src) | registers(dst), set()
+    if mnemonic == 'xor' and len(ops) == 2 and ops[0] == ops[1] and is_register(ops[0]):
+        return set(), {_REGISTERS[ops[0]]}
+    if mnemonic in ('imul', 'mul') and len(ops) == 1:
+        return registers(ops[0]) | {'rax'}, {'rax', 'rdx'}
+    if mnemonic in _ALU_OPS or mnemonic in ('shl', 'shr', 'sar', 'sal', 'neg', 'not', 'inc', 'dec'):
+        if mnemonic == 'imul' and len(ops) == 3:
+            return registers(ops[1]), {_REGISTERS[ops[0]]}
+        read = set().union(*map(registers, ops))
+        return read, registers(ops[0]) if is_register(ops[0]) else set()
+    if mnemonic in ('cmp', 'test'):
+        return set().union(*map(registers, ops)), set()
+    if mnemonic == 'push':
+        return registers(ops[0]) | {'rsp'}, {'rsp'}
+    if mnemonic == 'pop':
+        return {'rsp'}, ({_REGISTERS[ops[0]]} if is_register(ops[0]) else registers(ops[0])) | {'rsp'}
+    if mnemonic == 'cqo':
+        return {'rax'}, {'rdx'}
+    if mnemonic in ('idiv', 'div'):
+        return registers(ops[0]) | {'rax', 'rdx'}, {'rax', 'rdx'}
+    return None
+
+
+def reg_dead(lines, start, reg):
+    """True if ``reg`` is written before it is read from ``lines[start]`` on.
+
+    Labels and jumps end the scan: only scratch registers are dead there.
+    Calls, returns, tail jumps out of the function, slots and the end of
+    the buffer answer False.
+    """
+    for line in lines[start:]:
+        insn = parse(line)
+        if insn is None:
+            return isinstance(line, str) and line.endswith(':') and reg in SCRATCH_REGISTERS
+        if insn[0].startswith('j'):
+            return reg in SCRATCH_REGISTERS and insn[1][0].startswith('.')
+        effects = _effects(insn)
+        if effects is None:
+            return False
+        read, written = effects
+        if reg in read:
+            return False
+        if reg in written:
+            return True
+    return False
+
+
+def flags_dead(lines, start):
+    """True if the flags are overwritten before anything reads them."""
+    for line in lines[start:]:
+        insn = parse(line)
+        if insn is None:
+            return False
+        mnemonic = insn[0]
+        if _FLAG_READERS_RE.match(mnemonic) or mnemonic == 'jmp':
+            return False
+        if mnemonic in _FLAG_WRITERS or mnemonic in ('call', 'ret'):
+            return True
+    return False
+
+
+RULES = []
+
+
+def rule(name, window):
+    """Register a rule over ``window`` consecutive instructions.
+
+    The rule gets the optimizer, the buffer, the index of the window and
+    the parsed instructions; it returns the replacement lines or None.
+    """
+    def register(func):
+        RULES.append((name, window, func))
+        return func
+    return register
+
+
+@rule('self-move', 1)
+def _self_move(opt, lines, i, insns):
+    (m, ops), = insns
+    if m == 'mov' and len(ops) == 2 and ops[0] == ops[1]:
+        return []
+
+
+@rule('redundant-load', 2)
+def _redundant_load(opt, lines, i, insns):
+    # mov A, B / mov B, A: the second copy changes nothing
+    (m1, ops1), (m2, ops2) = insns
+    if m1 == m2 == 'mov' and ops1 == ops2[::-1]:
+        return [lines[i]]
+
+
+@rule('push-pop', 2)
+def _push_pop(opt, lines, i, insns):
+    (m1, ops1), (m2, ops2) = insns
+    if m1 != 'push' or m2 != 'pop':
+        return None
+    src, dst = ops1[0], ops2[0]
+    if src == dst:
+        return []
+    if (is_memory(src) and is_memory(dst)) or 'rsp' in registers(src) | registers(dst):
+        return None
+    if not (is_register(src) or is_memory(src) or is_imm32(src)):
+        return None
+    return [f'    mov {dst}, {src}']
+
+
+@rule('load-push', 2)
+def _load_push(opt, lines, i, insns):
+    (m1, ops1), (m2, ops2) = insns
+    if m1 != 'mov' or m2 != 'push' or ops1[0] != 'rax' or ops2[0] != 'rax':
+        return None
+    src = ops1[1]
+    if not (is_register(src) or is_memory(src) or is_imm32(src)):
+        return None
+    if not reg_dead(lines, i + 2, 'rax'):
+        return None
+    return [f'    push {src}']
+
+
+@rule('load-copy', 2)
+def _load_copy(opt, lines, i, insns):
+    # mov rax, S / mov D, rax: copy straight from S to D
+    (m1, ops1), (m2, ops2) = insns
+    if m1 != 'mov' or m2 != 'mov' or ops1[0] != 'rax' or ops2[1] != 'rax':
+        return None
+    src, dst = ops1[1], ops2[0]
+    if dst == 'rax' or 'rax' in registers(dst):
+        return None
+    if is_memory(dst) and not (is_register(src) or is_imm32(src)):
+        return None
+    if not (is_register(src) or is_memory(src) or _IMM_RE.match(src)):
+        return None
+    if not reg_dead(lines, i + 2, 'rax'):
+        return None
+    return [f'    mov {dst}, {src}']
+
+
+@rule('load-cmp', 2)
+def _load_cmp(opt, lines, i, insns):
+    # mov rax, S / cmp D, rax: compare against S directly
+    (m1, ops1), (m2, ops2) = insns
+    if m1 != 'mov' or m2 != 'cmp' or ops1[0] != 'rax' or ops2[1] != 'rax':
+        return None
+    src, dst = ops1[1], ops2[0]
+    if 'rax' in registers(dst) or _IMM_RE.match(dst):
+        return None
+    if not (is_register(src) or is_imm32(src) or (is_memory(src) and not is_memory(dst))):
+        return None
+    if not reg_dead(lines, i + 2, 'rax'):
+        return None
+    return [f'    cmp {dst}, {src}']
+
+
+@rule('op-to-target', 3)
+def _op_to_target(opt, lines, i, insns):
+    # mov rax, A / OP rax, B / mov C, rax: compute in C instead of rax
+    (m1, ops1), (m2, ops2), (m3, ops3) = insns
+    if m1 != 'mov' or m2 not in _ALU_OPS or m3 != 'mov' or len(ops2) != 2:
+        return None
+    if ops1[0] != 'rax' or ops2[0] != 'rax' or ops3[1] != 'rax':
+        return None
+    target = ops3[0]
+    if not is_register(target) or target == 'rax':
+        return None
+    if _REGISTERS[target] in registers(ops2[1]):
+        return None
+    if not reg_dead(lines, i + 3, 'rax'):
+        return None
+    return [f'    mov {target}, {ops1[1]}', f'    {m2} {target}, {ops2[1]}']
+
+
+@rule('lea-to-target', 2)
+def _lea_to_target(opt, lines, i, insns):
+    # lea rax, X / mov R, rax: compute the address straight into R
+    (m1, ops1), (m2, ops2) = insns
+    if m1 != 'lea' or m2 != 'mov' or ops1[0] != 'rax' or ops2[1] != 'rax':
+        return None
+    if not is_register(ops2[0]) or ops2[0] == 'rax':
+        return None
+    if not reg_dead(lines, i + 2, 'rax'):
+        return None
+    return [f'    lea {ops2[0]}, {ops1[1]}']
+
+
+@rule('identity-op', 1)
+def _identity_op(opt, lines, i, insns):
+    (m, ops), = insns
+    if len(ops) != 2 or not _IMM_RE.match(ops[1]):
+        return None
+    value = int(ops[1], 0)
+    if not ((m in ('add', 'sub', 'or', 'shl', 'shr') and value == 0) or (m == 'imul' and value == 1)):
+        return None
+    if not flags_dead(lines, i + 1):
+        return None
+    return []
+
+
+@rule('xor-before-local-call', 2)
+def _xor_before_local_call(opt, lines, i, insns):
+    # al only tells variadic callees how many vector registers carry
+    # arguments; functions defined in this program never read it.
+    # A tail call jumps to its callee instead of calling it.
+    (m1, ops1), (m2, ops2) = insns
+    if m1 == 'xor' and ops1 == ['rax', 'rax'] and m2 in ('call', 'jmp') and ops2[0] in opt.local_functions:
+        return [lines[i + 1]]
+
+
+@rule('jump-to-next', 1)
+def _jump_to_next(opt, lines, i, insns):
+    (m, ops), = insns
+    if not m.startswith('j') or len(ops) != 1 or i + 1 >= len(lines):
+        return None
+    if lines[i + 1] == f'{ops[0]}:':
+        return []
+
+
+class PeepholeOptimizer:
+    """Apply RULES to function buffers until none matches, counting hits per rule."""
+
+    def __init__(self, local_functions=()):
+        self.local_functions = frozenset(local_functions)
+        self.hits = Counter()
+
+    def optimize(self, lines):
+        """Rewrite one buffer in place."""
+        longest = max(window for _, window, _ in RULES)
+        i = 0
+        while i < len(lines):
+            parsed = [parse(line) for line in lines[i:i + longest]]
+            for name, window, func in RULES:
+                insns = parsed[:window]
+                if len(insns) < window or None in insns:
+                    continue
+                replacement = func(self, lines, i, insns)
+                if replacement is not None:
+                    lines[i:i + window] = replacement
+                    self.hits[name] += 1
+                    # A rewrite can complete a pattern that starts earlier
+                    i = max(i - 2, 0)
+                    break
+            else:
+                i += 1
+        return lines
@@ -0,0 +1,107 @@
+"""Linear-scan register allocation for SCB locals.
+
+Allocation works on one function at a time, on its basic blocks (see
+ir.py). Every scalar variable gets a live interval over node positions:
+the hull of its definitions, its uses and the block boundaries it is live
+across, so an interval covers every loop it is live around. Intervals then
+take registers in order of their start; when none is free, the one with
+the lowest spill weight (its uses, each counting ten times more per
+enclosing loop) is left on the stack. A name declared again is a new
+variable from that declaration on (ir.VersionedVarRefs), like the new
+stack slot codegen would give it. Variables whose address is needed
+(arrays, structs, ``&`` targets) always stay in memory.
+"""
+from parser_lexer import CallNode, FuncCallAssignNode
+from ir import compute_liveness, unversioned
+
+# Preserved across calls; a function saves the ones it uses
+CALLEE_SAVED = ['r12', 'r13', 'r14', 'r15']
+# Free for the callee to clobber, so only for intervals that span no call.
+# The generator itself never uses r10 and r11 as scratch.
+CALLER_SAVED = ['r10', 'r11']
+
+
+class Interval:
+    __slots__ = ('name', 'start', 'end', 'uses', 'weight', 'crosses_call', 'reg')
+
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.end = start
+        self.uses = [start]
+        self.weight = 0
+        self.crosses_call = False
+        self.reg = None
+
+    def cover(self, point):
+        self.start = min(self.start, point)
+        self.end = max(self.end, point)
+
+
+def live_intervals(func):
+    """Live intervals of the register candidates in one ir.Function.
+
+    Node ``i`` sits at point ``2i``; the odd points between nodes stand
+    for block entries and exits, where a value is live but not touched.
+    """
+    compute_liveness(func, versioned=True)
+    intervals = {}
+    defined = set()
+    for pos, (defs, uses) in enumerate(func.node_refs):
+        defined.update(defs)
+        for name in defs + uses:
+            interval = intervals.get(name)
+            if interval is None:
+                intervals[name] = Interval(name, 2 * pos)
+            else:
+                interval.cover(2 * pos)
+                interval.uses.append(2 * pos)
+
+    # Only variables this function writes itself can move to registers;
+    # anything else (argc/argv, undeclared names) keeps its usual handling.
+    candidates = [iv for name, iv in intervals.items()
+                  if name in defined and unversioned(name) not in func.pinned]
+
+    for block in func.blocks:
+        for iv in candidates:
+            if iv.name in block.live_in:
+                iv.cover(2 * block.start - 1)
+            if iv.name in block.live_out:
+                iv.cover(2 * block.end + 1)
+
+    calls = [2 * block.start + 2 * i for block in func.blocks
+             for i, node in enumerate(block.nodes) if isinstance(node, (CallNode, FuncCallAssignNode))]
+    loops = [(2 * head.start, 2 * tail.end) for head, tail in func.back_edges()]
+    for iv in candidates:
+        iv.crosses_call = any(iv.start < pos < iv.end for pos in calls)
+        iv.weight = sum(10 ** sum(head <= pos <= tail for head, tail in loops) for pos in iv.uses)
+    return candidates
+
+
+def allocate_registers(func):
+    """Map the variables of one ir.Function to registers.
+
+    Keys are the names of ir.VersionedVarRefs, so each declaration of a
+    name gets its own register, or none. Those missing from the result
+    stay in stack slots.
+    """
+    intervals = sorted(live_intervals(func), key=lambda iv: (iv.start, iv.end))
+    active = []
+    for iv in intervals:
+        # Every node reads its operands before writing its result, so an
+        # interval ending where this one starts can hand over its register.
+        active = [a for a in active if a.end > iv.start]
+        in_use = {a.reg for a in active}
+        pool = CALLEE_SAVED if iv.crosses_call else CALLER_SAVED + CALLEE_SAVED
+        free = [reg for reg in pool if reg not in in_use]
+        if free:
+            iv.reg = free[0]
+            active.append(iv)
+            continue
+        # Spill whichever is cheapest to keep in memory, this interval included
+        victim = min((a for a in active if a.reg in pool), key=lambda a: (a.weight, -a.end), default=None)
+        if victim is not None and (victim.weight, -victim.end) < (iv.weight, -iv.end):
+            iv.reg, victim.reg = victim.reg, None
+            active.remove(victim)
+            active.append(iv)
+    return {iv.name: iv.reg for iv in intervals if iv.reg is not None}
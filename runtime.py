@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+
+# C flags the runtime object is built with; part of its cache key
+RUNTIME_CFLAGS = ['-O2']
+
+RUNTIME_C_CONTENT = """#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+void* open(const char* filename, const char* mode) {
+    return fopen(filename, mode);
+}
+
+int write(void* file, const char* content) {
+    return fputs(content, (FILE*)file);
+}
+
+int close(void* file) {
+    return fclose((FILE*)file);
+}
+
+void* allocate(size_t size) {
+    return malloc(size);
+}
+
+void deallocate(void* ptr) {
+    free(ptr);
+}
+
+// String utilities
+int starts_with(const char* str, const char* prefix) {
+    size_t len_str = strlen(str);
+    size_t len_prefix = strlen(prefix);
+    if (len_prefix > len_str) return 0;
+    return strncmp(str, prefix, len_prefix) == 0;
+}
+
+int ends_with(const char* str, const char* suffix) {
+    size_t len_str = strlen(str);
+    size_t len_suffix = strlen(suffix);
+    if (len_suffix > len_str) return 0;
+    return strncmp(str + len_str - len_suffix, suffix, len_suffix) == 0;
+}
+
+char* read(void* file) {
+    FILE* fp = (FILE*)file;
+    char* content = NULL;
+    size_t len = 0;
+    char buffer[1024];
+    
+    while (fgets(buffer, sizeof(buffer), fp)) {
+        size_t new_len = len + strlen(buffer);
+        char* new_content = realloc(content, new_len + 1);
+        if (!new_content) {
+            free(content);
+            return NULL;
+        }
+        content = new_content;
+        strcpy(content + len, buffer);
+        len = new_len;
+    }
+    
+    return content;
+}
+"""
+
+def runtime_object(cache_dir, target, cflags=RUNTIME_CFLAGS):
+    """Return the path of the runtime object for ``target``, building it once.
+
+    The object lives in ``<cache_dir>/runtime/<key>/scbrt.o``, keyed by the
+    runtime source, target, flags and the gcc in use. It is built in a
+    private temp directory and renamed into place, so concurrent scbc
+    processes never race on a shared runtime.c; if two of them build it at
+    the same time the second rename simply replaces an identical file.
+    Raises RuntimeError with gcc's diagnostics when the build fails.
+    """
+    digest = hashlib.sha256(RUNTIME_C_CONTENT.encode())
+    digest.update(b'\0' + target.encode())
+    for flag in cflags:
+        digest.update(b'\0' + flag.encode())
+    digest.update(b'\0' + (shutil.which('gcc') or 'gcc').encode())
+    runtime_dir = os.path.join(cache_dir, 'runtime', digest.hexdigest()[:16])
+    object_path = os.path.join(runtime_dir, 'scbrt.o')
+    if os.path.exists(object_path):
+        return object_path
+
+    os.makedirs(runtime_dir, exist_ok=True)
+    build_dir = tempfile.mkdtemp(dir=runtime_dir, prefix='.build-')
+    try:
+        source = os.path.join(build_dir, 'runtime.c')
+        built = os.path.join(build_dir, 'scbrt.o')
+        with open(source, 'w') as f:
+            f.write(RUNTIME_C_CONTENT)
+        result = subprocess.run(['gcc', '-c'] + cflags + ['-o', built, source],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"building the runtime failed:\n{result.stderr}")
+        os.replace(built, object_path)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return object_path
@@ -1,132 +1,329 @@
 #!/usr/bin/env python3
 import sys
 import argparse
+import itertools
+import json
+import multiprocessing
 import subprocess
-from parser_lexer import Lexer, Parser
+import shutil
+import parser_lexer
+import bounds
+import codegen
+import constfold
+import dce
+import emitter
+import frame
+import inline
+import ir
+import isel
+import layout
+import passes
+import peephole
+import regalloc
+import stackregs
+import tailcall
+import vector
+import visitor
+from parser_lexer import FuncDefNode, Lexer, Parser
 from codegen import CodeGenerator
+from passes import OPT_LEVELS, PASSES, PassManager, select_passes
+from cache import CompileCache, DEFAULT_MAX_SIZE, compiler_version
+from runtime import RUNTIME_C_CONTENT, runtime_object
+from server import default_socket_path, forward, serve
+from stats import NULL_STATS, CompileStats, count_output
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
-# Add this constant near the top of the file
-RUNTIME_C_CONTENT = """#include <stdio.h>
-#include <stdlib.h>
-#include <string.h>
+__version__ = '0.1.0'
 
-void* open(const char* filename, const char* mode) {
-    return fopen(filename, mode);
-}
+# Modules whose source is hashed into the compile cache key
+CACHED_MODULES = [parser_lexer, visitor, bounds, inline, constfold, dce, ir, stackregs, tailcall, regalloc, isel, frame,
+                  layout, peephole, passes, vector, codegen, emitter, sys.modules[__name__]]
+_compiler_version = None
 
-int write(void* file, const char* content) {
-    return fputs(content, (FILE*)file);
-}
+def current_compiler_version():
+    # Hashed once per process; a resident server reuses it for every request
+    global _compiler_version
+    if _compiler_version is None:
+        _compiler_version = compiler_version(__version__, CACHED_MODULES)
+    return _compiler_version
 
-int close(void* file) {
-    return fclose((FILE*)file);
-}
-
-void* allocate(size_t size) {
-    return malloc(size);
-}
-
-void deallocate(void* ptr) {
-    free(ptr);
-}
-
-// String utilities
-int starts_with(const char* str, const char* prefix) {
-    size_t len_str = strlen(str);
-    size_t len_prefix = strlen(prefix);
-    if (len_prefix > len_str) return 0;
-    return strncmp(str, prefix, len_prefix) == 0;
-}
-
-int ends_with(const char* str, const char* suffix) {
-    size_t len_str = strlen(str);
-    size_t len_suffix = strlen(suffix);
-    if (len_suffix > len_str) return 0;
-    return strncmp(str + len_str - len_suffix, suffix, len_suffix) == 0;
-}
-
-char* read(void* file) {
-    FILE* fp = (FILE*)file;
-    char* content = NULL;
-    size_t len = 0;
-    char buffer[1024];
-    
-    while (fgets(buffer, sizeof(buffer), fp)) {
-        size_t new_len = len + strlen(buffer);
-        char* new_content = realloc(content, new_len + 1);
-        if (!new_content) {
-            free(content);
-            return NULL;
-        }
-        content = new_content;
-        strcpy(content + len, buffer);
-        len = new_len;
-    }
-    
-    return content;
-}
-"""
 
 class SCBCompiler:
-    def __init__(self, target_os='linux'):
+    def __init__(self, target_os='linux', stats=NULL_STATS, passes=(), dump_ir=False, pass_options=None,
+                 bounds_checks=False, avx2=False):
         self.target_os = target_os
+        self.bounds_checks = bounds_checks
+        self.avx2 = avx2
+        self.passes = passes
+        self.pass_options = pass_options
+        self.dump_ir = dump_ir
         self.code_generator = None  # Add this line
+        self.stats = stats
         
-    def compile(self, source):
-        lexer = Lexer(source)
-        tokens = lexer.tokenize()
-        parser = Parser(tokens)
-        ast = parser.parse()
-        self.code_generator = CodeGenerator(target_os=self.target_os)  # Store as instance variable
-        return self.code_generator.generate(ast)
+    def compile(self, source, out=None):
+        stats = self.stats
+        with stats.time_pass('lex'):
+            tokens = Lexer(source).tokenize()
+        with stats.time_pass('parse'):
+            ast = Parser(tokens).parse()
+        pass_manager = PassManager(self.passes, stats, self.pass_options)
+        ast = pass_manager.run_ast(ast)
+        self.code_generator = CodeGenerator(target_os=self.target_os, passes=pass_manager, dump_ir=self.dump_ir,  # Store as instance variable
+                                            bounds_checks=self.bounds_checks, avx2=self.avx2)
+        with stats.time_pass('codegen'):
+            self.code_generator.generate_nodes(ast)
+        with stats.time_pass('finalize'):
+            result = self.code_generator.finalize(out)
+        if stats.enabled:
+            stats.count('tokens', len(tokens))
+            stats.count('ast_nodes', len(ast))
+            stats.count('functions', sum(isinstance(node, FuncDefNode) for node in ast))
+            count_output(stats, self.code_generator)
+            pass_manager.report_counts(stats)
+        return result
+
+    def compile_stream(self, stream, out=None):
+        if self.stats.enabled:
+            # Passes can only be timed one at a time on whole lists
+            return self.compile(stream, out)
+        # Lex, parse and generate lazily from an open file so that no full
+        # copy of the source, token list or AST is ever held in memory.
+        # With an output stream the assembly is written straight to it.
+        lexer = Lexer(stream)
+        parser = Parser(lexer.iter_tokens())
+        pass_manager = PassManager(self.passes, options=self.pass_options)
+        nodes = pass_manager.run_ast(parser.iter_parse())
+        self.code_generator = CodeGenerator(target_os=self.target_os, passes=pass_manager, dump_ir=self.dump_ir,
+                                            bounds_checks=self.bounds_checks, avx2=self.avx2)
+        return self.code_generator.generate(nodes, out)
+
+def expand_sources(paths):
+    """Expand directories into the .scb files below them, in a stable order."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith('.scb'):
+                        yield os.path.join(root, name)
+        else:
+            yield path
 
-def main():
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
     parser = argparse.ArgumentParser(description='SCB Compiler')
     parser.add_argument('-c', action='store_true', help='Compile to executable')
     parser.add_argument('--target', choices=['linux', 'win64'], default='linux',
                        help='Target platform (default: linux)')
-    parser.add_argument('source', help='Source file to compile')
-    args = parser.parse_args()
+    parser.add_argument('-j', '--jobs', type=int, nargs='?', const=os.cpu_count() or 1, default=1,
+                       help='Build up to N files in parallel (default: 1, bare -j: one per CPU)')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Do not read or write the compile cache')
+    parser.add_argument('--cache-dir', default=None,
+                       help='Compile cache directory (default: $SCBC_CACHE_DIR or ~/.cache/scbc)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024), metavar='MB',
+                       help='Evict least recently used cache entries beyond this size')
+    parser.add_argument('--cache-stats', action='store_true',
+                       help='Print compile cache statistics')
+    parser.add_argument('--time-passes', action='store_true',
+                       help='Print wall time, memory and size counters for each pass')
+    parser.add_argument('--stats-json', default=None, metavar='FILE',
+                       help='Write per-file pass timings and counters as JSON ("-" for stdout)')
+    parser.add_argument('-O', dest='opt_level', type=int, choices=OPT_LEVELS, default=0, metavar='LEVEL',
+                       help='Optimization level: -O0 (default) runs no passes, -O1 the cheap ones, -O2 all; '
+                            '-f<pass> and -fno-<pass> add or remove one pass')
+    for p in PASSES:
+        parser.add_argument(f'-f{p.name}', dest='passes', action='append_const', const=p.name, default=[],
+                           help=f'{p.help} (-O{p.level})')
+        parser.add_argument(f'-fno-{p.name}', dest='no_passes', action='append_const', const=p.name,
+                           default=[], help=argparse.SUPPRESS)
+    parser.add_argument('--export', dest='exports', action='append', default=[], metavar='FUNC',
+                       help='Keep FUNC, and what it calls, when unused functions are removed '
+                            '(main is always kept)')
+    parser.add_argument('--inline-threshold', type=int, default=inline.DEFAULT_THRESHOLD, metavar='N',
+                       help='Inline functions of at most N statements (default: %(default)s)')
+    parser.add_argument('--bounds-check', action='store_true',
+                       help='Trap (ud2) when an array index is out of range')
+    parser.add_argument('-mavx2', dest='avx2', action='store_true',
+                       help='Use AVX2 for vector statements (default: SSE2)')
+    parser.add_argument('--dump-ir', action='store_true',
+                       help='Print the basic blocks, CFG edges and liveness of every function')
+    parser.add_argument('--server', action='store_true',
+                       help='Run a resident compile server on a Unix socket')
+    parser.add_argument('--client', action='store_true',
+                       help='Forward this build to a running server (compiles locally if none is running)')
+    parser.add_argument('--socket', default=None,
+                       help='Server socket path (default: $XDG_RUNTIME_DIR/scbc.sock)')
+    parser.add_argument('sources', nargs='*', metavar='source',
+                       help='Source files or directories of .scb files to compile')
+    args = parser.parse_args(argv)
+    if args.server:
+        serve(args.socket or default_socket_path(), main)
+        return 0
+    if not args.sources and not args.cache_stats:
+        parser.error('the following arguments are required: source')
+    if args.client:
+        returncode = forward(args.socket or default_socket_path(),
+                             [arg for arg in argv if arg != '--client'])
+        if returncode is not None:
+            return returncode
     
-    with open(args.source, 'r') as f:
-        source = f.read()
+    sources = list(expand_sources(args.sources))
+    if args.jobs > 1 and len(sources) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(args.jobs, len(sources)))
+        results = pool.map(build, sources, itertools.repeat(args))
+    else:
+        pool = None
+        results = (build(source, args) for source in sources)
     
-    compiler = SCBCompiler(target_os=args.target)
-    assembly = compiler.compile(source)
+    # Results come back in command-line order, whatever order they finish in
+    failed = 0
+    all_stats = []
+    for ok, messages, stats in results:
+        for message in messages:
+            print(message, file=sys.stderr)
+        if not ok:
+            failed += 1
+        if stats is not None:
+            all_stats.append(stats)
+    if pool is not None:
+        pool.shutdown()
     
-    output_file = args.source.replace('.scb', '.s')
-    with open(output_file, 'w') as f:
-        f.write(assembly)
+    if args.stats_json:
+        report = json.dumps({'version': __version__, 'files': all_stats}, indent=2)
+        if args.stats_json == '-':
+            print(report)
+        else:
+            with open(args.stats_json, 'w') as f:
+                f.write(report + '\n')
     
+    if args.cache_stats and not args.no_cache:
+        stats = CompileCache(args.cache_dir, args.cache_size * 1024 * 1024).stats()
+        print(f"cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries, "
+              f"{stats['size']} / {stats['max_size']} bytes", file=sys.stderr)
+    return 1 if failed else 0
+
+def build(source, args):
+    """Compile one source file; returns (ok, diagnostics, stats) instead of printing.
+
+    Runs in a worker process under -j, so all output is collected and
+    printed by main() in a deterministic order. stats is None unless
+    --time-passes or --stats-json asked for it.
+    """
+    messages = []
+    stats = CompileStats(source) if args.time_passes or args.stats_json else NULL_STATS
+    try:
+        ok = _build(source, args, messages, stats)
+    except Exception as e:
+        messages.append(f"{source}: error: {type(e).__name__}: {e}")
+        ok = False
+    if not stats.enabled:
+        return ok, messages, None
+    stats.close()
+    if args.time_passes:
+        messages.append(stats.report())
+    return ok, messages, stats.as_dict()
+
+def _run(command, messages):
+    result = subprocess.run(command, capture_output=True, text=True)
+    output = (result.stdout + result.stderr).rstrip()
+    if output:
+        messages.append(output)
+    return result.returncode == 0
+
+def _build(source, args, messages, stats):
+    cache = None if args.no_cache else CompileCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    output_file = source.replace('.scb', '.s')
+    # Options that change the generated code; part of the cache key
+    passes = select_passes(args.opt_level, args.passes, args.no_passes)
+    exports = sorted(set(args.exports))
+    codegen_flags = [f'-f{name}' for name in passes] + [f'--export={name}' for name in exports]
+    if 'inline' in passes:
+        codegen_flags.append(f'--inline-threshold={args.inline_threshold}')
+    if args.bounds_check:
+        codegen_flags.append('--bounds-check')
+    if args.avx2:
+        codegen_flags.append('-mavx2')
+    entry = None
+    if cache is not None:
+        with stats.time_pass('cache'):
+            key = cache.key(source, args.target, current_compiler_version(), codegen_flags)
+            # A dump needs the compiler to run, so it never comes from the cache
+            entry = None if args.dump_ir else cache.lookup(key)
+        stats.count('cache_hits', entry is not None)
+    
+    asm_written = entry is None
+    if entry is None:
+        compiler = SCBCompiler(target_os=args.target, stats=stats, passes=passes, dump_ir=args.dump_ir,
+                               pass_options={'exports': exports, 'inline_threshold': args.inline_threshold},
+                               bounds_checks=args.bounds_check, avx2=args.avx2)
+        try:
+            with open(source, 'r') as f, open(output_file, 'w') as out:
+                compiler.compile_stream(f, out)
+        except Exception:
+            # Do not leave half-written assembly behind
+            if os.path.exists(output_file):
+                os.remove(output_file)
+            raise
+        use_runtime = compiler.code_generator.use_runtime
+        if args.dump_ir:
+            messages.append(f'{source}: IR')
+            messages.extend(compiler.code_generator.ir_dumps)
+        if cache is not None:
+            entry = cache.store_asm(key, output_file, {'use_runtime': use_runtime})
+    else:
+        use_runtime = entry.meta['use_runtime']
+        if not args.c:
+            shutil.copyfile(entry.asm_path, output_file)
+            asm_written = True
+    
+    ok = True
     if args.c:
-        exe_file = args.source.replace('.scb', '.exe' if args.target == 'win64' else '')
+        exe_file = source.replace('.scb', '.exe' if args.target == 'win64' else '')
         link_flags = ['-Wl,-subsystem,console'] if args.target == 'win64' else ['-no-pie']
         sources = [output_file]
-        runtime_created = False
-        
-        # Add runtime if used
-        if compiler.code_generator.use_runtime:
-            # Write runtime.c temporarily
-            with open('runtime.c', 'w') as f:
-                f.write(RUNTIME_C_CONTENT)
-            sources.append('runtime.c')
-            runtime_created = True
-            
-        subprocess.run(['gcc'] + link_flags + ['-o', exe_file] + sources)
+        if entry is not None:
+            if not entry.has_object:
+                tmp_object = cache.object_temp_path(entry)
+                with stats.time_pass('assemble'):
+                    assembled = _run(['gcc', '-c', '-o', tmp_object, entry.asm_path], messages)
+                if assembled:
+                    cache.store_object(entry, tmp_object)
+                else:
+                    os.remove(tmp_object)
+            if entry.has_object:
+                sources = [entry.object_path]
+        runtime_dir = None
         
-        # Cleanup files
         try:
-            if args.target == 'win64':
-                subprocess.run(f'del {output_file}', shell=True)
-                if runtime_created:
-                    subprocess.run('del runtime.c', shell=True)
-            else:
-                os.remove(output_file)
-                if runtime_created:
-                    os.remove('runtime.c')
-        except Exception as e:
-            print(f"Warning: Error cleaning up files - {e}")
+            # Link the prebuilt runtime object if the program uses it
+            if use_runtime:
+                if cache is not None:
+                    runtime_root = cache.root
+                else:
+                    runtime_root = runtime_dir = tempfile.mkdtemp(prefix='scbrt-')
+                sources.append(runtime_object(runtime_root, args.target))
+            
+            with stats.time_pass('link'):
+                ok = _run(['gcc'] + link_flags + ['-o', exe_file] + sources, messages)
+        finally:
+            # Cleanup files
+            try:
+                if runtime_dir is not None:
+                    shutil.rmtree(runtime_dir)
+                if asm_written:
+                    if args.target == 'win64':
+                        subprocess.run(f'del {output_file}', shell=True)
+                    else:
+                        os.remove(output_file)
+            except Exception as e:
+                messages.append(f"Warning: Error cleaning up files - {e}")
+    return ok
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,114 @@
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+
+
+def default_socket_path():
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if not base:
+        from cache import default_cache_dir
+        base = default_cache_dir()
+    return os.path.join(base, 'scbc.sock')
+
+
+def _check_platform():
+    if not hasattr(socket, 'AF_UNIX'):
+        raise RuntimeError("server mode needs Unix domain sockets, which this platform lacks")
+
+
+class _CompileHandler(socketserver.StreamRequestHandler):
+    # One request per connection: a JSON line in, a JSON line out.
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            returncode = self.server.run_request(request)
+        reply = {'returncode': returncode, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+        self.wfile.write(json.dumps(reply).encode() + b'\n')
+
+
+class CompileServer(socketserver.UnixStreamServer):
+    """Resident compiler: requests run in this process, with every module,
+    compiled pattern and cache handle already warm.
+
+    Requests are served one at a time because each runs in the client's
+    working directory.
+    """
+
+    def __init__(self, socket_path, main):
+        _check_platform()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        os.makedirs(os.path.dirname(socket_path) or '.', exist_ok=True)
+        self.main = main
+        super().__init__(socket_path, _CompileHandler)
+
+    def run_request(self, request):
+        previous_cwd = os.getcwd()
+        previous_env = {name: os.environ.get(name) for name in request.get('env', {})}
+        try:
+            os.chdir(request['cwd'])
+            os.environ.update(request.get('env', {}))
+            return self.main(request['argv'])
+        except SystemExit as e:  # argparse errors and --help
+            return e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            print(f"scbc server: error: {type(e).__name__}: {e}", file=sys.stderr)
+            return 1
+        finally:
+            os.chdir(previous_cwd)
+            for name, value in previous_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def serve(socket_path, main):
+    server = CompileServer(socket_path, main)
+    # Let a plain `kill` shut down cleanly and remove the socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"scbc server listening on {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+# Environment variables that change how a build behaves; forwarded with each request
+FORWARDED_ENV = ['SCBC_CACHE_DIR', 'XDG_CACHE_HOME', 'LOCALAPPDATA', 'PATH']
+
+
+def forward(socket_path, argv):
+    """Send a compile request to a running server.
+
+    Returns the build's exit status, or None when no server is listening,
+    so the caller can compile in-process instead.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    request = {
+        'argv': argv,
+        'cwd': os.getcwd(),
+        'env': {name: os.environ[name] for name in FORWARDED_ENV if name in os.environ},
+    }
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            with sock.makefile('rb') as reply_file:
+                reply = json.loads(reply_file.readline())
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    sys.stdout.write(reply['stdout'])
+    sys.stderr.write(reply['stderr'])
+    return reply['returncode']
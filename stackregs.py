@@ -0,0 +1,178 @@
+"""The push/pop operand stack as variables.
+
+Codegen turns ``push`` and ``pop`` into machine pushes and pops. Wherever
+the depth of the stack is known at compile time, this pass instead keeps
+the entry at depth ``k`` in a variable ``stack.<k>``: a push stores into
+it and a pop copies it out. Those are plain scalar locals, so regalloc
+can put them in registers, and they are dropped like any other dead
+store.
+
+The depth is known from the function's entry on, through every path,
+until a pop would take more than this function pushed, a push cannot be
+expressed as a store (``push shl``/``push shr`` shift by whatever is in
+cl), or two paths with different depths meet. There the entries held in
+variables are pushed onto the machine stack, oldest first, and the
+machine stack is used from then on. When paths meet, the pushes go at
+the end of every block leading there, before its jump, since a push
+leaves the flags alone.
+
+Codegen binds names to slots in source order, so a variable must be
+stored before any code that reads it in the source, not only along the
+paths that run. A block whose pop or spill comes first in the source,
+as after a backward jump, uses the machine stack as well.
+"""
+from collections import Counter
+
+from ir import relink
+from parser_lexer import (AssignNode, BinOpNode, GetNode, JumpNode, PopNode, PushNode,
+                          StrDeclNode)
+
+UNKNOWN = -1  # Depth of a block that uses the machine stack
+
+_STACK_OPS = ('add', 'sub', 'mul', 'div')
+
+
+def _slot(depth):
+    return f'stack.{depth}'
+
+
+def _store(value, depth, number):
+    """Nodes pushing ``value`` at ``depth`` into its variable, or None if they cannot."""
+    slot = _slot(depth)
+    if value.startswith('"'):
+        # A fresh name per push: a string declaration always takes a new slot
+        string = f'str.{number}'
+        return [StrDeclNode(string, value[1:-1]), BinOpNode('add', slot, '$' + string, '0')]
+    op, _, rest = value.partition(' ')
+    if rest and ',' in rest:
+        if op not in _STACK_OPS:
+            return None
+        left, right = (operand.strip() for operand in rest.split(',', 1))
+        return [BinOpNode(op, slot, left, right)]
+    if value.isdigit():
+        return [AssignNode(slot, int(value))]
+    return [BinOpNode('add', slot, value, '0')]
+
+
+def _transfer(block, depth):
+    """The depth after ``block``, entered at ``depth``."""
+    for node in block.nodes:
+        if depth == UNKNOWN:
+            break
+        if type(node) is PushNode:
+            depth = depth + 1 if _store(node.value, depth, 0) is not None else UNKNOWN
+        elif type(node) is PopNode:
+            depth = depth - 1 if depth > 0 else UNKNOWN
+    return depth
+
+
+def _spill(depth):
+    return [PushNode('$' + _slot(k)) for k in range(depth)]
+
+
+def stack_depths(func, machine=frozenset()):
+    """(depth on entry, depth on exit) of every block; UNKNOWN where the machine stack is used.
+
+    Blocks that cannot be reached are UNKNOWN: their code never runs, and
+    so are the blocks whose index is in ``machine``.
+    """
+    blocks = func.blocks
+    depth_in = [None] * len(blocks)
+    depth_out = [None] * len(blocks)
+    depth_in[0] = 0
+    changed = True
+    while changed:
+        changed = False
+        for block in blocks:
+            i = block.index
+            preds = [depth_out[pred.index] for pred in block.preds if depth_out[pred.index] is not None]
+            if i == 0:
+                preds.append(0)
+            if not preds:
+                continue
+            new_in = preds[0] if all(depth == preds[0] for depth in preds) else UNKNOWN
+            if i in machine:
+                new_in = UNKNOWN
+            new_out = _transfer(block, new_in)
+            # Entries left in variables cannot flow into a block that uses the machine stack
+            if any(depth_in[succ.index] == UNKNOWN for succ in block.succs):
+                new_out = UNKNOWN
+            if (new_in, new_out) != (depth_in[i], depth_out[i]):
+                depth_in[i], depth_out[i] = new_in, new_out
+                changed = True
+    return ([UNKNOWN if depth is None else depth for depth in depth_in],
+            [UNKNOWN if depth is None else depth for depth in depth_out])
+
+
+def _rewrite(block, depth, spill_at_end, number, counts):
+    """The nodes of ``block``, entered at ``depth``, and the next string number."""
+    nodes = []
+    for node in block.nodes:
+        if depth != UNKNOWN and type(node) is PushNode:
+            store = _store(node.value, depth, number)
+            if store is not None:
+                number += 1
+                nodes.extend(store)
+                depth += 1
+                counts['pushes'] += 1
+                continue
+            nodes.extend(_spill(depth))
+            counts['spills'] += depth
+            depth = UNKNOWN
+        elif depth != UNKNOWN and type(node) is PopNode:
+            if depth > 0:
+                depth -= 1
+                if node.var_name is not None:
+                    nodes.append(GetNode(node.var_name, node.var_type, '$' + _slot(depth)))
+                counts['pops'] += 1
+                continue
+            depth = UNKNOWN
+        nodes.append(node)
+    if depth != UNKNOWN and spill_at_end:
+        # A successor uses the machine stack
+        at = len(nodes) - (type(block.terminator()) is JumpNode)
+        nodes[at:at] = _spill(depth)
+        counts['spills'] += depth
+    return nodes, number
+
+
+def _reads_first(nodes, stored):
+    """Whether ``nodes`` read a slot not in ``stored``, which collects the ones they store."""
+    for node in nodes:
+        if type(node) is GetNode:
+            read = node.target
+        elif type(node) is PushNode:
+            read = node.value
+        else:
+            if type(node) in (AssignNode, BinOpNode):
+                stored.add(node.result_var if type(node) is BinOpNode else node.name)
+            continue
+        if read.startswith('$stack.') and read[1:] not in stored:
+            return True
+    return False
+
+
+def keep_stack_in_variables(func, codegen, counts, options):
+    """Rewrite the pushes and pops of an ir.Function whose depth is known; see the module docstring."""
+    if not any(type(node) in (PushNode, PopNode) for node in func.nodes()):
+        return
+    # Blocks that would read a slot before it is stored; each one found
+    # can only turn more blocks over to the machine stack
+    machine = set()
+    while True:
+        depth_in, depth_out = stack_depths(func, machine)
+        rewritten, stored, number, found = {}, set(), 0, Counter()
+        for block in func.blocks:
+            depth = depth_in[block.index]
+            if depth == UNKNOWN:
+                continue
+            nodes, number = _rewrite(block, depth, depth_out[block.index] == UNKNOWN, number, found)
+            if _reads_first(nodes, stored):
+                machine.add(block.index)
+            rewritten[block.index] = nodes
+        if machine.isdisjoint(rewritten):
+            break
+    for block in func.blocks:
+        block.nodes = rewritten.get(block.index, block.nodes)
+    counts.update(found)
+    relink(func)
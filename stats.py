@@ -0,0 +1,132 @@
+import contextlib
+import time
+import tracemalloc
+
+
+class CompileStats:
+    """Wall time and peak memory for each compiler pass, plus size counters.
+
+    Memory is measured with tracemalloc, which is only started when stats
+    are requested; see NULL_STATS for the disabled case.
+    """
+
+    enabled = True
+
+    def __init__(self, source=None):
+        self.source = source
+        self.passes = []  # [name, seconds, peak bytes, depth]
+        self.counters = {}
+        self._entries = {}  # Pass name -> its entry in passes
+        self._open = []  # [entry, base bytes, peak so far] of each running pass
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def close(self):
+        # Tracing slows every allocation; stop it once this build is measured
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def time_pass(self, name):
+        """Time the block as pass ``name``.
+
+        A pass timed inside another is listed under it and not counted
+        again in the total. Timing the same pass again (an IR pass runs
+        once per function) adds to its entry.
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            entry = self._entries[name] = [name, 0.0, 0, len(self._open)]
+            self.passes.append(entry)
+        # Resetting the peak hides it from the passes still running
+        _, peak = tracemalloc.get_traced_memory()
+        for frame in self._open:
+            frame[2] = max(frame[2], peak - frame[1])
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        frame = [entry, base, 0]
+        self._open.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            self._open.pop()
+            entry[1] += elapsed
+            entry[2] = max(entry[2], frame[2], peak - base, 0)
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        return {
+            'source': self.source,
+            'passes': [{'name': name, 'seconds': seconds, 'peak_bytes': peak, 'depth': depth}
+                       for name, seconds, peak, depth in self.passes],
+            'counters': dict(self.counters),
+        }
+
+    def report(self):
+        total = sum(seconds for _, seconds, _, depth in self.passes if not depth) or 1e-12
+        lines = [f"===== pass timing: {self.source} ====="]
+        lines.append(f"{'pass':<14} {'wall ms':>10} {'%':>6} {'peak KiB':>10}")
+        for name, seconds, peak, depth in self.passes:
+            label = '  ' * depth + name
+            lines.append(f"{label:<14} {seconds * 1000:>10.3f} {seconds / total:>6.1%} {peak / 1024:>10.1f}")
+        lines.append(f"{'total':<14} {total * 1000:>10.3f}")
+        width = max([22] + [len(name) for name in self.counters])
+        for name, value in self.counters.items():
+            lines.append(f"{name:<{width}} {value:>10}")
+        return '\n'.join(lines)
+
+
+class _NullStats:
+    """Stand-in used when stats are off: every call is a no-op."""
+
+    enabled = False
+
+    def time_pass(self, name):
+        return contextlib.nullcontext()
+
+    def count(self, name, value):
+        pass
+
+
+NULL_STATS = _NullStats()
+
+
+def _asciz_size(operand):
+    # .asciz "..." takes the unescaped string plus its terminating NUL
+    text = operand.strip()[1:-1]
+    return len(text.encode('latin-1', 'backslashreplace').decode('unicode_escape').encode('utf-8')) + 1
+
+
+def count_output(stats, code_generator):
+    """Add the emitted instruction count and section sizes to ``stats``."""
+    instructions = 0
+    for _, lines in code_generator.emitter.functions:
+        for line in lines:
+            text = str(line)
+            # Instructions are indented; labels and directives are not
+            if text.startswith('    ') and not text.lstrip().startswith('.'):
+                instructions += 1
+    stats.count('instructions', instructions)
+
+    sizes = {'.data': 0, '.rodata': 0, '.bss': 0}
+    section = None
+    for line in code_generator.data_section:
+        text = line.strip()
+        if text == '.data':
+            section = '.data'
+        elif text.startswith('.section'):
+            section = text.split()[1].rstrip(',')
+        elif text.startswith('.asciz') and section in sizes:
+            sizes[section] += _asciz_size(text[len('.asciz'):])
+        elif text.startswith('.space') and section in sizes:
+            sizes[section] += int(text.split()[1])
+    stats.count('data_bytes', sizes['.data'])
+    stats.count('rodata_bytes', sizes['.rodata'])
+    stats.count('bss_bytes', sizes['.bss'])
@@ -0,0 +1,52 @@
+"""Tail calls.
+
+A call whose result the function returns at once (``$r = call %f(...)``
+followed by ``ret int $r``, or any call followed by ``ret void``) needs
+nothing of the caller's frame afterwards. Such a call becomes a
+TailCallNode: codegen tears the frame down and jumps to the callee, which
+then returns straight to our caller. A function calling itself jumps back
+to just after its prologue instead, so the recursion runs as a loop.
+
+Only calls whose arguments all travel in registers qualify, since stack
+arguments would have to go over our caller's frame. A function that takes
+the address of a local keeps all of its calls, as the pointer may be
+passed on and outlive the frame.
+"""
+from ir import relink
+from parser_lexer import AddressOfNode, CallNode, FuncCallAssignNode, RetNode, TailCallNode
+
+
+def _callee(call):
+    return call.func if type(call) is CallNode else call.func_name
+
+
+def _returns_result(call, ret):
+    if type(call) not in (CallNode, FuncCallAssignNode) or type(ret) is not RetNode:
+        return False
+    if ret.ret_type == 'void':
+        return True
+    return type(call) is FuncCallAssignNode and call.var_name is not None and ret.value == f'${call.var_name}'
+
+
+def optimize_tail_calls(func, codegen, counts, options):
+    """Turn the calls of an ir.Function that end a block with the ret of their result into tail calls."""
+    if any(type(node) is AddressOfNode for node in func.nodes()):
+        return
+    name = func.header.name
+    changed = False
+    for block in func.blocks:
+        if len(block.nodes) < 2 or not _returns_result(*block.nodes[-2:]):
+            continue
+        call = block.nodes[-2]
+        if len(call.args) > len(codegen.param_regs):
+            continue
+        if _callee(call) == name:
+            func.entry_label = f'{name}.tailrec'
+            block.nodes[-2:] = [TailCallNode(call, func.entry_label)]
+            counts['loops'] += 1
+        else:
+            block.nodes[-2:] = [TailCallNode(call)]
+            counts['calls'] += 1
+        changed = True
+    if changed:
+        relink(func)
@@ -0,0 +1,191 @@
+"""Element-wise vector statements on int arrays.
+
+    $c: int[N] = vadd $a, $b;    # also vsub, vmul, vmin and vmax
+    $s: int = vsum $a;           # horizontal sum
+
+Each element of an ``int`` array is a 64-bit lane. By default the
+statements use SSE2, two lanes per xmm register; with ``-mavx2`` they use
+AVX2, four lanes per ymm register, and one xmm chunk for two of the lanes
+left over. A last odd element is done with scalar instructions.
+
+SSE2 and AVX2 have no 64-bit multiply, and SSE2 no 64-bit compare, so
+``vmul`` is built from 32-bit ``pmuludq`` products (the low 64 bits of
+a*b are lo*lo + (hi*lo + lo*hi) << 32), and SSE2's ``vmin``/``vmax`` take
+the sign of b - a, corrected for overflow, as the a > b mask.
+
+Arrays of at most UNROLL chunks are written out in full; longer ones
+loop over their chunks with rcx as the byte offset.
+"""
+
+from parser_lexer import VECTOR_BINARY_OPS
+
+VECTOR_OPS = VECTOR_BINARY_OPS + ('vsum',)
+ELEMENT_TYPES = ('int', 'int64')
+ELEMENT_SIZE = 8
+UNROLL = 4  # Chunks written out before a loop is used instead
+
+_SCALAR_OPS = {'vadd': 'add', 'vsub': 'sub', 'vmul': 'imul'}
+_CMOV = {'vmin': 'cmovg', 'vmax': 'cmovl'}
+
+
+class VectorUnit:
+    """The vector registers of one width, and how to encode instructions on them.
+
+    ``vex`` units use the three-operand AVX forms; the others the SSE2 forms,
+    which overwrite their first operand.
+    """
+
+    __slots__ = ('reg', 'size', 'vex', 'ptr')
+
+    def __init__(self, reg, size, vex):
+        self.reg = reg
+        self.size = size
+        self.vex = vex
+        self.ptr = 'YMMWORD PTR' if size == 32 else 'XMMWORD PTR'
+
+    def r(self, n):
+        return f'{self.reg}{n}'
+
+    def load(self, n, address):
+        return f'    {"v" if self.vex else ""}movdqu {self.r(n)}, {self.ptr} {address}'
+
+    def store(self, address, n):
+        return f'    {"v" if self.vex else ""}movdqu {self.ptr} {address}, {self.r(n)}'
+
+    def op(self, mnemonic, dst, left, right):
+        """``dst = left <mnemonic> right``; ``right`` is a register number or an immediate string."""
+        right = self.r(right) if isinstance(right, int) else right
+        if self.vex:
+            return [f'    v{mnemonic} {self.r(dst)}, {self.r(left)}, {right}']
+        lines = [] if dst == left else [f'    movdqa {self.r(dst)}, {self.r(left)}']
+        return lines + [f'    {mnemonic} {self.r(dst)}, {right}']
+
+    def shuffle(self, dst, src, order):
+        return f'    {"v" if self.vex else ""}pshufd {self.r(dst)}, {self.r(src)}, {order}'
+
+
+SSE2 = (VectorUnit('xmm', 16, vex=False),)
+AVX2 = (VectorUnit('ymm', 32, vex=True), VectorUnit('xmm', 16, vex=True))
+
+
+def _binary(unit, op):
+    """Lines computing ``op`` on the lanes of registers 0 and 1, and the register holding the result."""
+    if op == 'vadd':
+        return unit.op('paddq', 0, 0, 1), 0
+    if op == 'vsub':
+        return unit.op('psubq', 0, 0, 1), 0
+    if op == 'vmul':
+        return [
+            *unit.op('psrlq', 2, 0, '32'),      # hi(a)
+            *unit.op('pmuludq', 2, 2, 1),       # hi(a) * lo(b)
+            *unit.op('psrlq', 3, 1, '32'),      # hi(b)
+            *unit.op('pmuludq', 3, 3, 0),       # lo(a) * hi(b)
+            *unit.op('paddq', 2, 2, 3),
+            *unit.op('psllq', 2, 2, '32'),
+            *unit.op('pmuludq', 0, 0, 1),       # lo(a) * lo(b)
+            *unit.op('paddq', 0, 0, 2),
+        ], 0
+    if unit.vex:
+        lines = unit.op('pcmpgtq', 2, 0, 1)     # a > b
+        if op == 'vmin':
+            return lines + [f'    vpblendvb {unit.r(0)}, {unit.r(0)}, {unit.r(1)}, {unit.r(2)}'], 0
+        return lines + [f'    vpblendvb {unit.r(0)}, {unit.r(1)}, {unit.r(0)}, {unit.r(2)}'], 0
+    lines = [
+        *unit.op('psubq', 2, 1, 0),             # d = b - a
+        *unit.op('pxor', 3, 0, 1),              # a ^ b
+        *unit.op('pxor', 4, 1, 2),
+        *unit.op('pand', 4, 4, 3),              # Overflow of d
+        *unit.op('pxor', 2, 2, 4),              # Sign bit set where a > b
+        *unit.op('psrad', 2, 2, '31'),
+        unit.shuffle(2, 2, '0xF5'),             # Mask of the high dwords
+        *unit.op('pand', 3, 3, 2),              # a ^ b where a > b
+    ]
+    # a ^ (a ^ b) is b and the other way round
+    if op == 'vmin':
+        return lines + unit.op('pxor', 0, 0, 3), 0
+    return lines + unit.op('pxor', 1, 1, 3), 1
+
+
+def _chunk(unit, op, dst, left, right):
+    """Lines doing ``op`` on one register of lanes, between three addresses."""
+    if op == 'vsum':
+        return [unit.load(1, left), *unit.op('paddq', 0, 0, 1)]
+    lines, result = _binary(unit, op)
+    return [unit.load(0, left), unit.load(1, right), *lines, unit.store(dst, result)]
+
+
+def _scalar(op, dst, left, right):
+    """Lines doing ``op`` on one element; vsum adds it to rax."""
+    if op == 'vsum':
+        return [f'    add rax, QWORD PTR {left}']
+    if op in _SCALAR_OPS:
+        return [f'    mov rax, QWORD PTR {left}',
+                f'    {_SCALAR_OPS[op]} rax, QWORD PTR {right}',
+                f'    mov QWORD PTR {dst}, rax']
+    return [f'    mov rax, QWORD PTR {left}',
+            f'    mov rcx, QWORD PTR {right}',
+            '    cmp rax, rcx',
+            f'    {_CMOV[op]} rax, rcx',
+            f'    mov QWORD PTR {dst}, rax']
+
+
+def _reduce(lines, unit):
+    """Lines adding the lanes of register 0 into rax."""
+    if unit.size == 32:
+        lines += ['    vextracti128 xmm1, ymm0, 1', '    vpaddq xmm0, xmm0, xmm1']
+    v = 'v' if unit.vex else ''
+    lines += [f'    {v}pshufd xmm1, xmm0, 0x4E',
+              f'    {v}paddq xmm0, xmm0, xmm1' if unit.vex else '    paddq xmm0, xmm1',
+              f'    {v}movq rax, xmm0']
+
+
+def lower(op, count, dst, left, right, units, label):
+    """Lines doing vector ``op`` on ``count`` elements.
+
+    ``dst``, ``left`` and ``right`` are the rbp offsets of the arrays'
+    first elements (``dst`` and ``right`` are None for vsum, whose result is
+    left in rax). ``units`` are the VectorUnits to use, widest first, and
+    ``label`` names the loop, if one is needed.
+    """
+    def address(base, offset, index=''):
+        return None if base is None else f'[rbp - {base - offset}{index}]'
+
+    lines = []
+    offset = 0
+    reduced = None  # Unit whose lanes register 0 holds, for vsum
+    wide = False
+    for unit in units:
+        chunks = (count * ELEMENT_SIZE - offset) // unit.size
+        if not chunks:
+            continue
+        if op == 'vsum':
+            if reduced is None:
+                lines += unit.op('pxor', 0, 0, 0)
+            elif reduced.size != unit.size:
+                # Fold the wider lanes down before adding narrower chunks
+                lines += ['    vextracti128 xmm1, ymm0, 1', '    vpaddq xmm0, xmm0, xmm1']
+            reduced = unit
+        wide = wide or unit.size == 32
+        if chunks > UNROLL:
+            body = _chunk(unit, op, address(dst, offset, ' + rcx'), address(left, offset, ' + rcx'),
+                          address(right, offset, ' + rcx'))
+            lines += ['    xor ecx, ecx', f'{label}:', *body,
+                      f'    add rcx, {unit.size}',
+                      f'    cmp rcx, {chunks * unit.size}',
+                      f'    jb {label}']
+            offset += chunks * unit.size
+        else:
+            for _ in range(chunks):
+                lines += _chunk(unit, op, address(dst, offset), address(left, offset), address(right, offset))
+                offset += unit.size
+    if op == 'vsum':
+        if reduced is None:
+            lines.append('    xor eax, eax')
+        else:
+            _reduce(lines, reduced)
+    for element in range(offset // ELEMENT_SIZE, count):
+        lines += _scalar(op, address(dst, element * ELEMENT_SIZE), address(left, element * ELEMENT_SIZE),
+                         address(right, element * ELEMENT_SIZE))
+    if wide:
+        lines.append('    vzeroupper')  # Keep later SSE code free of the AVX transition penalty
+    return lines
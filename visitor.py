@@ -0,0 +1,100 @@
+class Dispatcher:
+    """Route each item to a handler method chosen by a key derived from the item.
+
+    Subclasses set ``prefix`` and override ``dispatch_key`` and
+    ``handler_name``. The handler for each key is looked up once per class
+    and cached, so dispatching an item costs one dict lookup however many
+    handlers there are. Items without a handler go to ``generic_visit``.
+    """
+
+    prefix = 'visit_'
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # One cache per class: a subclass may override any handler
+        cls._handlers = {}
+
+    @staticmethod
+    def dispatch_key(item):
+        return type(item)
+
+    @staticmethod
+    def handler_name(key):
+        return key.__name__
+
+    def visit(self, item):
+        key = self.dispatch_key(item)
+        try:
+            handler = self._handlers[key]
+        except KeyError:
+            handler = self._resolve(key)
+        return handler(self, item)
+
+    def visit_all(self, items):
+        """Visit every item in order; returns nothing."""
+        handlers = self._handlers
+        dispatch_key = self.dispatch_key
+        for item in items:
+            key = dispatch_key(item)
+            handler = handlers.get(key) or self._resolve(key)
+            handler(self, item)
+
+    @classmethod
+    def _resolve(cls, key):
+        handler = getattr(cls, cls.prefix + cls.handler_name(key), None)
+        if handler is None and isinstance(key, type):
+            # Fall back to a handler for a base class of the node
+            for base in key.__mro__[1:]:
+                handler = getattr(cls, cls.prefix + cls.handler_name(base), None)
+                if handler is not None:
+                    break
+        if handler is None:
+            handler = cls.generic_visit
+        cls._handlers[key] = handler
+        return handler
+
+    def generic_visit(self, item):
+        return None
+
+
+class NodeVisitor(Dispatcher):
+    """Dispatch AST nodes to ``visit_<ClassName>`` methods.
+
+    Code generation and every analysis or optimisation pass over the AST
+    subclass this. Node types without a method are ignored, unless the
+    subclass overrides ``generic_visit``.
+    """
+
+
+class NodeTransformer(NodeVisitor):
+    """A NodeVisitor whose handlers return the replacement for each node.
+
+    A handler returns a node, a list of nodes (an empty list deletes the
+    node), or None to keep the node unchanged.
+    """
+
+    def transform(self, nodes):
+        result = []
+        for node in nodes:
+            replacement = self.visit(node)
+            if replacement is None:
+                result.append(node)
+            elif isinstance(replacement, list):
+                result.extend(replacement)
+            else:
+                result.append(replacement)
+        return result
+
+
+class TokenDispatcher(Dispatcher):
+    """Dispatch lexer tokens to ``parse_<token type in lower case>`` methods."""
+
+    prefix = 'parse_'
+
+    @staticmethod
+    def dispatch_key(token):
+        return token.type
+
+    @staticmethod
+    def handler_name(key):
+        return key.lower()